@@ -0,0 +1,92 @@
+﻿from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import threading
+
+from recommendation import get_movie_recommendations
+
+global recomputation_executor, recomputation_jobs, queued_recalculations
+recomputation_executor = None
+# running (or submitted) recomputation jobs by user id; there is at most one job per user at a time
+recomputation_jobs = {}
+# scores that need to be recalculated for a user but were requested while their job was running (by user id)
+queued_recalculations = {}
+# lock for the jobs and the queued recalculations, which are accessed by the request threads and the workers
+recomputation_lock = threading.Lock()
+
+
+def get_recomputation_executor():
+	"""
+	Gets the thread pool the recomputation jobs run in and creates it if it does not exist yet. The amount of workers
+	is set by the SCORE_RECOMPUTATION_WORKERS setting (1 by default, as SQLite only allows one writer at a time).
+
+	:return: the ThreadPoolExecutor of the recomputation jobs
+	"""
+
+	global recomputation_executor
+
+	if recomputation_executor is None:
+		recomputation_executor = ThreadPoolExecutor(
+			max_workers=current_app.config.get('SCORE_RECOMPUTATION_WORKERS', 1),
+			thread_name_prefix='score-recomputation')
+
+	return recomputation_executor
+
+
+def recompute_scores(app, user_id: int, calculation_needed_for: tuple[str]):
+	"""
+	Recalculates the scores of a user for the hybrid recommendations, in the same way as when the user visits the home
+	page, in an application context of its own. If more recalculations were requested for the user while the job was
+	running, a new job is started for them afterwards.
+
+	:param app: the Flask app
+	:param user_id: id of the user
+	:param calculation_needed_for: tuple of strings relating to UserMovieRecommendationScores attributes that the values
+			need to be recalculated for
+	"""
+
+	try:
+		with app.app_context():
+			get_movie_recommendations(user_id, 4, 4.0, 48, "hybrid", calculation_needed_for=calculation_needed_for)
+	except Exception:
+		# the job runs detached from any request, so the error is only logged (the last calculated scores stay in use)
+		app.logger.exception("Recomputation of the scores of user %s failed", user_id)
+	finally:
+		# start a new job for the recalculations requested in the meantime, otherwise the user has no running job
+		# anymore
+		with recomputation_lock:
+			queued = queued_recalculations.pop(user_id, None)
+			if queued:
+				recomputation_jobs[user_id] = get_recomputation_executor().submit(recompute_scores, app, user_id,
+				                                                                  tuple(queued))
+			else:
+				recomputation_jobs.pop(user_id, None)
+
+
+def request_score_recomputation(user_id: int, calculation_needed_for: tuple[str]):
+	"""
+	Requests the recalculation of scores of a user in the background. If a job is running for the user already, the
+	recalculation is queued and done by another job once it finished, so that the jobs of a user never overlap.
+
+	:param user_id: id of the user
+	:param calculation_needed_for: tuple of strings relating to UserMovieRecommendationScores attributes that the values
+			need to be recalculated for
+	"""
+
+	with recomputation_lock:
+		if user_id in recomputation_jobs:
+			queued_recalculations.setdefault(user_id, set()).update(calculation_needed_for)
+		else:
+			recomputation_jobs[user_id] = get_recomputation_executor().submit(
+				recompute_scores, current_app._get_current_object(), user_id, tuple(calculation_needed_for))
+
+
+def check_whether_recomputation_is_running(user_id: int):
+	"""
+	Checks whether scores of a user are being recalculated in the background.
+
+	:param user_id: id of the user
+	:return: True if a job is running (or submitted) for the user, False otherwise
+	"""
+
+	with recomputation_lock:
+		return user_id in recomputation_jobs
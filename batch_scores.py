@@ -0,0 +1,110 @@
+﻿from concurrent.futures import ProcessPoolExecutor, as_completed
+import calendar
+import click
+import multiprocessing
+import time
+
+from models import db, User, ScoreBatchRun, ScoreBatchProgress
+from preparation import initialize_user_movie_scores
+from rating_matrix import get_rating_matrix
+from recommendation import get_movie_recommendations
+from similarity import build_user_neighbour_index
+
+global batch_app
+batch_app = None
+
+
+def initialize_worker():
+	"""
+	Initializes a worker process of the batch job. The worker gets its own database connections instead of using the
+	ones inherited from the parent process.
+	"""
+
+	with batch_app.app_context():
+		db.engine.dispose(close=False)
+
+
+def compute_scores_for_users(run_id: int, user_ids: list[int]):
+	"""
+	Computes the neighbours and all scores in UserMovieRecommendationScores for each of the given users, in the same
+	way as when the user visits the home page, and marks them as completed for the batch run.
+
+	:param run_id: id of the batch run
+	:param user_ids: ids of the users
+	:return: amount of users the scores were computed for
+	"""
+
+	for user_id in user_ids:
+		# work in an application context of its own for each user, so that the session does not grow over the chunk
+		with batch_app.app_context():
+			user = db.session.get(User, user_id)
+			# initialize the movie scores if not done for the user already
+			if not user.initialized_scores:
+				initialize_user_movie_scores(user_id)
+				setattr(user, 'initialized_scores', True)
+				db.session.commit()
+			# recalculate all scores with the same parameters as the home page; the item-collaborative scores are not
+			# part of the hybrid scores, so they are requested separately (and calculated as they are still pending)
+			get_movie_recommendations(user_id, 4, 4.0, 48, "hybrid")
+			get_movie_recommendations(user_id, 4, 4.0, 48, "item-collaborative", calculation_needed_for=())
+
+			db.session.add(ScoreBatchProgress(run_id=run_id, user_id=user_id,
+			                                  time_completed=calendar.timegm(time.gmtime())))
+			db.session.commit()
+
+	return len(user_ids)
+
+
+def compute_scores_for_all_users(app, amount_of_workers: int = None, chunk_size: int = 20, resume: bool = False):
+	"""
+	Computes the neighbours and all scores for every active user in a pool of worker processes, so that the
+	recommendations are up-to-date without the users having to wait for them on their next visit. The users are split
+	into chunks of chunk_size users that are distributed over the workers. The progress of the run is saved for each
+	user, so that an interrupted run can be resumed without computing the completed users again.
+
+	:param app: the Flask app
+	:param amount_of_workers: amount of worker processes (None = amount of CPUs)
+	:param chunk_size: amount of users per chunk
+	:param resume: whether the last run should be resumed if it was not finished
+	:return: amount of users the scores were computed for
+	"""
+
+	global batch_app
+	batch_app = app
+
+	# get the last run if it should be resumed and was not finished, otherwise start a new one
+	run = ScoreBatchRun.query.order_by(ScoreBatchRun.id.desc()).first() if resume else None
+	if run is None or run.time_finished is not None:
+		run = ScoreBatchRun(time_started=calendar.timegm(time.gmtime()))
+		db.session.add(run)
+		db.session.commit()
+
+	# get the active users that were not completed in the run yet
+	completed = db.session.query(ScoreBatchProgress.user_id).filter(ScoreBatchProgress.run_id == run.id)
+	user_ids = [u.id for u in db.session.query(User.id).filter(User.active.is_(True), User.id.not_in(completed))
+	            .order_by(User.id).all()]
+	chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+	click.echo("Computing scores for %d users in run %d" % (len(user_ids), run.id))
+
+	# build the shared rating matrix and the user neighbour index before the workers are forked, so that they do not
+	# each need to build them, and close the database connections so that they are not shared with the workers
+	get_rating_matrix()
+	build_user_neighbour_index()
+	run_id = run.id
+	db.session.remove()
+	db.engine.dispose()
+
+	amount_of_completed_users = 0
+	with ProcessPoolExecutor(max_workers=amount_of_workers, mp_context=multiprocessing.get_context('fork'),
+	                         initializer=initialize_worker) as executor:
+		futures = [executor.submit(compute_scores_for_users, run_id, chunk) for chunk in chunks]
+		for future in as_completed(futures):
+			amount_of_completed_users += future.result()
+			click.echo("Completed %d of %d users" % (amount_of_completed_users, len(user_ids)))
+
+	# mark the run as finished
+	run = db.session.get(ScoreBatchRun, run_id)
+	run.time_finished = calendar.timegm(time.gmtime())
+	db.session.commit()
+
+	return amount_of_completed_users
@@ -2,10 +2,12 @@
 from sqlalchemy import case
 import math
 
-from models import MovieRating, UserMovieRecommendationScores, Movie, MovieGenre, UserGenrePreferences, db, \
-	MovieWatchList, UserDecadePreferences, User
+from models import MovieRating, Movie, MovieGenre, UserGenrePreferences, db, MovieWatchList, UserDecadePreferences, \
+	User
+from score_storage import get_top_movie_ids
 
-global all_movie_ids, all_user_ids, all_movie_ids_rated
+global all_movie_ids, all_user_ids, all_movie_ids_rated, popularity_ranking
+popularity_ranking = None
 
 
 def get_all_movies_and_users_ids():
@@ -61,6 +63,71 @@ def get_all_movie_genres():
 	return genres
 
 
+def build_popularity_ranking():
+	"""
+	Builds the global popularity ranking, i.e. the ids and average ratings of all rated movies sorted by their amount of
+	ratings in a descending order (ties in the order of the movie ids), with a single query.
+
+	:return: popularity_ranking - list of (movie id, average rating) tuples of the rated movies ordered by popularity
+	"""
+
+	global popularity_ranking
+
+	# print("build popularity ranking")
+	movies = (db.session.query(Movie.id, Movie.average_rating).filter(Movie.amount_of_ratings > 0)
+	          .order_by(Movie.amount_of_ratings.desc(), Movie.id).all())
+	ranking = [(m.id, m.average_rating) for m in movies]
+	popularity_ranking = ranking
+	# print("done (popularity ranking)")
+
+	return ranking
+
+
+def invalidate_popularity_ranking():
+	"""
+	Invalidates the global popularity ranking, so that it is rebuilt the next time it is needed. Needs to be called
+	whenever the amounts of ratings or the average ratings of the movies change.
+	"""
+
+	global popularity_ranking
+	popularity_ranking = None
+
+
+def get_most_popular_movie_ids(user_id: int, amount_of_results: int, consider_ratings: bool = True):
+	"""
+	Gets the ids of the most popular movies the user did not rate yet based on the amount of ratings of the movies. If
+	consider_ratings is True, the average movie ratings are considered as well.
+
+	:param user_id: id of the user
+	:param amount_of_results: amount of results that should be returned
+	:param consider_ratings: determines whether the average movie ratings should be included
+	:return: most_popular_movie_ids - list of the ids of the most rated movies (with an average rating of at least 4.0
+			if consider_ratings is True)
+	"""
+
+	# keep a local reference, as the global ranking can be invalidated by another request in the meantime
+	ranking = popularity_ranking or build_popularity_ranking()
+
+	# get a set of the ids of all movies the user rated, excluding those they ignored
+	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == user_id,
+	                                                MovieRating.ignored == 0).all()
+	movies_already_rated_ids = {m.movie_id for m in movies_already_rated}
+
+	# go through the ranking until enough movies were found, skipping the movies the user rated and (if the
+	# average ratings should be considered) those with an average rating below 4.0
+	most_popular_movie_ids = []
+	for movie_id, average_rating in ranking:
+		if len(most_popular_movie_ids) >= amount_of_results:
+			break
+		if movie_id in movies_already_rated_ids:
+			continue
+		if consider_ratings and (average_rating is None or average_rating < 4.0):
+			continue
+		most_popular_movie_ids.append(movie_id)
+
+	return most_popular_movie_ids
+
+
 def get_most_popular_movies(amount_of_results: int, consider_ratings: bool = True):
 	"""
 	Gets the most popular movies based on the amount of ratings of the movies. If consider_ratings is True, the average
@@ -73,27 +140,18 @@ def get_most_popular_movies(amount_of_results: int, consider_ratings: bool = Tru
 			an average rating of at least 4.0
 	"""
 
-	# get a list of the ids of all movies the current user rated, excluding those they ignored
-	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == current_user.id,
-	                                                MovieRating.ignored == 0).all()
-	movies_already_rated_ids = [m.movie_id for m in movies_already_rated]
 	# print("get most rated movies")
-	most_rated_movies = db.session.query(Movie).join(MovieRating).filter(
-		MovieRating.movie_id.not_in(movies_already_rated_ids) if movies_already_rated else True,
-		MovieRating.ignored == 0).order_by(Movie.amount_of_ratings.desc()).distinct().all()
-	# print("most rated movies:", most_rated_movies)
-
-	# if the average ratings should not be considered, return the first amount_of_results results of the most rated
-	# movies
-	if consider_ratings is False:
-		return most_rated_movies[:amount_of_results]
+	most_popular_movie_ids = get_most_popular_movie_ids(current_user.id, amount_of_results, consider_ratings)
+	if not most_popular_movie_ids:
+		return []
 
-	# print("filter for liked movies")
-	# extract all movies with an average rating of at least 4.0 from the most rated movies
-	most_rated_popular_movies = [movie for movie in most_rated_movies if
-	                             Movie.query.filter(Movie.id == movie.id).first().average_rating >= 4.0]
+	# get the corresponding Movie objects in the order of the ranking with a single query
+	id_ordering = case(
+		{_id: index for index, _id in enumerate(most_popular_movie_ids)},
+		value=Movie.id
+		)
 
-	return most_rated_popular_movies[:amount_of_results]
+	return Movie.query.filter(Movie.id.in_(most_popular_movie_ids)).order_by(id_ordering).all()
 
 
 def get_all_rated_movies_by_current_user():
@@ -173,10 +231,7 @@ def get_genre_and_decade_filtered_recommendations(genre_filter: str, decade_filt
 
 	# get a list of all movie ids sorted by their total recommendation score in a descending manner to be able to
 	# sort the filtered movies accordingly
-	recommended_movies = UserMovieRecommendationScores.query.filter(
-		UserMovieRecommendationScores.user_id == current_user.id).order_by(
-		UserMovieRecommendationScores.total_recommendation_score.desc()).all()
-	recommended_movies_ids = [m.movie_id for m in recommended_movies]
+	recommended_movies_ids = get_top_movie_ids(current_user.id, 'total_recommendation_score')
 	id_ordering = case(
 		{_id: index for index, _id in enumerate(recommended_movies_ids)},
 		value=Movie.id
@@ -244,19 +299,20 @@ def get_ignored_movies():
 	return ignored_movies if ignored_movies else []
 
 
-def get_survey_preferences():
+def get_survey_preferences(user_id: int):
 	"""
-	Gets the preferences of the current user as selected in the preference survey.
+	Gets the preferences of the user as selected in the preference survey.
 
+	:param user_id: id of the user
 	:return: liked genres - list of all genres the user selected as liked,
 			disliked_genres - list of all genres the user selected as disliked
 	"""
 
 	# get the preferences by filtering the database with the survey_response attribute
-	liked_genres = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == current_user.id,
+	liked_genres = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == user_id,
 	                                                 UserGenrePreferences.survey_response == 1).all()
 	liked_genres = [liked.genre for liked in liked_genres]
-	disliked_genres = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == current_user.id,
+	disliked_genres = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == user_id,
 	                                                    UserGenrePreferences.survey_response == 0).all()
 	disliked_genres = [disliked.genre for disliked in disliked_genres]
 
@@ -273,7 +329,7 @@ def get_user_preferences_from_database(min_ratio: float):
 	"""
 
 	# get the genre and decade ratios with minimum amount of ratings 4
-	genre_ratios, decade_ratios = get_user_preference_ratios(4)
+	genre_ratios, decade_ratios = get_user_preference_ratios(current_user.id, 4)
 	extracted_liked_genres = []
 	extracted_disliked_genres = []
 	# go through all genres
@@ -298,10 +354,11 @@ def get_user_preferences_from_database(min_ratio: float):
 	return extracted_liked_genres, extracted_disliked_genres, extracted_liked_decades, extracted_disliked_decades
 
 
-def get_user_preference_ratios(min_amount_of_ratings: int):
+def get_user_preference_ratios(user_id: int, min_amount_of_ratings: int):
 	"""
-	Gets the preferences of the current user as saved in UserGenrePreferences and UserDecadePreferences.
+	Gets the preferences of the user as saved in UserGenrePreferences and UserDecadePreferences.
 
+	:param user_id: id of the user
 	:param min_amount_of_ratings: amount of ratings needed for a genre/decade so that the saved preferences are
 			considered as preferences
 	:return: genre_rating_ratios - dictionary with genres as keys and a list of the corresponding liked and disliked
@@ -314,13 +371,13 @@ def get_user_preference_ratios(min_amount_of_ratings: int):
 	# go through all genres in the database
 	for genre in get_all_movie_genres():
 		if genre is not None:
-			# get the UserGenrePreference entry for the genre corresponding to the current user
-			row = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == current_user.id,
+			# get the UserGenrePreference entry for the genre corresponding to the user
+			row = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == user_id,
 			                                        UserGenrePreferences.genre == genre).first()
-			# if no entry exists (which could be the case if the current user did not submit the preference survey and
+			# if no entry exists (which could be the case if the user did not submit the preference survey and
 			# did not rate a movie yet), add a new entry and set the genre ratios to 0.0
 			if not row:
-				new_genre_preference = UserGenrePreferences(user_id=current_user.id, genre=genre,
+				new_genre_preference = UserGenrePreferences(user_id=user_id, genre=genre,
 				                                            survey_response=math.nan, amount_of_ratings=0,
 				                                            amount_of_likes=0, amount_of_dislikes=0)
 				db.session.add(new_genre_preference)
@@ -341,13 +398,13 @@ def get_user_preference_ratios(min_amount_of_ratings: int):
 	decade_rating_ratios = {}
 	# go through all decades from the 1900's to the 2020's
 	for decade in range(1900, 2030, 10):
-		# get the UserDecadePreference entry for the decade corresponding to the current user
-		row = UserDecadePreferences.query.filter(UserDecadePreferences.user_id == current_user.id,
+		# get the UserDecadePreference entry for the decade corresponding to the user
+		row = UserDecadePreferences.query.filter(UserDecadePreferences.user_id == user_id,
 		                                         UserDecadePreferences.decade == decade).first()
-		# if no entry exists (which could be the case if the current user did not submit the preference survey and
+		# if no entry exists (which could be the case if the user did not submit the preference survey and
 		# did not rate a movie yet), add a new entry and set the decade ratios to 0.0
 		if not row:
-			new_decade_preference = UserDecadePreferences(user_id=current_user.id, decade=decade, amount_of_ratings=0,
+			new_decade_preference = UserDecadePreferences(user_id=user_id, decade=decade, amount_of_ratings=0,
 			                                              amount_of_likes=0, amount_of_dislikes=0)
 			db.session.add(new_decade_preference)
 			db.session.commit()
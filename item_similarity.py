@@ -0,0 +1,139 @@
+﻿from flask import current_app
+from scipy.sparse import csc_matrix
+import numpy
+import os
+
+from rating_matrix import get_rating_matrix, get_user_ratings, get_movie_ids
+from similarity import get_centered_ratings
+
+global neighbour_columns, neighbour_similarities, index_movie_ids, index_movie_index, time_index_file_modified
+neighbour_columns = None
+neighbour_similarities = None
+index_movie_ids = None
+index_movie_index = None
+time_index_file_modified = None
+
+# name of the file in the instance folder the item neighbour index is saved to
+index_file_name = 'item_neighbours.npz'
+
+
+def get_index_file_path():
+	"""
+	Gets the path of the file the item neighbour index is saved to.
+
+	:return: path of the index file in the instance folder of the app
+	"""
+
+	return os.path.join(current_app.instance_path, index_file_name)
+
+
+def build_item_neighbour_index(amount_of_neighbours: int = 50, shrinkage: float = 10.0, block_size: int = 500):
+	"""
+	Builds the item neighbour index, i.e. the amount_of_neighbours most similar movies of every movie by the adjusted
+	cosine similarity on the shared rating matrix, and saves it to the instance folder. The ratings are centered by the
+	mean rating of the respective user, and the similarities are shrunk towards 0 for movies that only a few users rated
+	both of (similarity * co-raters / (co-raters + shrinkage)). The similarities are calculated for blocks of block_size
+	movies at a time, so that the full movie-movie matrix never needs to be held in memory.
+
+	:param amount_of_neighbours: amount of neighbours that are saved for each movie
+	:param shrinkage: amount of co-raters at which the similarity is shrunk by half
+	:param block_size: amount of movies the similarities are calculated for at once
+	:return: path of the saved index file
+	"""
+
+	# print("build item neighbour index")
+	matrix, _, _ = get_rating_matrix()
+	matrix = matrix.copy()
+	matrix.eliminate_zeros()
+
+	# center the ratings by the user means and normalize the columns (movies) to unit length
+	centered = csc_matrix(get_centered_ratings(matrix))
+	norms = numpy.sqrt(numpy.asarray(centered.multiply(centered).sum(axis=0)).ravel())
+	centered = csc_matrix(centered.multiply(1.0 / numpy.where(norms > 0, norms, 1.0)))
+	rated = csc_matrix(matrix != 0, dtype=numpy.float64)
+
+	amount_of_movies = matrix.shape[1]
+	amount_of_neighbours = max(0, min(amount_of_neighbours, amount_of_movies - 1))
+	columns = numpy.zeros((amount_of_movies, amount_of_neighbours), dtype=numpy.int32)
+	similarities = numpy.zeros((amount_of_movies, amount_of_neighbours), dtype=numpy.float32)
+
+	for start in range(0, amount_of_movies, block_size):
+		block = numpy.arange(start, min(start + block_size, amount_of_movies))
+		# calculate the similarities of the movies of the block to all movies and shrink them by the amount of co-raters
+		block_similarities = (centered[:, block].T @ centered).toarray()
+		co_raters = (rated[:, block].T @ rated).toarray()
+		block_similarities *= co_raters / (co_raters + shrinkage)
+		# a movie is not its own neighbour
+		block_similarities[numpy.arange(len(block)), block] = 0.0
+
+		# get the most similar movies of each movie of the block sorted by the similarity (and the column for ties)
+		candidates = numpy.argpartition(-block_similarities, amount_of_neighbours - 1, axis=1)[:, :amount_of_neighbours]
+		for row, movie_column in enumerate(block):
+			candidate_similarities = block_similarities[row, candidates[row]]
+			order = numpy.lexsort((candidates[row], -candidate_similarities))
+			columns[movie_column] = candidates[row][order]
+			similarities[movie_column] = candidate_similarities[order]
+
+	# only keep neighbours with a positive similarity (the others are marked with a similarity of 0)
+	similarities[similarities < 0] = 0.0
+
+	path = get_index_file_path()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	numpy.savez(path, neighbour_columns=columns, neighbour_similarities=similarities, movie_ids=get_movie_ids())
+	# print("done (item neighbour index)")
+
+	return path
+
+
+def load_item_neighbour_index():
+	"""
+	Loads the item neighbour index from the instance folder if it was not loaded yet or if the file changed since (e.g.
+	because the index was rebuilt by another process).
+
+	:return: True if an index is available, False if it was not built yet
+	"""
+
+	global neighbour_columns, neighbour_similarities, index_movie_ids, index_movie_index, time_index_file_modified
+
+	path = get_index_file_path()
+	if not os.path.exists(path):
+		return False
+	time_modified = os.path.getmtime(path)
+	if neighbour_columns is None or time_modified != time_index_file_modified:
+		with numpy.load(path) as index:
+			neighbour_columns = index['neighbour_columns']
+			neighbour_similarities = index['neighbour_similarities']
+			index_movie_ids = index['movie_ids']
+		index_movie_index = {movie_id: row for row, movie_id in enumerate(index_movie_ids.tolist())}
+		time_index_file_modified = time_modified
+
+	return True
+
+
+def predict_item_collaborative_scores(user_id: int, min_rating: float):
+	"""
+	Calculates the item-collaborative scores of all movies of the index for a user by summing up the similarities of
+	each movie to the movies the user liked, only considering the neighbours in the index (so that only
+	amount of liked movies * amount of neighbours similarities need to be read). The sums are scaled by the highest
+	sum, so that the scores are between 0.0 and 1.0.
+
+	:param user_id: id of the user
+	:param min_rating: minimum rating needed so that a movie is deemed as liked
+	:return: movie_ids - array of the ids of the movies of the index,
+			scores - array of the corresponding scores
+	"""
+
+	user_columns, user_values = get_user_ratings(user_id)
+
+	# get the rows of the liked movies in the index
+	liked_movie_ids = get_movie_ids()[user_columns[user_values >= min_rating]].tolist()
+	rows = numpy.array([index_movie_index[movie_id] for movie_id in liked_movie_ids if movie_id in index_movie_index],
+	                   dtype=int)
+
+	# sum up the similarities of the neighbours of the liked movies
+	scores = numpy.bincount(neighbour_columns[rows].ravel(), weights=neighbour_similarities[rows].ravel(),
+	                        minlength=len(index_movie_ids))
+	if scores.max(initial=0.0) > 0:
+		scores /= scores.max()
+
+	return index_movie_ids, scores
@@ -0,0 +1,183 @@
+﻿from flask import current_app
+from scipy.sparse import csr_matrix
+import numpy
+import os
+
+from rating_matrix import get_rating_matrix, get_user_ratings, get_movie_ids
+
+global item_factors, item_biases, model_movie_ids, model_movie_index, global_mean, regularization, bias_damping, \
+	time_model_file_modified
+item_factors = None
+item_biases = None
+model_movie_ids = None
+model_movie_index = None
+global_mean = None
+regularization = None
+bias_damping = None
+time_model_file_modified = None
+
+# name of the file in the instance folder the latent factor model is saved to
+model_file_name = 'latent_factors.npz'
+
+
+def get_model_file_path():
+	"""
+	Gets the path of the file the latent factor model is saved to.
+
+	:return: path of the model file in the instance folder of the app
+	"""
+
+	return os.path.join(current_app.instance_path, model_file_name)
+
+
+def solve_least_squares(factors: numpy.ndarray, ratings: numpy.ndarray, regularization_weight: float):
+	"""
+	Solves the regularized least squares problem for the latent factors of a single user or movie given the factors of
+	the movies they rated (or the users who rated them) and the corresponding ratings.
+
+	:param factors: array of the factors of the rated movies (or of the users who rated the movie)
+	:param ratings: array of the corresponding ratings minus the global mean and the biases
+	:param regularization_weight: weight of the regularization
+	:return: vector of the latent factors
+	"""
+
+	amount_of_factors = factors.shape[1]
+	if len(ratings) == 0:
+		return numpy.zeros(amount_of_factors)
+	gram = factors.T @ factors + regularization_weight * numpy.eye(amount_of_factors)
+
+	return numpy.linalg.solve(gram, factors.T @ ratings)
+
+
+def train_latent_factor_model(amount_of_factors: int = 32, regularization_weight: float = 20.0,
+                              bias_damping_weight: float = 10.0, amount_of_iterations: int = 10):
+	"""
+	Trains a latent factor model on the shared rating matrix and saves the movie factors and biases to the instance
+	folder. The ratings are first explained by the global mean rating and damped movie and user biases (so that movies
+	with only a few ratings do not get extreme predictions), the remaining residuals are factorized with alternating
+	least squares. The user factors and biases are not saved, as they are calculated from the current ratings of a user
+	when needed (see fold_in_user).
+
+	:param amount_of_factors: amount of latent factors
+	:param regularization_weight: weight of the regularization of the factors
+	:param bias_damping_weight: amount of ratings of the global mean that the biases are damped with
+	:param amount_of_iterations: amount of alternating iterations
+	:return: path of the saved model file
+	"""
+
+	# print("train latent factor model")
+	matrix, _, _ = get_rating_matrix()
+	matrix = matrix.copy()
+	matrix.eliminate_zeros()
+	matrix_by_movie = matrix.tocsc()
+	mean = matrix.data.mean() if matrix.nnz else 0.0
+
+	# calculate the damped movie biases and then the damped user biases
+	entry_columns = numpy.repeat(numpy.arange(matrix.shape[1]), numpy.diff(matrix_by_movie.indptr))
+	movie_biases = (numpy.bincount(entry_columns, weights=matrix_by_movie.data - mean, minlength=matrix.shape[1]) /
+	                (numpy.diff(matrix_by_movie.indptr) + bias_damping_weight))
+	entry_rows = numpy.repeat(numpy.arange(matrix.shape[0]), numpy.diff(matrix.indptr))
+	residuals = matrix.data - mean - movie_biases[matrix.indices]
+	user_biases = (numpy.bincount(entry_rows, weights=residuals, minlength=matrix.shape[0]) /
+	               (numpy.diff(matrix.indptr) + bias_damping_weight))
+
+	# get the residuals that are left after the biases in both formats
+	residuals = csr_matrix((residuals - user_biases[entry_rows], matrix.indices, matrix.indptr), shape=matrix.shape)
+	residuals_by_movie = residuals.tocsc()
+
+	# initialize the factors randomly
+	random = numpy.random.default_rng(0)
+	user_factors = numpy.zeros((matrix.shape[0], amount_of_factors))
+	movie_factors = random.normal(scale=0.1, size=(matrix.shape[1], amount_of_factors))
+
+	for _ in range(amount_of_iterations):
+		# fix the movie factors and solve for the factors of each user
+		for row in range(matrix.shape[0]):
+			start, end = residuals.indptr[row], residuals.indptr[row + 1]
+			user_factors[row] = solve_least_squares(movie_factors[residuals.indices[start:end]],
+			                                        residuals.data[start:end], regularization_weight)
+		# fix the user factors and solve for the factors of each movie
+		for column in range(matrix.shape[1]):
+			start, end = residuals_by_movie.indptr[column], residuals_by_movie.indptr[column + 1]
+			movie_factors[column] = solve_least_squares(user_factors[residuals_by_movie.indices[start:end]],
+			                                            residuals_by_movie.data[start:end], regularization_weight)
+
+	# save the movie factors and biases together with the ids of the movies they correspond to
+	path = get_model_file_path()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	numpy.savez(path, item_factors=movie_factors, item_biases=movie_biases, movie_ids=get_movie_ids(),
+	            global_mean=mean, regularization=regularization_weight, bias_damping=bias_damping_weight)
+	# print("done (latent factor model)")
+
+	return path
+
+
+def load_latent_factor_model():
+	"""
+	Loads the latent factor model from the instance folder if it was not loaded yet or if the file changed since (e.g.
+	because the model was retrained by another process).
+
+	:return: True if a model is available, False if it was not trained yet
+	"""
+
+	global item_factors, item_biases, model_movie_ids, model_movie_index, global_mean, regularization, bias_damping, \
+		time_model_file_modified
+
+	path = get_model_file_path()
+	if not os.path.exists(path):
+		return False
+	time_modified = os.path.getmtime(path)
+	if item_factors is None or time_modified != time_model_file_modified:
+		with numpy.load(path) as model:
+			item_factors = model['item_factors']
+			item_biases = model['item_biases']
+			model_movie_ids = model['movie_ids']
+			global_mean = float(model['global_mean'])
+			regularization = float(model['regularization'])
+			bias_damping = float(model['bias_damping'])
+		model_movie_index = {movie_id: row for row, movie_id in enumerate(model_movie_ids.tolist())}
+		time_model_file_modified = time_modified
+
+	return True
+
+
+def fold_in_user(user_id: int):
+	"""
+	Calculates the bias and the latent factors of a user from their current ratings and the fixed movie factors and
+	biases of the model, so that new users and new ratings are taken into account without retraining the model.
+
+	:param user_id: id of the user
+	:return: user_bias - bias of the user,
+			user_vector - vector of the latent factors of the user
+	"""
+
+	user_columns, user_values = get_user_ratings(user_id)
+
+	# only consider the ratings of movies that are part of the model
+	rated_movie_ids = get_movie_ids()[user_columns].tolist()
+	known = numpy.array([movie_id in model_movie_index for movie_id in rated_movie_ids], dtype=bool)
+	rows = numpy.array([model_movie_index[movie_id] for movie_id in rated_movie_ids if movie_id in model_movie_index],
+	                   dtype=int)
+
+	# calculate the damped user bias and the factors that explain the remaining residuals
+	residuals = user_values[known] - global_mean - item_biases[rows]
+	user_bias = residuals.sum() / (len(residuals) + bias_damping)
+	user_vector = solve_least_squares(item_factors[rows], residuals - user_bias, regularization)
+
+	return user_bias, user_vector
+
+
+def predict_ratings(user_id: int):
+	"""
+	Predicts the ratings of all movies of the model for a user with a single product of the user's latent factors and
+	the movie factors.
+
+	:param user_id: id of the user
+	:return: movie_ids - array of the ids of the movies of the model,
+			predictions - array of the corresponding predicted ratings
+	"""
+
+	user_bias, user_vector = fold_in_user(user_id)
+	predictions = item_factors @ user_vector + item_biases + user_bias + global_mean
+
+	return model_movie_ids, predictions
@@ -28,6 +28,8 @@ class User(db.Model, UserMixin):
     tags = db.relationship('Tags', backref='user', lazy=True)
     watchlist = db.relationship('MovieWatchList', backref='user', lazy=True)
     movie_score = db.relationship('UserMovieRecommendationScores', backref='user', lazy=True)
+    neighbours = db.relationship('UserNeighbours', backref='user', lazy=True)
+    score_vectors = db.relationship('UserScoreVector', backref='user', lazy=True)
 
 
 class UserGenrePreferences(db.Model):
@@ -53,20 +55,66 @@ class UserDecadePreferences(db.Model):
 
 class UserMovieRecommendationScores(db.Model):
     __tablename__ = 'user_movie_scores'
+    __table_args__ = (db.UniqueConstraint("user_id", "movie_id"),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), nullable=False)
     survey_based_score = db.Column(db.Float, nullable=False, server_default='')
     user_based_score = db.Column(db.Float, nullable=False, server_default='')
     item_based_score = db.Column(db.Float, nullable=False, server_default='')
+    item_collaborative_score = db.Column(db.Float, nullable=False, server_default='0')
+    tag_based_score = db.Column(db.Float, nullable=False, server_default='0')
     exploration_based_score = db.Column(db.Float, nullable=False, server_default='')
     total_recommendation_score = db.Column(db.Float, nullable=False, server_default='')
 
 
+class UserScoreVector(db.Model):
+    __tablename__ = 'user_score_vectors'
+    __table_args__ = (db.UniqueConstraint("user_id", "score_name"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    score_name = db.Column(db.String(50), nullable=False)  # name of the score attribute, e.g. 'user_based_score'
+    scores = db.Column(db.LargeBinary, nullable=False)  # float32 array of the scores of all movies ordered by id
+    amount_of_movies = db.Column(db.Integer, nullable=False)  # length of the array
+
+
+class UserNeighbours(db.Model):
+    __tablename__ = 'user_neighbours'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
+    neighbour_ids = db.Column(db.JSON, nullable=False)  # ids of the neighbours ordered by the distance
+    distances = db.Column(db.JSON, nullable=False)  # distances of the neighbours to the user
+    metric = db.Column(db.String(50), nullable=True)  # similarity metric
+    max_distance = db.Column(db.Float, nullable=True)
+    amount_of_neighbours = db.Column(db.Integer, nullable=True)
+    version = db.Column(db.Integer, nullable=False, server_default='0')  # incremented with each calculation
+    amount_of_ratings = db.Column(db.Integer, nullable=False, server_default='0')  # at the time of the calculation
+    amount_of_rating_changes = db.Column(db.Integer, nullable=False, server_default='0')  # since the calculation
+    time_calculated = db.Column(db.Integer)
+
+
+class ScoreBatchRun(db.Model):
+    __tablename__ = 'score_batch_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    time_started = db.Column(db.Integer)
+    time_finished = db.Column(db.Integer, nullable=True)  # None while the run is not finished
+    progress = db.relationship('ScoreBatchProgress', backref='run', lazy=True)
+
+
+class ScoreBatchProgress(db.Model):
+    __tablename__ = 'score_batch_progress'
+    __table_args__ = (db.UniqueConstraint("run_id", "user_id"),)
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('score_batch_runs.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    time_completed = db.Column(db.Integer)
+
+
 class Movie(db.Model):
     __tablename__ = 'movies'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100, collation='NOCASE'), nullable=False, unique=True)
+    search_title = db.Column(db.String(100), nullable=True, index=True)  # title without release year, preprocessed
     release_year = db.Column(db.Integer, nullable=True)
     amount_of_ratings = db.Column(db.Integer, nullable=True)
     average_rating = db.Column(db.Float, nullable=True)
@@ -121,4 +169,5 @@ class Tags(db.Model):
     movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     tag = db.Column(db.String(255), nullable=False, server_default='')
+    search_tag = db.Column(db.String(255), nullable=True, index=True)  # preprocessed tag
     timestamp = db.Column(db.Integer)
@@ -0,0 +1,180 @@
+﻿from scipy.sparse import csr_matrix
+import numpy
+import threading
+
+from models import db, Movie, MovieGenre
+
+global feature_movie_ids, feature_movie_index, genre_names, genre_index, movie_genre_matrix, movie_genre_counts, \
+	movie_missing_genre, movie_decades, genre_movie_index
+feature_movie_ids = None
+feature_movie_index = None
+genre_names = None
+genre_index = None
+movie_genre_matrix = None
+movie_genre_counts = None
+movie_missing_genre = None
+movie_decades = None
+genre_movie_index = None
+# lock for building and reading the movie features, which are shared by the request threads, the scorer threads and the
+# background workers (reentrant, as the features are built while holding it)
+movie_features_lock = threading.RLock()
+
+
+def build_movie_features():
+	"""
+	Builds the shared movie features, i.e. the genres and the decades of all movies, with two queries. The movies are
+	ordered by their ids, so that the features can be used as arrays over all movies. The features are built in local
+	variables and published together under movie_features_lock, so that other threads never see a part of them only.
+	"""
+
+	global feature_movie_ids, feature_movie_index, genre_names, genre_index, movie_genre_matrix, movie_genre_counts, \
+		movie_missing_genre, movie_decades, genre_movie_index
+
+	with movie_features_lock:
+		# print("build movie features")
+		# get the ids and release years of all movies
+		movies = db.session.query(Movie.id, Movie.release_year).order_by(Movie.id).all()
+		movie_ids = numpy.array([m.id for m in movies])
+		movie_index = {movie_id: index for index, movie_id in enumerate(movie_ids.tolist())}
+
+		# get the decade of each movie (NaN if the release year is missing)
+		decades = numpy.array([numpy.nan if m.release_year is None else (m.release_year // 10) * 10
+		                        for m in movies])
+
+		# get the genres of all movies in the order in which they were saved
+		movie_genres = db.session.query(MovieGenre.movie_id, MovieGenre.genre).order_by(MovieGenre.id).all()
+		names = sorted({g.genre for g in movie_genres if g.genre is not None})
+		index_of_genre = {genre: index for index, genre in enumerate(names)}
+
+		# build the one-hot genre matrix with the movies as rows and the genres as columns, keeping the saved order of
+		# the genres of each movie in the rows, and note the movies that have a missing genre (None)
+		genres_per_movie = [[] for _ in movies]
+		missing_genre = numpy.zeros(len(movies), dtype=bool)
+		for g in movie_genres:
+			if g.movie_id not in movie_index:
+				continue
+			index = movie_index[g.movie_id]
+			if g.genre is None:
+				missing_genre[index] = True
+			else:
+				genres_per_movie[index].append(index_of_genre[g.genre])
+		genre_counts = numpy.array([len(genres) for genres in genres_per_movie])
+		indptr = numpy.concatenate(([0], numpy.cumsum(genre_counts)))
+		indices = numpy.array([genre for genres in genres_per_movie for genre in genres], dtype=numpy.int32)
+		genre_matrix = csr_matrix((numpy.ones(len(indices)), indices, indptr), shape=(len(movies), len(names)))
+		# count the missing genres as genres of the movie as well (like get_movie_genres does)
+		genre_counts = genre_counts + missing_genre
+
+		# build the inverted index with the movies of each genre (the columns of the genre matrix)
+		movies_of_genres = genre_matrix.tocsc()
+
+		# publish the features, with the ids last, as they tell whether the features were built
+		feature_movie_index = movie_index
+		genre_names = names
+		genre_index = index_of_genre
+		movie_genre_matrix = genre_matrix
+		movie_genre_counts = genre_counts
+		movie_missing_genre = missing_genre
+		movie_decades = decades
+		genre_movie_index = movies_of_genres
+		feature_movie_ids = movie_ids
+		# print("done (movie features)")
+
+
+def get_movie_features():
+	"""
+	Gets the shared movie features and builds them if they do not exist yet.
+
+	:return: feature_movie_ids - array of the ids of all movies (the order of the rows of all features),
+			genre_names - list of all genres (the order of the columns of the genre matrix),
+			movie_genre_matrix - CSR matrix with a 1 for each genre of each movie (in the order in which the genres of a
+			movie were saved),
+			movie_genre_counts - array of the amount of genres of each movie,
+			movie_missing_genre - boolean array that is True for movies with a missing genre,
+			movie_decades - array of the decade of each movie (NaN if the release year is missing)
+	"""
+
+	with movie_features_lock:
+		if feature_movie_ids is None:
+			build_movie_features()
+
+		return (feature_movie_ids, genre_names, movie_genre_matrix, movie_genre_counts, movie_missing_genre,
+		        movie_decades)
+
+
+def get_movie_mask(movie_ids: list[int]):
+	"""
+	Gets a boolean mask over all movies of the shared movie features that is True for the given movies.
+
+	:param movie_ids: ids of the movies
+	:return: mask - boolean array in the order of the movie features
+	"""
+
+	with movie_features_lock:
+		get_movie_features()
+		mask = numpy.zeros(len(feature_movie_ids), dtype=bool)
+		mask[[feature_movie_index[m] for m in movie_ids if m in feature_movie_index]] = True
+
+	return mask
+
+
+def get_genre_movie_mask(genres: list[str]):
+	"""
+	Gets a boolean mask over all movies of the shared movie features that is True for the movies that have at least one
+	of the given genres, using the inverted genre index.
+
+	:param genres: genres of the movies
+	:return: mask - boolean array in the order of the movie features
+	"""
+
+	with movie_features_lock:
+		get_movie_features()
+		mask = numpy.zeros(len(feature_movie_ids), dtype=bool)
+		for genre in genres:
+			if genre in genre_index:
+				column = genre_index[genre]
+				start, end = genre_movie_index.indptr[column], genre_movie_index.indptr[column + 1]
+				mask[genre_movie_index.indices[start:end]] = True
+
+	return mask
+
+
+def get_movie_positions(movie_ids: list[int]):
+	"""
+	Gets the positions of the given movies in the order of the shared movie features.
+
+	:param movie_ids: ids of the movies
+	:return: positions - array of the positions of the movies (-1 for movies that are not part of the features)
+	"""
+
+	with movie_features_lock:
+		get_movie_features()
+
+		return numpy.array([feature_movie_index.get(m, -1) for m in movie_ids], dtype=int)
+
+
+def get_movie_popularity():
+	"""
+	Gets the amount of ratings and the average rating of all movies with a single query, in the order of the movie
+	features.
+
+	:return: amounts_of_ratings - array of the amount of ratings of each movie (0 if it is not set),
+			average_ratings - array of the average rating of each movie (NaN if it is not set)
+	"""
+
+	movies = db.session.query(Movie.id, Movie.amount_of_ratings, Movie.average_rating).all()
+	with movie_features_lock:
+		get_movie_features()
+		amounts_of_ratings = numpy.zeros(len(feature_movie_ids))
+		average_ratings = numpy.full(len(feature_movie_ids), numpy.nan)
+		for m in movies:
+			if m.id not in feature_movie_index:
+				continue
+			index = feature_movie_index[m.id]
+			# if the amount of ratings is None, set it to 0
+			if m.amount_of_ratings is not None:
+				amounts_of_ratings[index] = m.amount_of_ratings
+			if m.average_rating is not None:
+				average_ratings[index] = m.average_rating
+
+	return amounts_of_ratings, average_ratings
@@ -1,14 +1,68 @@
-﻿from flask_login import current_user
-from sqlalchemy import Table, Column, exc, func, and_
+﻿from sqlalchemy import func, inspect, text, UniqueConstraint
 from thefuzz import fuzz
 import math
 
-from get_data import get_all_movies_and_users_ids, get_all_movie_genres
-from models import UserMovieRecommendationScores, db, Movie, MovieRating, Tags
+from get_data import get_all_movies_and_users_ids, get_all_movie_genres, invalidate_popularity_ranking
+from models import db, Movie, MovieRating, Tags
+from score_storage import bulk_update, initialize_scores
+from searcher import get_search_title, preprocess_string
 
 global all_movie_ids
 
 
+def upgrade_database_schema():
+	"""
+	Adds the columns, indexes and unique constraints of the models that are missing in the existing tables, as
+	db.create_all() only creates missing tables (e.g. the search_title, search_tag, item_collaborative_score and
+	tag_based_score columns and the unique constraint on the user and movie ids of the scores in a database that was
+	created before they were added). SQLite cannot add constraints to an existing table, so the unique constraints are
+	added as unique indexes, and duplicate rows are deleted before (keeping the first one).
+	"""
+
+	inspector = inspect(db.session.connection())
+	existing_tables = inspector.get_table_names()
+	for table in db.metadata.sorted_tables:
+		# the missing tables are created by db.create_all()
+		if table.name not in existing_tables:
+			continue
+
+		# add the missing columns (with their default, so that the existing rows get a value)
+		existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+		for column in table.columns:
+			if column.name in existing_columns:
+				continue
+			# print("add column", column.name, "to", table.name)
+			definition = "%s %s" % (column.name, column.type.compile(dialect=db.engine.dialect))
+			if column.server_default is not None:
+				if not column.nullable:
+					definition += " NOT NULL"
+				definition += " DEFAULT '%s'" % column.server_default.arg
+			db.session.execute(text("ALTER TABLE %s ADD COLUMN %s" % (table.name, definition)))
+
+		# add the missing indexes
+		for index in table.indexes:
+			index.create(bind=db.session.connection(), checkfirst=True)
+
+		# add the missing unique constraints as unique indexes
+		existing_unique_columns = [set(c['column_names']) for c in inspector.get_unique_constraints(table.name)]
+		existing_unique_columns += [set(i['column_names']) for i in inspector.get_indexes(table.name)
+		                            if i['unique']]
+		primary_key = table.primary_key.columns.values()[0].name
+		for constraint in table.constraints:
+			if not isinstance(constraint, UniqueConstraint):
+				continue
+			column_names = [c.name for c in constraint.columns]
+			if set(column_names) in existing_unique_columns:
+				continue
+			# print("add unique index on", column_names, "to", table.name)
+			columns = ", ".join(column_names)
+			db.session.execute(text("DELETE FROM %s WHERE %s NOT IN (SELECT MIN(%s) FROM %s GROUP BY %s)"
+			                        % (table.name, primary_key, primary_key, table.name, columns)))
+			db.session.execute(text("CREATE UNIQUE INDEX uq_%s_%s ON %s (%s)"
+			                        % (table.name, "_".join(column_names), table.name, columns)))
+	db.session.commit()
+
+
 def preprocess_tags():
 	"""
 	Preprocesses the movie tags by removing the genres part of the movie genres and merging similar tags.
@@ -63,6 +117,29 @@ def preprocess_tags():
 # print("done (tag preprocessing)")
 
 
+def save_search_ready_titles_and_tags():
+	"""
+	Saves the search-ready movie titles and tags for all Movie and Tags entries that do not have them yet, i.e. whose
+	search_title or search_tag is NULL (e.g. entries that were added before these attributes existed). The columns
+	need to exist already; in a database created before they were added, they are added by upgrade_database_schema when
+	the app starts.
+	"""
+
+	# print("save search-ready titles and tags")
+	# get the movies without a search-ready title and save it
+	movies = db.session.query(Movie.id, Movie.title).filter(Movie.search_title.is_(None)).all()
+	if movies:
+		db.session.bulk_update_mappings(Movie, [{"id": m.id, "search_title": get_search_title(m.title)} for m in movies])
+		db.session.commit()
+
+	# get the tags without a search-ready tag and save it
+	tags = db.session.query(Tags.id, Tags.tag).filter(Tags.search_tag.is_(None)).all()
+	if tags:
+		db.session.bulk_update_mappings(Tags, [{"id": t.id, "search_tag": preprocess_string(t.tag)} for t in tags])
+		db.session.commit()
+# print("done (search-ready titles and tags)")
+
+
 def get_and_save_amount_of_ratings_and_average_ratings():
 	"""
 	Get the amount of ratings and the average rating of all movies and add them to the corresponding Movie entries.
@@ -81,62 +158,20 @@ def get_and_save_amount_of_ratings_and_average_ratings():
 		data[m[0]] = [m[1] if m[1] else 0, round(m[2], 2) if m[2] else math.nan]
 	# print("save amount of ratings and average ratings of the movies to the database")
 
-	# create a temporary table
-	try:
-		t = Table("t", db.metadata,
-		          Column("movie_id", db.Integer),
-		          Column("amount_of_ratings", db.Integer),
-		          Column("average_rating", db.Float),
-		          extend_existing=True
-		          )
-	except exc.InvalidRequestError:
-		t = None
-	if t is None:
-		t = Table("t", db.metadata,
-		          Column("movie_id", db.Integer),
-		          Column("amount_of_ratings", db.Integer),
-		          Column("average_rating", db.Float),
-		          extend_existing=True
-		          )
-	db.session.commit()
-	t.create(bind=db.session.get_bind())
-
-	# insert the values
-	db.session.execute(
-		t.insert().values(
-			[{"movie_id": k, "amount_of_ratings": v[0], "average_rating": v[1]} for k, v in data.items()]))
-
 	# update the Movie entries
-	db.session.execute(Movie.__table__.update().values(
-		{'amount_of_ratings': t.c.amount_of_ratings, 'average_rating': t.c.average_rating}).where(and_(
-		Movie.__table__.c.id == t.c.movie_id)))
-	db.session.commit()
+	bulk_update(Movie.__table__, ["id"], [{"id": k, "amount_of_ratings": v[0], "average_rating": v[1]}
+	                                      for k, v in data.items()])
 
-	# drop the temporary table
-	t.drop(bind=db.session.get_bind())
+	# the popularity ranking depends on the amounts of ratings and the average ratings, so it needs to be rebuilt
+	invalidate_popularity_ranking()
 
 
-def initialize_user_movie_scores():
-	"""
-	Initializes the entries in UserMovieRecommendationScores for the current user.
+def initialize_user_movie_scores(user_id: int):
 	"""
+	Initializes the scores of all movies for the user (the UserMovieRecommendationScores entries or the packed score
+	vectors, depending on the score storage backend).
 
-	# get a list of all movie ids
-	global all_movie_ids
-	try:
-		all_movie_ids
-	except NameError:
-		all_movie_ids = None
-	if all_movie_ids is None:
-		all_movie_ids, _ = get_all_movies_and_users_ids()
+	:param user_id: id of the user
+	"""
 
-	# generate a new entry for each movie and add it to a list of all new entries
-	entries = []
-	for movie in all_movie_ids:
-		new_entry = UserMovieRecommendationScores(user_id=current_user.id, movie_id=movie, survey_based_score=0,
-		                                          user_based_score=0, item_based_score=0, exploration_based_score=0,
-		                                          total_recommendation_score=0)
-		entries.append(new_entry)
-	# add all entries to the database
-	db.session.add_all(entries)
-	db.session.commit()
+	initialize_scores(user_id)
@@ -0,0 +1,324 @@
+﻿from scipy.sparse import csr_matrix
+import numpy
+import threading
+import time
+
+from get_data import get_all_movies_and_users_ids
+from models import db, MovieRating
+
+global rating_matrix, rating_matrix_by_movie, user_index, movie_index, movie_ids, pending_ratings, time_compacted, \
+	user_rating_counts, user_rating_sums, user_squared_norms
+rating_matrix = None
+rating_matrix_by_movie = None
+user_index = None
+movie_index = None
+movie_ids = None
+# ratings that are not part of the sparsity structure of the rating matrix yet, with (row, column) tuples as keys
+pending_ratings = {}
+time_compacted = None
+# per-user statistics of the ratings (amount of ratings, sum of the ratings and sum of the squared ratings)
+user_rating_counts = None
+user_rating_sums = None
+user_squared_norms = None
+# lock for all changes (and reads that need a consistent state) of the rating matrix, the pending ratings and the
+# per-user statistics, which are shared by the request threads and the background workers
+rating_matrix_lock = threading.Lock()
+
+# amount of pending ratings after which they are folded into the rating matrix
+compaction_threshold = 500
+# time in seconds after which pending ratings are folded into the rating matrix
+compaction_interval = 10 * 60
+
+
+def build_rating_matrix():
+	"""
+	Builds the sparse user-movie rating matrix from all MovieRating entries that are not ignored. The rows correspond to
+	the users, the columns to the movies (both ordered by their ids), and a movie a user did not rate (or ignored) is an
+	empty entry of the matrix. It must be called while holding rating_matrix_lock.
+
+	:return: rating_matrix - CSR matrix of the ratings with the shape (amount of users, amount of movies),
+			user_index - dictionary with user ids as keys and the corresponding row indices as values,
+			movie_index - dictionary with movie ids as keys and the corresponding column indices as values
+	"""
+
+	global rating_matrix, rating_matrix_by_movie, user_index, movie_index, movie_ids, pending_ratings, time_compacted
+
+	# print("build rating matrix")
+	# get the ids of all movies and users and map them to the columns and rows of the matrix
+	all_movie_ids, all_user_ids = get_all_movies_and_users_ids()
+	user_index = {user_id: row for row, user_id in enumerate(all_user_ids)}
+	movie_index = {movie_id: column for column, movie_id in enumerate(all_movie_ids)}
+	movie_ids = numpy.array(all_movie_ids)
+
+	# get all ratings that are not ignored with a single query
+	ratings = db.session.query(MovieRating.user_id, MovieRating.movie_id, MovieRating.rating).filter(
+		MovieRating.ignored == 0,
+		MovieRating.rating.is_not(None)
+		).all()
+	# only keep ratings of users and movies that are part of the matrix
+	ratings = [r for r in ratings if r.user_id in user_index and r.movie_id in movie_index]
+
+	rows = numpy.array([user_index[r.user_id] for r in ratings], dtype=numpy.int32)
+	columns = numpy.array([movie_index[r.movie_id] for r in ratings], dtype=numpy.int32)
+	values = numpy.array([r.rating for r in ratings], dtype=numpy.float64)
+	rating_matrix = csr_matrix((values, (rows, columns)), shape=(len(all_user_ids), len(all_movie_ids)))
+	rating_matrix.sort_indices()
+	rating_matrix_by_movie = None
+	pending_ratings = {}
+	time_compacted = time.time()
+	calculate_user_rating_statistics()
+	# print("done (rating matrix)")
+
+	return rating_matrix, user_index, movie_index
+
+
+def calculate_user_rating_statistics():
+	"""
+	Calculates the amount of ratings, the sum of the ratings and the sum of the squared ratings of each user from the
+	rating matrix and the pending ratings. It must be called while holding rating_matrix_lock.
+	"""
+
+	global user_rating_counts, user_rating_sums, user_squared_norms
+
+	# get the row of each entry of the rating matrix and sum the values per row
+	entry_rows = numpy.repeat(numpy.arange(rating_matrix.shape[0]), numpy.diff(rating_matrix.indptr))
+	user_rating_counts = numpy.bincount(entry_rows, weights=rating_matrix.data != 0, minlength=rating_matrix.shape[0])
+	user_rating_sums = numpy.bincount(entry_rows, weights=rating_matrix.data, minlength=rating_matrix.shape[0])
+	user_squared_norms = numpy.bincount(entry_rows, weights=rating_matrix.data ** 2, minlength=rating_matrix.shape[0])
+
+	# add the pending ratings
+	for (row, _), rating in pending_ratings.items():
+		user_rating_counts[row] += rating != 0
+		user_rating_sums[row] += rating
+		user_squared_norms[row] += rating ** 2
+
+
+def get_rating_matrix(user_id: int = None):
+	"""
+	Gets the shared rating matrix and builds it if it does not exist yet. If the given user is not part of it yet, a row
+	is added for them. Pending ratings are folded into the matrix if the compaction threshold or interval is reached,
+	so the rows of other users can miss their latest new ratings until then (the exact ratings of a single user can be
+	gotten with get_user_ratings).
+
+	:param user_id: id of a user that needs to be part of the matrix (e.g. the current user)
+	:return: rating_matrix - CSR matrix of the ratings,
+			user_index - dictionary with user ids as keys and the corresponding row indices as values,
+			movie_index - dictionary with movie ids as keys and the corresponding column indices as values
+	"""
+
+	with rating_matrix_lock:
+		if rating_matrix is None:
+			build_rating_matrix()
+		if user_id is not None and user_id not in user_index:
+			add_user_to_rating_matrix(user_id)
+		if pending_ratings and (len(pending_ratings) >= compaction_threshold or
+		                        time.time() - time_compacted > compaction_interval):
+			compact_rating_matrix()
+
+		return rating_matrix, user_index, movie_index
+
+
+def get_rating_matrix_by_movie():
+	"""
+	Gets the shared rating matrix in the CSC format, which allows to read the ratings of single movies efficiently. It
+	is converted from the rating matrix the first time it is needed after the rating matrix was built or compacted.
+
+	:return: rating_matrix_by_movie - CSC matrix of the ratings
+	"""
+
+	global rating_matrix_by_movie
+
+	get_rating_matrix()
+	with rating_matrix_lock:
+		if rating_matrix_by_movie is None:
+			rating_matrix_by_movie = rating_matrix.tocsc()
+			rating_matrix_by_movie.sort_indices()
+
+		return rating_matrix_by_movie
+
+
+def get_movie_ids():
+	"""
+	Gets the ids of the movies corresponding to the columns of the shared rating matrix.
+
+	:return: movie_ids - array of the movie ids in the order of the columns
+	"""
+
+	get_rating_matrix()
+
+	return movie_ids
+
+
+def get_user_rating_statistics():
+	"""
+	Gets the per-user statistics of the ratings, which are always up-to-date with all rating changes.
+
+	:return: user_rating_counts - array of the amount of ratings of each user (row),
+			user_rating_sums - array of the sum of the ratings of each user,
+			user_squared_norms - array of the sum of the squared ratings of each user
+	"""
+
+	get_rating_matrix()
+	with rating_matrix_lock:
+		return user_rating_counts, user_rating_sums, user_squared_norms
+
+
+def get_user_ratings(user_id: int):
+	"""
+	Gets the exact current ratings of a user, i.e. the user's row of the rating matrix including their pending ratings.
+
+	:param user_id: id of the user
+	:return: columns - array of the columns of the movies the user rated,
+			ratings - array of the corresponding ratings
+	"""
+
+	get_rating_matrix(user_id)
+
+	# get the ratings from the row of the matrix and add the pending ratings of the user
+	with rating_matrix_lock:
+		row = user_index[user_id]
+		start, end = rating_matrix.indptr[row], rating_matrix.indptr[row + 1]
+		columns = rating_matrix.indices[start:end].tolist()
+		ratings = rating_matrix.data[start:end].tolist()
+		for (pending_row, column), rating in pending_ratings.items():
+			if pending_row == row:
+				columns.append(column)
+				ratings.append(rating)
+
+	# only keep actual ratings
+	columns = numpy.array(columns, dtype=numpy.int32)
+	ratings = numpy.array(ratings, dtype=numpy.float64)
+	rated = ratings != 0
+
+	return columns[rated], ratings[rated]
+
+
+def add_user_to_rating_matrix(user_id: int):
+	"""
+	Adds a row for a user to the rating matrix (e.g. for a user who registered after the matrix was built) and adds
+	their ratings from the database as pending ratings. It must be called while holding rating_matrix_lock.
+
+	:param user_id: id of the user that should be added
+	"""
+
+	global user_rating_counts, user_rating_sums, user_squared_norms
+
+	# add an empty row at the end of the matrix
+	row = rating_matrix.shape[0]
+	rating_matrix.resize((row + 1, rating_matrix.shape[1]))
+	if rating_matrix_by_movie is not None:
+		rating_matrix_by_movie.resize((row + 1, rating_matrix.shape[1]))
+	user_index[user_id] = row
+	user_rating_counts = numpy.append(user_rating_counts, 0.0)
+	user_rating_sums = numpy.append(user_rating_sums, 0.0)
+	user_squared_norms = numpy.append(user_squared_norms, 0.0)
+
+	# add the user's ratings that are not ignored (if there are any yet)
+	ratings = db.session.query(MovieRating.movie_id, MovieRating.rating).filter(
+		MovieRating.user_id == user_id,
+		MovieRating.ignored == 0,
+		MovieRating.rating.is_not(None)
+		).all()
+	for r in ratings:
+		if r.movie_id in movie_index:
+			set_rating_in_matrix(row, movie_index[r.movie_id], float(r.rating))
+
+
+def update_rating_in_matrix(user_id: int, movie_id: int, rating: float):
+	"""
+	Updates a single rating in the shared rating matrix and the per-user statistics without rebuilding the matrix from
+	the database. A rating that is already part of the sparsity structure of the matrix is updated in place, a new
+	rating is added to the pending ratings until the matrix is compacted.
+
+	:param user_id: id of the user
+	:param movie_id: id of the movie
+	:param rating: new rating of the movie by the user (0.0 to remove the rating, e.g. if the movie was ignored)
+	"""
+
+	with rating_matrix_lock:
+		# if the matrix was not built yet, there is nothing to update as it will include the change once it is built
+		if rating_matrix is None or movie_id not in movie_index:
+			return
+		if user_id not in user_index:
+			add_user_to_rating_matrix(user_id)
+		set_rating_in_matrix(user_index[user_id], movie_index[movie_id], float(rating))
+
+
+def set_rating_in_matrix(row: int, column: int, rating: float):
+	"""
+	Sets a single entry of the rating matrix (in place or as a pending rating) and updates the per-user statistics by
+	the difference. It must be called while holding rating_matrix_lock.
+
+	:param row: row of the user
+	:param column: column of the movie
+	:param rating: new rating of the movie by the user (0.0 to remove the rating)
+	"""
+
+	# check whether the entry is part of the sparsity structure of the matrix
+	start, end = rating_matrix.indptr[row], rating_matrix.indptr[row + 1]
+	position = start + numpy.searchsorted(rating_matrix.indices[start:end], column)
+	if position < end and rating_matrix.indices[position] == column:
+		# update the entry in place in the CSR matrix and, if it exists, the CSC matrix
+		previous_rating = rating_matrix.data[position]
+		rating_matrix.data[position] = rating
+		if rating_matrix_by_movie is not None:
+			start, end = rating_matrix_by_movie.indptr[column], rating_matrix_by_movie.indptr[column + 1]
+			position = start + numpy.searchsorted(rating_matrix_by_movie.indices[start:end], row)
+			rating_matrix_by_movie.data[position] = rating
+	else:
+		# add the rating to the pending ratings
+		previous_rating = pending_ratings.get((row, column), 0.0)
+		pending_ratings[(row, column)] = rating
+
+	# update the per-user statistics by the difference
+	user_rating_counts[row] += int(rating != 0) - int(previous_rating != 0)
+	user_rating_sums[row] += rating - previous_rating
+	user_squared_norms[row] += rating ** 2 - previous_rating ** 2
+
+
+def compact_rating_matrix():
+	"""
+	Folds the pending ratings into the rating matrix and removes entries of removed ratings from its sparsity structure.
+	It must be called while holding rating_matrix_lock.
+	"""
+
+	global rating_matrix, rating_matrix_by_movie, pending_ratings, time_compacted
+
+	# print("compact rating matrix")
+	if pending_ratings:
+		rows, columns = zip(*pending_ratings.keys())
+		pending = csr_matrix((list(pending_ratings.values()), (rows, columns)), shape=rating_matrix.shape)
+		rating_matrix = rating_matrix + pending
+	rating_matrix.eliminate_zeros()
+	rating_matrix.sort_indices()
+	rating_matrix_by_movie = None
+	pending_ratings = {}
+	time_compacted = time.time()
+
+
+def get_weighted_average_ratings(user_ids: list[int], weights: list[float]):
+	"""
+	Calculates the weighted average rating of every movie over the given users in one pass over their rows of the
+	rating matrix, only considering the users who rated the respective movie.
+
+	:param user_ids: ids of the users
+	:param weights: weights of the users' ratings (e.g. their similarities to another user)
+	:return: average_ratings - array of the weighted average rating of each movie (column), or 0.0 if none of the users
+			rated it,
+			weight_sums - array of the sum of the weights of the users who rated each movie
+	"""
+
+	matrix, users, _ = get_rating_matrix()
+	with rating_matrix_lock:
+		known = [u in users for u in user_ids]
+		rows = [users[u] for u, k in zip(user_ids, known) if k]
+		ratings = matrix[rows]
+	weights = numpy.asarray(weights, dtype=numpy.float64)[numpy.array(known, dtype=bool)]
+
+	# sum up the weighted ratings and the weights of the users who rated each movie
+	weighted_sums = ratings.T @ weights
+	weight_sums = (ratings != 0).T @ weights
+	average_ratings = numpy.divide(weighted_sums, weight_sums, out=numpy.zeros(matrix.shape[1]),
+	                               where=weight_sums > 0)
+
+	return average_ratings, weight_sums
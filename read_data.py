@@ -4,6 +4,7 @@ import math
 import sqlalchemy
 from sqlalchemy.exc import IntegrityError
 from models import Movie, MovieGenre, MovieRating, Links, Tags, User
+from searcher import get_search_title, preprocess_string
 import random
 import pandas as pd
 import re
@@ -137,6 +138,7 @@ def check_and_read_data(db: sqlalchemy, testing: bool = False):
     :param db: database to be populated
     :param testing: if set to True, only a subset of the data is checked and read in to reduce computing time for
     testing
+    :return: True if the data was read in (i.e. the database had no movies yet), False otherwise
     """
 
     # check if we have movies in the database
@@ -154,8 +156,9 @@ def check_and_read_data(db: sqlalchemy, testing: bool = False):
                         title = get_clean_movie_title(row[1])
                         # extract the release year
                         year = extract_release_year_from_title(title)
-                        movie = Movie(id=movie_id, title=title, release_year=year, amount_of_ratings=math.nan,
-                                      average_rating=math.nan)
+                        # save the search-ready title (without the release year and preprocessed) as well
+                        movie = Movie(id=movie_id, title=title, search_title=get_search_title(title), release_year=year,
+                                      amount_of_ratings=math.nan, average_rating=math.nan)
                         db.session.add(movie)
                         genres = row[2].split('|')
                         for genre in genres:
@@ -238,7 +241,9 @@ def check_and_read_data(db: sqlalchemy, testing: bool = False):
                 if count > 0:
                     try:
                         tag = row[2].upper()
-                        tags = Tags(user_id=row[0], movie_id=row[1], tag=tag, timestamp=row[3])
+                        # save the search-ready (preprocessed) tag as well
+                        tags = Tags(user_id=row[0], movie_id=row[1], tag=tag, search_tag=preprocess_string(tag),
+                                    timestamp=row[3])
                         db.session.add(tags)
                         db.session.commit()
                     except IntegrityError:
@@ -249,3 +254,6 @@ def check_and_read_data(db: sqlalchemy, testing: bool = False):
                 if count % 100 == 0:
                     print(count, " tags read")
         # endregion
+        return True
+
+    return False
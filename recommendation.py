@@ -1,164 +1,107 @@
-﻿from flask_user import current_user
-from sqlalchemy import and_, or_, case, Table, Column, func, exc
-from sklearn.metrics.pairwise import nan_euclidean_distances
+﻿from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from flask_user import current_user
+from sqlalchemy import or_, case, func
+from scipy.sparse import csr_matrix
 import numpy
 import calendar
+import contextvars
+import threading
 import time
 import math
 
-from get_data import (get_user_preference_ratios, get_all_movies_and_users_ids, get_most_popular_movies,
-                      get_movie_genres, get_survey_preferences, get_all_rated_movies_by_current_user,
-                      get_all_rated_movies_ids)
-from models import (db, Movie, MovieRating, UserGenrePreferences, UserDecadePreferences, MovieWatchList,
-                    UserMovieRecommendationScores)
+from get_data import (get_user_preference_ratios, get_most_popular_movie_ids, invalidate_popularity_ranking,
+                      get_movie_genres, get_survey_preferences)
+from movie_features import get_movie_features, get_movie_mask, get_genre_movie_mask, get_movie_popularity
+from models import db, Movie, MovieRating, UserGenrePreferences, UserDecadePreferences, MovieWatchList
+from item_similarity import load_item_neighbour_index, predict_item_collaborative_scores
+from tag_features import predict_tag_based_scores
+from latent_factors import load_latent_factor_model, predict_ratings
+from score_storage import (score_names, save_scores, set_scores, combine_scores, load_scores,
+                           get_top_movie_ids)
+from rating_matrix import get_rating_matrix, get_movie_ids, update_rating_in_matrix, get_weighted_average_ratings
+from similarity import (calculate_user_distances, similarity_metrics, get_nearest_users, get_cached_neighbours,
+                        save_neighbours, register_rating_change)
 from utils import check_whether_there_are_survey_entries
 
-global all_movie_ids_rated, all_movie_ids, all_user_ids
+global item_based_changed_movies, survey_changed_genres, pending_score_components
+# ids of the movies whose rating or ignored status changed since the item-based scores of a user were last calculated
+# (by user id; users without an entry need a full calculation)
+item_based_changed_movies = {}
+# genres whose survey response (liked or disliked) changed since the survey-based scores of a user were last calculated
+# (by user id; users without an entry need a full calculation)
+survey_changed_genres = {}
+# components of the scoring pipeline that need to be recalculated for a user but were not needed by the methods
+# requested since (by user id)
+pending_score_components = {}
+# lock for the tracked changes and the pending components, which are accessed by the request threads, the scorer
+# threads and the background recomputation jobs
+score_tracking_lock = threading.Lock()
+# scores calculated by a scorer running in parallel to others, which are saved together once all of them are done (set
+# for the thread of the scorer only; scorers without a buffer save their scores directly)
+score_buffer = contextvars.ContextVar('score_buffer', default=None)
 
 
 # set the allowed values for the recommendation type
-recommendation_types = ["user-based", "item-based", "explorative", "hybrid", "survey-based"]
+recommendation_types = ["user-based", "item-based", "item-collaborative", "tag-based", "explorative", "hybrid",
+                        "survey-based"]
 
 
-def get_movie_recommendations(min_amount_of_ratings: int, min_rating: float, amount_of_results: int,
-                              method: str = "hybrid", calculation_needed_for: tuple[str] =
-                              ('user-based', 'item-based', 'explorative', 'hybrid', 'survey-based')):
+def get_movie_recommendations(user_id: int, min_amount_of_ratings: int, min_rating: float,
+                              amount_of_results: int, method: str = "hybrid", calculation_needed_for: tuple[str] =
+                              ('user-based', 'item-based', 'item-collaborative', 'tag-based', 'explorative',
+                               'hybrid', 'survey-based'), recalculate: bool = True):
 	"""
-	Gets the movie recommendations and updates the score attributes in UserMovieRecommendationScores if needed.
+	Gets the movie recommendations of a user and updates the score attributes in UserMovieRecommendationScores if
+	needed. Only the scores the method depends on are recalculated (see score_components); the others stay pending until
+	a method that needs them is requested.
 
+	:param user_id: id of the user
 	:param min_amount_of_ratings: minimum amount of ratings needed to get user-based, item-based and hybrid recommendations
 	:param min_rating: minimum rating needed so that a movie is deemed as liked
 	:param amount_of_results: amount of results that should be returned
 	:param method: method that should be used for the recommendations
 	:param calculation_needed_for: tuple of strings relating to UserMovieRecommendationScores attributes that the values
 			need to be recalculated for
-	:return: user_based_recommendations if method == "user-based" - list of Movie objects of user-based movie
-			recommendations,
-			item_based_recommendations if method == "item-based",
-			survey_based_recommendations if method == "survey-based",
-			exploration_based_recommendations if method == "explorative",
-			hybrid_recommendations if method == "hybrid" - list of Movie objects corresponding to the movie recommendations
-			based on the method
+	:param recalculate: whether the pending scores should be recalculated; if False, the scores as they were last
+			calculated are used, and the pending ones stay pending (e.g. while a background recomputation is running)
+	:return: list of Movie objects corresponding to the movie recommendations based on the method
 	"""
 
 	# check if the method is valid
 	if method not in recommendation_types:
 		raise ValueError("Invalid value for parameter method. Expected one of: %s" % recommendation_types)
 
-	# get a list of the ids of all movies the current user rated, excluding those they ignored
-	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == current_user.id,
-	                                                MovieRating.ignored == 0).all()
+	# the inputs shared by the scorers are only fetched once per request (and only if a scorer needs them)
+	inputs = {'min_rating': min_rating}
 	# if calculation_needed_for:
 	# print("get movie recommendations called with calculation needed for ", calculation_needed_for)
 	# else:
 	# print("get movie recommendations called with no calculation needed")
 
-	# print("amount of movies the user rated:", len(movies_already_rated))
-	# check how much history there is for the current user
-	# if the current user rated fewer movies than min_amount_of_ratings, use the survey responses for the recommendations
+	# print("amount of movies the user rated:", len(get_score_input(user_id, inputs, 'movies_already_rated')))
+	# check how much history there is for the user
+	# if the user rated fewer movies than min_amount_of_ratings, use the survey responses for the recommendations
 	# if there are no survey responses, use the explorative method instead
-	if len(movies_already_rated) < min_amount_of_ratings:
-		method = "survey-based" if check_whether_there_are_survey_entries() else "explorative"
+	if len(get_score_input(user_id, inputs, 'movies_already_rated')) < min_amount_of_ratings:
+		method = "survey-based" if get_score_input(user_id, inputs, 'survey_entries') else "explorative"
 	# print("method is", method, "as there are not enough ratings yet")
-	# if the user rated at least min_amount_of_ratings movies, get user-based, item-based and explorative
-	# recommendations based on them
-	else:
-		# region USER-BASED
-		# user-based recommendations: get movies that similar users liked that the user did not rate yet
-		# print("USER-BASED")
-
-		# if user-based is part of the recalculation tuple, recalculate the user-based scores
-		if 'user-based' in calculation_needed_for:
-			calculate_user_based_scores(min_rating)
-
-		# if the method is user-based, get user-based recommendations and return
-		if method == "user-based":
-			user_based_recommendations = get_user_based_recommendations(amount_of_results)
-			return user_based_recommendations
-		# endregion
-
-		# region ITEM-BASED
-		# item-based recommendations: get movies that have similar properties to the movies the user liked
-		# print("ITEM-BASED")
-
-		# if item-based is part of the recalculation tuple, recalculate the item-based scores
-		if 'item-based' in calculation_needed_for:
-			# print("will get preference ratios")
-			# get the genre and decade ratios
-			genre_ratios, decade_ratios = get_user_preference_ratios(1)
-			calculate_item_based_scores(genre_ratios, decade_ratios)
-
-		# if the method is item-based, get item-based recommendations and return
-		if method == "item-based":
-			item_based_recommendations = get_item_based_recommendations(amount_of_results)
-			return item_based_recommendations
-	# endregion
-
-	# region SURVEY-BASED
-	# survey-based: get movies fitting the preferences selected in the survey
-	# print("SURVEY-BASED")
-	# if there are survey entries, check whether recalculation is needed and survey-based recommendations should be
-	# returned
-	if check_whether_there_are_survey_entries():
-		# print("there are survey entries")
-		# if survey-based is part of the recalculation tuple, recalculate the survey-based scores
-		if 'survey-based' in calculation_needed_for:
-			calculate_survey_based_scores()
-
-		# if the method is survey-based, get survey-based recommendations and return
-		if method == "survey-based":
-			survey_based_recommendations = get_survey_based_recommendations(amount_of_results)
-			return survey_based_recommendations
-	# if there are no survey entries, update the survey based score attribute to 0.0 if there were previous survey
-	# responses
-	else:
-		# reset survey-based scores if they were calculated for previous responses
-		if UserMovieRecommendationScores.query.filter(
-				UserMovieRecommendationScores.user_id == current_user.id,
-				UserMovieRecommendationScores.survey_based_score != 0).all():
-			# print("reset survey-based movie scores from previous survey responses")
-			(db.session.query(UserMovieRecommendationScores).filter(
-				UserMovieRecommendationScores.user_id == current_user.id).update(
-				{'survey_based_score': 0.0}))
-			db.session.commit()
-	# endregion
-
-	# region EXPLORATIVE
-	# exploration-based recommendations: get additional recommendations that are not based on similar users or similar
-	# items
-	# if user did not rate at least 50 movies, recommendations are popular and liked movies
-	# if they did rate at least 50 movies, underexplored genres
-	# should be explored
-	# print("EXPLORATIVE")
-
-	# if explorative is part of the recalculation tuple, recalculate the exploration-based recommendations
-	if 'explorative' in calculation_needed_for:
-		# if the current user rated less than 50 movies, base the score on popularity
-		if len(movies_already_rated) < 50:
-			calculate_exploration_based_scores("popular")
-		# if the current user rated at least 50 movies, base the score on under-exploration
-		else:
-			calculate_exploration_based_scores("underexplored")
-
-	# if the method is explorative, get exploration-based recommendations and return
-	if method == "explorative":
-		exploration_based_recommendations = get_exploration_based_recommendations(amount_of_results)
-		return exploration_based_recommendations
-	# endregion
-
-	# region HYBRID
-	# hybrid recommendations: get movies that fit the survey, that similar users liked, that are similar to liked
-	# movies, and that allow for exploration (weighted scores)
-	# print("HYBRID")
 
-	# if hybrid is part of the recalculation tuple, recalculate the total recommendation scores
-	if 'hybrid' in calculation_needed_for:
-		calculate_hybrid_scores()
+	# recalculate the scores the method depends on that are pending, either from this request or from earlier ones
+	if recalculate:
+		with score_tracking_lock:
+			pending = pending_score_components.pop(user_id, set()) | set(calculation_needed_for)
+		calculated = evaluate_score_components(user_id, method, pending, inputs)
+		# keep the components that were not needed, together with those that became pending in the meantime
+		with score_tracking_lock:
+			pending_score_components[user_id] = pending_score_components.get(user_id, set()) | (pending - calculated)
+	elif calculation_needed_for:
+		with score_tracking_lock:
+			pending_score_components[user_id] = (pending_score_components.get(user_id, set()) |
+			                                     set(calculation_needed_for))
 
-	# if the method is hybrid, get hybrid recommendations and return
-	if method == "hybrid":
-		hybrid_recommendations = get_hybrid_recommendations(amount_of_results)
-		return hybrid_recommendations
+	# get the recommendations with the highest scores of the method
+	return get_top_recommendations(user_id, score_components[method]['output'], amount_of_results)
 
 
 # region exploration-based
@@ -166,37 +109,35 @@ def get_movie_recommendations(min_amount_of_ratings: int, min_rating: float, amo
 exploration_types = ["popular", "underexplored"]
 
 
-def calculate_exploration_based_scores(exploration_type: str):
+def calculate_exploration_based_scores(user_id: int, exploration_type: str):
 	"""
-	Calculates the exploration_based_score attribute of UserMovieRecommendationScores corresponding to the current
-	user. The score depends on either the popularity of the corresponding movie in terms of the amount of ratings and
-	its average movie rating, or on how many of the corresponding movie's genres are underexplored by the current user.
-
-	:param exploration_type: either popular or underexplored, with the latter meaning that the current user did not
-			rate any or very few movies of the respective genre(s)
+	Calculates the exploration_based_score attribute of UserMovieRecommendationScores corresponding to the user. The
+	score depends on either the popularity of the corresponding movie in terms of the amount of ratings and its average
+	movie rating, or on how many of the corresponding movie's genres are underexplored by the user. The scores of all
+	movies are calculated at once from the shared movie features.
+
+	:param user_id: id of the user
+	:param exploration_type: either popular or underexplored, with the latter meaning that the user did not rate any or
+			very few movies of the respective genre(s)
 	"""
 
-	# get the ids of all movies
-	global all_movie_ids
-	try:
-		all_movie_ids
-	except NameError:
-		all_movie_ids = None
-	if all_movie_ids is None:
-		all_movie_ids, _ = get_all_movies_and_users_ids()
-
 	# validate the parameter
 	if exploration_type not in exploration_types:
 		raise ValueError("Invalid value for parameter method. Expected one of: %s" % exploration_types)
 
-	# get a list of the ids of all movies the current user rated, excluding those they ignored
-	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == current_user.id,
+	# get the ids and the genres of all movies
+	movie_ids, genres, genre_matrix, genre_counts, missing_genre, _ = get_movie_features()
+
+	# get a list of the ids of all movies the user rated, excluding those they ignored
+	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == user_id,
 	                                                MovieRating.ignored == 0).all()
 	movies_already_rated_ids = [m.movie_id for m in movies_already_rated]
-	# get a list of the ids of all movies the current user ignored
-	ignored_movies = MovieRating.query.filter(MovieRating.user_id == current_user.id,
+	# get a list of the ids of all movies the user ignored
+	ignored_movies = MovieRating.query.filter(MovieRating.user_id == user_id,
 	                                          MovieRating.ignored == 1).all()
 	ignored_movies_ids = [m.movie_id for m in ignored_movies]
+	# get a mask of the movies the user ignored or rated
+	excluded = get_movie_mask(movies_already_rated_ids + ignored_movies_ids)
 
 	# get the maximum amount of ratings in the database
 	max_amount_of_ratings = db.session.query(func.max(Movie.amount_of_ratings)).first()[0]
@@ -204,45 +145,29 @@ def calculate_exploration_based_scores(exploration_type: str):
 	# if the exploration type if popular, the score depends on the movies' popularity
 	if exploration_type == "popular":
 		# print("POPULAR MOVIES")
-		# get the 100 most popular movies
-		popular_liked_movies = get_most_popular_movies(100, consider_ratings=True)
-		popular_liked_movies_ids = [m.id for m in popular_liked_movies]
-		# from all movie ids, extract those that are not part of the popular movies
-		remainder_movies = [m_id for m_id in all_movie_ids if m_id not in popular_liked_movies_ids]
-
-		# print("go through popular movies and calculate score based on average rating")
-		new_scores = {}
-		# go through all popular movies
-		for movie in popular_liked_movies:
-			# if the current user ignored or rated the movie, set the score to 0.0
-			if movie.id in ignored_movies_ids or movie.id in movies_already_rated_ids:
-				score = 0.0
-			# else, calculate the score of the movie
-			else:
-				# get the amount of ratings of the movie
-				amount_of_ratings = Movie.query.filter(Movie.id == movie.id).first().amount_of_ratings
-				# if it is None, set it to 0
-				if amount_of_ratings is None:
-					amount_of_ratings = 0
-				# get the average rating of the movie
-				average_movie_rating = Movie.query.filter(Movie.id == movie.id).first().average_rating
-				# half of the score is a factor determined by casting the amount of ratings of the movie
-				# to the score range from 0.0 to 1.0
-				# the other half is the average score of the movie casted to the rating range from 0.0 to 1.0
-				# with the rating range of the popular movies being (4.0, 5.0) and the score range being (0.0, 1.0),
-				# the calculation is:
-				# ((average_rating - min_rating_range) / (max_rating_range - min_rating_range)) +
-				# (max_score_range - min_score_range) + min_score_range
-				# = ((average_rating - 4.0) / 5.0 - 4.0)) + (1.0 - 0.0) + 0.0
-				# so simplified: (average_rating - 4.0)
-				score = round(
-					(0.5 * (average_movie_rating - 4.0) + 0.5 * (amount_of_ratings / max_amount_of_ratings)), 2)
-			# append the score to the dictionary
-			new_scores[movie.id] = score
-		# set the score of all movies that are not part of the popular movies to 0.0
-		for movie in remainder_movies:
-			new_scores[movie] = 0.0
-	# if the exploration type is underexplored, the score depends on whether the current user did rate none or few
+		# get the amount of ratings and the average rating of all movies
+		amounts_of_ratings, average_ratings = get_movie_popularity()
+		# get the 100 most popular movies from the global popularity ranking
+		popular_liked_movies_ids = get_most_popular_movie_ids(user_id, 100, consider_ratings=True)
+		popular = get_movie_mask(popular_liked_movies_ids)
+
+		# print("calculate score of popular movies based on average rating")
+		# half of the score is a factor determined by casting the amount of ratings of the movie
+		# to the score range from 0.0 to 1.0
+		# the other half is the average score of the movie casted to the rating range from 0.0 to 1.0
+		# with the rating range of the popular movies being (4.0, 5.0) and the score range being (0.0, 1.0),
+		# the calculation is:
+		# ((average_rating - min_rating_range) / (max_rating_range - min_rating_range)) +
+		# (max_score_range - min_score_range) + min_score_range
+		# = ((average_rating - 4.0) / 5.0 - 4.0)) + (1.0 - 0.0) + 0.0
+		# so simplified: (average_rating - 4.0)
+		scores = numpy.zeros(len(movie_ids))
+		scores[popular] = [round(score, 2) for score in (0.5 * (average_ratings[popular] - 4.0) + 0.5 * (
+			amounts_of_ratings[popular] / max_amount_of_ratings)).tolist()]
+		# set the score of all movies that are not part of the popular movies or that the user ignored or rated
+		# to 0.0
+		scores[~popular | excluded] = 0.0
+	# if the exploration type is underexplored, the score depends on whether the user did rate none or few
 	# movies with the corresponding genre
 	elif exploration_type == "underexplored":
 		# print("UNDEREXPLORED GENRES")
@@ -250,19 +175,19 @@ def calculate_exploration_based_scores(exploration_type: str):
 		# print("get genres with no ratings by the user")
 		# get all genres that the user did not rate any movie with yet
 		no_ratings = UserGenrePreferences.query.filter(
-			UserGenrePreferences.user_id == current_user.id,
+			UserGenrePreferences.user_id == user_id,
 			UserGenrePreferences.amount_of_ratings == 0
 			).all()
 		# if there are such genres, append them to the list
 		if no_ratings:
 			for g in no_ratings:
 				underexplored_genres.append(g.genre)
-		# if there are none, get underexplored genres, i.e. less than 10% of the current user's ratings included these
+		# if there are none, get underexplored genres, i.e. less than 10% of the user's ratings included these
 		# genres
 		else:
 			# print("None found; get genres with amount of ratings less than 10% of total amount of ratings of the user")
 			few_ratings = UserGenrePreferences.query.filter(
-				UserGenrePreferences.user_id == current_user.id,
+				UserGenrePreferences.user_id == user_id,
 				UserGenrePreferences.amount_of_ratings < len(movies_already_rated_ids) * 0.1
 				).all()
 			for g in few_ratings:
@@ -272,114 +197,43 @@ def calculate_exploration_based_scores(exploration_type: str):
 
 		# if there are underexplored genres, calculate the score based on the proportion of underexplored genres of all
 		# movie genres for a movie
+		scores = numpy.zeros(len(movie_ids))
 		if underexplored_genres:
-			# print("go through all movies and calculate their score")
-			# count = 0
-			new_scores = {}
-			# go through all movies
-			for movie in all_movie_ids:
-				# count += 1
-				# if count % 1000 == 0:
-				# print("loop count:", count)
-				# if count == len(all_movie_ids):
-				# print("last loop")
-				# if the current user ignored or rated the movie, set the score to 0.0
-				if movie in ignored_movies_ids or movie in movies_already_rated_ids:
-					score = 0.0
-				# else, calculate the score
-				else:
-					# get all genres of the movie
-					movie_genres = get_movie_genres(movie)
-					amount_of_genres = len(movie_genres)
-					# if no genre is listed, add a small score for recommendation to not exclude it
-					if None in movie_genres:
-						score = 0.25
-					else:
-						# extract the underexplored genres from the movie genres
-						underexplored = [g for g in movie_genres if g is not None and g in underexplored_genres]
-						# if there is at least one, calculate the score as a proportion
-						if underexplored:
-							score = round(len(underexplored) / amount_of_genres, 2)
-						# if none of the genres is underexplored, set the score to 0.0
-						else:
-							score = 0.0
-				# append the score to the dictionary
-				new_scores[movie] = score
-		# if there are no underexplored genres, set the score of each movie to 0.0 (rather unlikely for the current
+			# print("calculate the score of all movies")
+			# count the underexplored genres of each movie and calculate the score as a proportion
+			underexplored_genre_mask = numpy.array([g in underexplored_genres for g in genres], dtype=float)
+			amounts_of_underexplored = genre_matrix @ underexplored_genre_mask
+			proportions = numpy.divide(amounts_of_underexplored, genre_counts, out=numpy.zeros(len(genre_counts)),
+			                           where=genre_counts > 0)
+			scores = numpy.array([round(score, 2) for score in proportions.tolist()])
+			# if no genre is listed, add a small score for recommendation to not exclude it
+			scores[missing_genre] = 0.25
+			# if the user ignored or rated the movie, set the score to 0.0
+			scores[excluded] = 0.0
+		# if there are no underexplored genres, the score of each movie stays 0.0 (rather unlikely for the current
 		# context)
-		else:
-			# print("there are no underexplored genres")
-			new_scores = {}
-			for movie in all_movie_ids:
-				new_scores[movie] = 0.0
+		# else:
+		# print("there are no underexplored genres")
 	else:
 		raise ValueError("Invalid value for parameter method. Expected one of: %s" % exploration_types)
+	new_scores = dict(zip(movie_ids.tolist(), scores.tolist()))
 
-	# create a temporary table
-	try:
-		temp = Table("temp", db.metadata,
-		             Column("movie_id", db.Integer),
-		             Column("exploration_based_score", db.Float),
-		             extend_existing=True
-		             )
-	except exc.InvalidRequestError:
-		temp = None
-	if temp is None:
-		temp = Table("temp", db.metadata,
-		             Column("movie_id", db.Integer),
-		             Column("exploration_based_score", db.Float),
-		             extend_existing=True
-		             )
-	db.session.commit()
-	temp.create(bind=db.session.get_bind())
-
-	# insert the new scores
-	db.session.execute(
-		temp.insert().values(
-			[{"movie_id": k, "exploration_based_score": v} for k, v in new_scores.items()]))
-
-	# update the UserMovieRecommendationScores corresponding to the current user
-	db.session.execute(UserMovieRecommendationScores.__table__.update().values(
-		exploration_based_score=temp.c.exploration_based_score).where(and_(
-		UserMovieRecommendationScores.__table__.c.movie_id == temp.c.movie_id,
-		UserMovieRecommendationScores.__table__.c.user_id == current_user.id)))
-	db.session.commit()
-
-	# drop the temporary table
-	temp.drop(bind=db.session.get_bind())
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'exploration_based_score', new_scores)
 
 
-def get_exploration_based_recommendations(amount_of_results: int):
+def get_exploration_based_recommendations(user_id: int, amount_of_results: int):
 	"""
 	Gets a set amount of movie recommendations based on the exploration based score attribute in
 	UserMovieRecommendationsScores.
 
+	:param user_id: id of the user
 	:param amount_of_results: amount of results that should be returned
 	:return: exploration_based_recommendations = list of Movie objects of the recommended movies
 	"""
 
-	# get movies by score from the database
-	# print("get exploration based recommendations by filtering the database")
-	# sort the UserMovieRecommendationScores entries corresponding to the current user by the exploration based score
-	# attribute in a descending manner and get the first amount_of_results entries and the corresponding movie ids
-	exploration_based_recommendations_ids = UserMovieRecommendationScores.query.filter(
-		UserMovieRecommendationScores.user_id == current_user.id
-		).order_by(UserMovieRecommendationScores.exploration_based_score.desc()).limit(amount_of_results).all()
-
-	exploration_based_recommendations_ids = [m.movie_id for m in exploration_based_recommendations_ids]
-
-	id_ordering = case(
-		{_id: index for index, _id in enumerate(exploration_based_recommendations_ids)},
-		value=Movie.id
-		)
-
-	# print("get corresponding Movie Objects")
-	# get the corresponding Movie objects ordered by the exploration based score attribute
-	exploration_based_recommendations = Movie.query.filter(
-		Movie.id.in_(exploration_based_recommendations_ids),
-		).order_by(id_ordering).all()
-
-	return exploration_based_recommendations
+	# get the Movie objects of the movies with the highest exploration based score attribute of the user
+	return get_top_recommendations(user_id, 'exploration_based_score', amount_of_results)
 # endregion
 
 
@@ -399,11 +253,15 @@ def save_survey_preferences_and_check_for_recalculation(included_genres: list[st
 	previous_response_rows = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == current_user.id,
 	                                                           or_(UserGenrePreferences.survey_response == 0,
 	                                                               UserGenrePreferences.survey_response == 1)).all()
-	# if there are previous responses and/or at least one of the lists is not empty, the movie scores need to be
-	# recalculated
-	if previous_response_rows or (included_genres is not [] or excluded_genres is not []):
+	# get the genres whose inclusion or exclusion changed compared to the previous responses
+	previous_included_genres = {row.genre for row in previous_response_rows if row.survey_response == 1}
+	previous_excluded_genres = {row.genre for row in previous_response_rows if row.survey_response == 0}
+	changed_genres = ((previous_included_genres ^ set(included_genres)) |
+	                  (previous_excluded_genres ^ set(excluded_genres)))
+	# if at least one genre changed, the movie scores need to be recalculated for the movies with the changed genres
+	if changed_genres:
 		recalculation_needed_for = ('survey-based', 'hybrid')
-	# else (there are no previous responses and both lists are empty) no recalculation is needed
+	# else (the responses are the same as before) no recalculation is needed
 	else:
 		recalculation_needed_for = ()
 	# reset the rows that have survey responses saved
@@ -450,151 +308,98 @@ def save_survey_preferences_and_check_for_recalculation(included_genres: list[st
 			db.session.add(new_entry)
 			db.session.commit()
 
+	# note the changed genres after the responses were saved, so that a calculation that takes the changes sees the new
+	# responses
+	with score_tracking_lock:
+		if changed_genres and current_user.id in survey_changed_genres:
+			survey_changed_genres[current_user.id] |= changed_genres
+
 	return recalculation_needed_for
 # endregion
 
 
 # region survey-based
-def calculate_survey_based_scores():
+def calculate_survey_based_scores(user_id: int, changed_genres: set[str] = None):
 	"""
-	Calculates the survey_based_score attribute of UserMovieRecommendationScores corresponding to the current user. The
-	score depends on how many of the genres of the corresponding movie the user selected as liked in the preference
-	survey.
+	Calculates the survey_based_score attribute of UserMovieRecommendationScores corresponding to the user. The score
+	depends on how many of the genres of the corresponding movie the user selected as liked in the preference survey.
+	The scores are calculated at once from the shared movie features. If the genres whose survey response changed are
+	given, only the scores of the movies with these genres are calculated.
+
+	:param user_id: id of the user
+	:param changed_genres: genres whose survey response changed since the scores were last calculated (None = all movies
+			need to be calculated)
 	"""
 
-	global all_movie_ids
-	try:
-		all_movie_ids
-	except NameError:
-		all_movie_ids = None
-	if all_movie_ids is None:
-		all_movie_ids, _ = get_all_movies_and_users_ids()
-
-	# get a list of the ids of all movies the current user rated, excluding those they ignored
-	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == current_user.id,
+	movie_ids, genres, genre_matrix, genre_counts, _, _ = get_movie_features()
+	# if only some genres changed, restrict the calculation to the movies with these genres
+	if changed_genres is not None:
+		affected = get_genre_movie_mask(list(changed_genres))
+		if not numpy.any(affected):
+			return
+		movie_ids, genre_matrix, genre_counts = movie_ids[affected], genre_matrix[affected], genre_counts[affected]
+
+	# get a list of the ids of all movies the user rated, excluding those they ignored
+	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == user_id,
 	                                                MovieRating.ignored == 0).all()
 	movies_already_rated_ids = [m.movie_id for m in movies_already_rated]
-	# get a list of the ids of all movies the current user ignored
-	ignored_movies = MovieRating.query.filter(MovieRating.user_id == current_user.id,
+	# get a list of the ids of all movies the user ignored
+	ignored_movies = MovieRating.query.filter(MovieRating.user_id == user_id,
 	                                          MovieRating.ignored == 1).all()
 	ignored_movies_ids = [m.movie_id for m in ignored_movies]
+	# get a mask of the movies the user ignored or rated
+	excluded = get_movie_mask(movies_already_rated_ids + ignored_movies_ids)
 
-	# get the maximum amount of ratings from the database
+	# get the maximum amount of ratings from the database and the amount of ratings of each movie
 	max_amount_of_ratings = db.session.query(func.max(Movie.amount_of_ratings)).first()[0]
+	amounts_of_ratings, _ = get_movie_popularity()
+	if changed_genres is not None:
+		excluded, amounts_of_ratings = excluded[affected], amounts_of_ratings[affected]
 
 	# print("get survey preferences")
-	# get the preferences the current user selected in the preference survey
-	liked_genres, disliked_genres = get_survey_preferences()
-
-	# print("go through all movies to calculate the score")
-	# count = 0
-	new_scores = {}
-	# go through all movies
-	for movie in all_movie_ids:
-		# count += 1
-		# if count % 1000 == 0:
-		# print("loop count:", count)
-		# if count == len(all_movie_ids):
-		# print("last loop")
-		# if the current user ignored or rated the movie, set the score to 0.0
-		if movie in ignored_movies_ids or movie in movies_already_rated_ids:
-			score = 0.0
-		else:
-			# get the genres of the movie
-			movie_genres = get_movie_genres(movie)
-			# extract those genres the current user selected as disliked in the preference survey
-			disliked = [g for g in movie_genres if g in disliked_genres]
-			# if at least one of the movie genres was specified as disliked, set the score to 0.0
-			if disliked:
-				score = 0.0
-			# if none of the genres was specified as disliked, extract those genres the current user selected as liked
-			# in the preference survey
-			else:
-				liked = [g for g in movie_genres if g in liked_genres]
-				# if at least one of the movie genres was specified as liked, calculate the score of the movie
-				if liked:
-					# get the amount of ratings for the movie
-					amount_of_ratings = Movie.query.filter(Movie.id == movie).first().amount_of_ratings
-					# if it is None, set it to 0
-					if amount_of_ratings is None:
-						amount_of_ratings = 0
-					# half of the score is a factor determined by casting the amount of ratings of the movie
-					# to the score range from 0.0 to 1.0
-					# with the rating range being (0, max_amount_of_ratings) and the score range being (0.0, 1.0),
-					# the calculation is:
-					# ((amount_of_ratings - min_rating_range) / (max_rating_range - min_rating_range)) +
-					# (max_score_range - min_score_range) + min_score_range
-					# = ((amount_of_ratings - 0 / max_amount_of_ratings - 0)) + (1.0 - 0.0) + 0.0
-					# so simplified: (amount_of_ratings / max_amount_of_ratings)
-					score = round((0.5 * (len(liked) / len(movie_genres)) + 0.5 * (
-							amount_of_ratings / max_amount_of_ratings)), 2)
-				# if none of the movie genres was either disliked or liked, set the score to 0.0
-				else:
-					score = 0.0
-		# append the score to the dictionary
-		new_scores[movie] = score
-	# create a temporary table
-	try:
-		temp = Table("temp", db.metadata,
-		             Column("movie_id", db.Integer),
-		             Column("survey_based_score", db.Float),
-		             extend_existing=True
-		             )
-	except exc.InvalidRequestError:
-		temp = None
-	if temp is None:
-		temp = Table("temp", db.metadata,
-		             Column("movie_id", db.Integer),
-		             Column("survey_based_score", db.Float),
-		             extend_existing=True
-		             )
-	db.session.commit()
-	temp.create(bind=db.session.get_bind())
-
-	# insert the new movie scores
-	db.session.execute(
-		temp.insert().values([{"movie_id": k, "survey_based_score": v} for k, v in new_scores.items()]))
-
-	# update the UserMovieRecommendationScores entries corresponding to the current user
-	db.session.execute(UserMovieRecommendationScores.__table__.update().values(
-		survey_based_score=temp.c.survey_based_score).where(and_(
-		UserMovieRecommendationScores.__table__.c.movie_id == temp.c.movie_id,
-		UserMovieRecommendationScores.__table__.c.user_id == current_user.id)))
-	db.session.commit()
-
-	# drop the temporary table
-	temp.drop(bind=db.session.get_bind())
-
-
-def get_survey_based_recommendations(amount_of_results: int):
+	# get the preferences the user selected in the preference survey
+	liked_genres, disliked_genres = get_survey_preferences(user_id)
+
+	# get masks of the genres the user selected as liked and disliked in the preference survey and count the
+	# liked and disliked genres of each movie
+	liked_genre_mask = numpy.array([g in liked_genres for g in genres], dtype=float)
+	disliked_genre_mask = numpy.array([g in disliked_genres for g in genres], dtype=float)
+	amounts_of_liked = genre_matrix @ liked_genre_mask
+	amounts_of_disliked = genre_matrix @ disliked_genre_mask
+
+	# half of the score is the fraction of the movie genres that were specified as liked, the other half is a factor
+	# determined by casting the amount of ratings of the movie to the score range from 0.0 to 1.0
+	# with the rating range being (0, max_amount_of_ratings) and the score range being (0.0, 1.0),
+	# the calculation is:
+	# ((amount_of_ratings - min_rating_range) / (max_rating_range - min_rating_range)) +
+	# (max_score_range - min_score_range) + min_score_range
+	# = ((amount_of_ratings - 0 / max_amount_of_ratings - 0)) + (1.0 - 0.0) + 0.0
+	# so simplified: (amount_of_ratings / max_amount_of_ratings)
+	liked_fractions = numpy.divide(amounts_of_liked, genre_counts, out=numpy.zeros(len(genre_counts)),
+	                               where=genre_counts > 0)
+	scores = 0.5 * liked_fractions + 0.5 * (amounts_of_ratings / max_amount_of_ratings)
+	# round the scores like the built-in round function
+	scores = numpy.array([round(score, 2) for score in scores.tolist()])
+	# if none of the movie genres was specified as liked, if at least one of them was specified as disliked or if the
+	# current user ignored or rated the movie, set the score to 0.0
+	scores[(amounts_of_liked == 0) | (amounts_of_disliked > 0) | excluded] = 0.0
+	new_scores = dict(zip(movie_ids.tolist(), scores.tolist()))
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'survey_based_score', new_scores)
+
+
+def get_survey_based_recommendations(user_id: int, amount_of_results: int):
 	"""
 	Gets a set amount of movie recommendations based on the survey based score attribute in
 	UserMovieRecommendationsScores.
 
+	:param user_id: id of the user
 	:param amount_of_results: amount of results that should be returned
 	:return: survey_based_recommendations = list of Movie objects of the recommended movies
 	"""
 
-	# print("get survey-based recommendations by filtering the database")
-	# sort the UserMovieRecommendationScores entries corresponding to the current user by the item based score attribute
-	# in a descending manner and get the first amount_of_results entries and the corresponding movie ids
-	survey_based_recommendations = UserMovieRecommendationScores.query.filter(
-		UserMovieRecommendationScores.user_id == current_user.id
-		).order_by(UserMovieRecommendationScores.survey_based_score.desc()).limit(amount_of_results).all()
-
-	survey_based_recommendation_ids = [m.movie_id for m in survey_based_recommendations]
-
-	id_ordering = case(
-		{_id: index for index, _id in enumerate(survey_based_recommendation_ids)},
-		value=Movie.id
-		)
-
-	# print("get movie objects")
-	# get the corresponding Movie objects ordered by the survey based score attribute
-	survey_based_recommendations = Movie.query.filter(Movie.id.in_(survey_based_recommendation_ids)).order_by(
-		id_ordering).all()
-
-	return survey_based_recommendations
+	# get the Movie objects of the movies with the highest survey based score attribute of the user
+	return get_top_recommendations(user_id, 'survey_based_score', amount_of_results)
 # endregion
 
 
@@ -694,114 +499,76 @@ def add_or_update_user_preferences(movie_id: int, movie_rating: float):
 				                                              amount_of_likes=0, amount_of_dislikes=0)
 				db.session.add(new_decade_preference)
 				db.session.commit()
+
+	# the item-based scores of the movies that share a genre or the decade with the movie need to be updated (noted
+	# after the preferences were saved, so that a calculation that takes the changes sees the new preferences)
+	register_item_based_change(movie_id)
 # endregion
 
 
 # region user-based
-def calculate_euclidean_distance_between_vectors(vector1: list[float], vector2: list[float]):
+def get_neighbours(user_id: int, max_distance: float, amount_of_neighbours: int = None, metric: str = 'euclidean'):
 	"""
-	Calculates the euclidean distance between two vectors.
-
-	:param vector1: first vector
-	:param vector2: second vector
-	:return: euclidean_distance - euclidean distance between the vectors
+	Gets users for which the distance of the rating vector and the user's rating vector is at most the given value. The
+	distances to all users are calculated at once from the shared rating matrix with the given similarity metric (see
+	similarity_metrics in similarity.py), only considering the movies both users rated. If amount_of_neighbours is set,
+	the amount_of_neighbours nearest users are gotten from the approximate nearest-neighbour index instead, so that not
+	all users need to be compared to the user. The neighbours are persisted in the neighbour cache and reused until the
+	user's ratings change materially.
+
+	:param user_id: id of the user
+	:param max_distance: the maximum distance between the rating vectors of similar users and the user that is allowed
+	:param amount_of_neighbours: amount of nearest users that should be gotten instead of all users within max_distance
+	:param metric: name of the similarity metric
+	:return: user_ids - array of the ids of the neighbours sorted by the distance in an increasing manner,
+			distances - array of the corresponding distances
 	"""
 
-	# reshape the vectors for the euclidean distance calculation
-	vector1_2d = numpy.array(vector1).reshape(1, -1)
-	vector2_2d = numpy.array(vector2).reshape(1, -1)
-
-	# calculate the euclidean distance while ignoring NaN entries
-	euclidean_distance = nan_euclidean_distances(vector1_2d, vector2_2d)
-
-	return euclidean_distance
-
+	# get the neighbours from the neighbour cache if the cached entry is still valid
+	user_ids, distances = get_cached_neighbours(user_id, metric, max_distance, amount_of_neighbours)
 
-def get_user_ratings_vector(user_id: int, movie_ids: list[int]):
-	"""
-	Gets a sparse vector of a user's ratings for a list of movies.
-
-	:param user_id: id of the user the vector should be gotten of
-	:param movie_ids: list of the ids of the movies the user's ratings should be added to the vector of
-	:return: user_rating_vector - list of the user's ratings (or NaN) corresponding to the movies
-	"""
+	if user_ids is None:
+		# if the amount of neighbours is set, get the nearest users from the approximate nearest-neighbour index
+		if amount_of_neighbours is not None:
+			user_ids, distances = get_nearest_users(user_id, amount_of_neighbours, metric)
+		else:
+			# calculate the distances between all users and the user based on the user's exact ratings
+			distances = calculate_user_distances(user_id, metric)
+			_, users, _ = get_rating_matrix(user_id)
+			user_ids = numpy.array(list(users.keys()))
 
-	# get all MovieRating entries corresponding to the user
-	user_ratings = MovieRating.query.filter(MovieRating.user_id == user_id, MovieRating.ignored == 0).order_by(
-		MovieRating.movie_id).all()
-	rated_movies_ids = [m.movie_id for m in user_ratings]
-	user_movie_ratings = [m.rating for m in user_ratings]
+			# only keep users within the maximum distance (ignoring the user themselves and users the distance is not
+			# defined for) and sort them by the distance in an increasing manner
+			valid = ~numpy.isnan(distances) & (user_ids != user_id) & (distances <= max_distance)
+			user_ids, distances = user_ids[valid], distances[valid]
+			order = numpy.argsort(distances, kind="stable")
+			user_ids, distances = user_ids[order], distances[order]
 
-	user_rating_vector = []
-	# go through each movie
-	for movie in movie_ids:
-		# if there is a rating by the user for that movie, append the rating to the vector
-		if movie in rated_movies_ids:
-			user_rating_vector.append(user_movie_ratings[rated_movies_ids.index(movie)])
-		# if there is no rating, append NaN instead
-		else:
-			user_rating_vector.append(math.nan)
+		# save the neighbours in the neighbour cache
+		save_neighbours(user_id, user_ids, distances, metric, max_distance, amount_of_neighbours)
 
-	return user_rating_vector
+	return user_ids, distances
 
 
-def get_similar_users(max_distance: int):
+def get_similar_users(user_id: int, max_distance: float, amount_of_neighbours: int = None, metric: str = 'euclidean'):
 	"""
-	Gets users for which the euclidean distance of the rating vector and the current user's rating vector is at most the
-	given value.
-
-	:param max_distance: the maximum distance between the rating vectors of similar users and the current user that is
-			allowed
-	:return: exact_matches - users for which the distance between the rating vector and the current user's rating
-			vector is 0,
-			most_similar_users - remaining users for which the distance is at most max_distance
+	Gets the neighbours of the user (see get_neighbours) split into exact matches and most similar users.
+
+	:param user_id: id of the user
+	:param max_distance: the maximum distance between the rating vectors of similar users and the user that is allowed
+	:param amount_of_neighbours: amount of nearest users that should be gotten instead of all users within max_distance
+	:param metric: name of the similarity metric
+	:return: exact_matches - users for which the distance between the rating vector and the user's rating vector is 0,
+			most_similar_users - remaining users for which the distance is at most max_distance (or the remaining
+			nearest users if amount_of_neighbours is set)
 	"""
 
-	# get the ids of all movies there are ratings of and all user ids
-	global all_movie_ids_rated, all_user_ids
-	try:
-		all_movie_ids_rated
-	except NameError:
-		all_movie_ids_rated = None
-	if all_movie_ids_rated is None:
-		all_movie_ids_rated = get_all_rated_movies_ids()
-	try:
-		all_user_ids
-	except NameError:
-		all_user_ids = None
-	if all_user_ids is None or current_user.id not in all_user_ids:
-		_, all_user_ids = get_all_movies_and_users_ids()
-
-	# create a matrix of the user rating vectors
-	user_movie_matrix = []
-	# get the user rating vectors for each user
-	for user in all_user_ids:
-		user_movie_matrix.append(get_user_ratings_vector(user, all_movie_ids_rated))
-
-	# calculate the similarity between all users and the current user
-	user_distances = []
-	# go through all users and ignore the current user
-	for user in all_user_ids:
-		if user != current_user.id:
-			# calculate the euclidean distance between the user's and the current user's rating vectors
-			distance = calculate_euclidean_distance_between_vectors(
-				user_movie_matrix[all_user_ids.index(current_user.id)],
-				user_movie_matrix[all_user_ids.index(user)]).flatten().flatten()[0]
-			# if the distance is not NaN save the distance in a list
-			if not math.isnan(distance):
-				user_distances.append([user, distance])
-
-	# sort the distances in an increasing manner
-	user_similarities_sorted = sorted(user_distances, key=lambda x: x[1], reverse=False)
-
-	# get the exact matches (i.e. distance is 0) and the most similar users (i.e. 0 < distance <= max_distance)
-	most_similar_users = []
-	exact_matches = []
-	for user in user_similarities_sorted:
-		if user[1] == 0.0:
-			exact_matches.append(user[0])
-		elif user[1] <= max_distance:
-			most_similar_users.append(user[0])
+	user_ids, distances = get_neighbours(user_id, max_distance, amount_of_neighbours, metric)
+
+	# get the exact matches (i.e. distance is 0) and the most similar users (i.e. distance > 0, within max_distance
+	# unless the nearest users from the index are used)
+	exact_matches = user_ids[distances == 0.0].tolist()
+	most_similar_users = user_ids[distances > 0.0].tolist()
 
 	# print("exact matches:", exact_matches)
 	# print("similar users:", most_similar_users)
@@ -809,334 +576,606 @@ def get_similar_users(max_distance: int):
 	return exact_matches, most_similar_users
 
 
-def calculate_user_based_scores(min_rating_for_rec: float):
+def calculate_user_based_scores(user_id: int, min_rating_for_rec: float, amount_of_neighbours: int = None,
+                                metric: str = 'euclidean', confidence_weight: float = 1.0):
+	"""
+	Calculates the user_based_score attribute of UserMovieRecommendationScores corresponding to the user. For every
+	movie, the ratings of the user's neighbours (see get_neighbours) are averaged in one pass over the rating matrix,
+	weighted by their similarity to the user (max_distance / (max_distance + distance), i.e. 1.0 for exact matches and
+	0.5 at the maximum distance of the similarity metric). A predicted rating of min_rating_for_rec - 1 or lower results
+	in a score of 0.0, a predicted rating of 5.0 in a score of 1.0, and the score is lowered for movies that only a few
+	(or only less similar) neighbours rated.
+
+	:param user_id: id of the user
+	:param min_rating_for_rec: minimum rating a movie needs to have so that it is deemed as liked
+	:param amount_of_neighbours: amount of nearest users that should be considered as similar users instead of all
+			users within the maximum distance (None to use the maximum distance)
+	:param metric: name of the similarity metric that is used to find similar users
+	:param confidence_weight: sum of the weights of the neighbours who rated a movie at which its score is halved
 	"""
-	Calculates the user_based_score attribute of UserMovieRecommendationScores corresponding to the current user. The
-	score depends on whether the corresponding movie was liked by exact matches or most similar users of the current
-	user that are determined by get_similar_users(max_distance).
 
-	:param min_rating_for_rec: minimum rating exact matches/similar users need to have given a movie so that it is
-			deemed as liked and considered for the recommendation for the current user
+	# print("get similar users")
+	# get the ids of similar users and their distances to the user and weight them by their similarity
+	max_distance = similarity_metrics[metric]['max_distance']
+	user_ids, distances = get_neighbours(user_id, max_distance, amount_of_neighbours, metric)
+	weights = max_distance / (max_distance + distances)
+
+	# print("predict ratings from similar users")
+	# get the similarity-weighted average rating of every movie over the neighbours and map it to a score between 0.0
+	# and 1.0 that is lowered by the confidence in the average
+	predictions, weight_sums = get_weighted_average_ratings(user_ids.tolist(), weights)
+	lowest_rating = min_rating_for_rec - 1
+	scores = (numpy.clip((predictions - lowest_rating) / (5.0 - lowest_rating), 0.0, 1.0) *
+	          weight_sums / (weight_sums + confidence_weight))
+	new_scores = dict(zip(get_movie_ids().tolist(), numpy.round(scores, 2).tolist()))
+
+	# set the scores of all movies the user rated or ignored to 0.0
+	rated_or_ignored_movies = (db.session.query(MovieRating.movie_id)
+	                           .filter(MovieRating.user_id == user_id).all())
+	for m in rated_or_ignored_movies:
+		if m.movie_id in new_scores:
+			new_scores[m.movie_id] = 0.0
+
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'user_based_score', new_scores)
+
+
+def calculate_latent_factor_user_based_scores(user_id: int, min_rating_for_rec: float):
 	"""
+	Calculates the user_based_score attribute of UserMovieRecommendationScores corresponding to the user from the
+	ratings predicted by the offline-trained latent factor model (see latent_factors.py). A predicted rating of
+	min_rating_for_rec - 1 or lower results in a score of 0.0, a predicted rating of 5.0 in a score of 1.0.
 
-	# get a list of the ids of all movies the current user rated, excluding those they ignored
-	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == current_user.id,
-	                                                MovieRating.ignored == 0).all()
-	movies_already_rated_ids = [m.movie_id for m in movies_already_rated]
-	# get a list of the ids of all movies the current user ignored
-	ignored_movies = MovieRating.query.filter(MovieRating.user_id == current_user.id,
-	                                          MovieRating.ignored == 1).all()
-	ignored_movies_ids = [m.movie_id for m in ignored_movies]
+	:param user_id: id of the user
+	:param min_rating_for_rec: minimum rating a movie needs to have so that it is deemed as liked
+	"""
 
-	# print("get similar users")
-	# get the ids of similar users and the euclidean distance between their rating vector and the current user's
-	# rating vector
-	exact_matches, most_similar_users_ids = get_similar_users(max_distance=30)
-
-	# print("get movies from exact matches")
-	# get the ids of all movies that exact matches liked, excluding those that the current user rated or ignored
-	unrated_movies_exact_matches_liked = MovieRating.query.filter(
-		MovieRating.user_id.in_(exact_matches),
-		MovieRating.movie_id.not_in(movies_already_rated_ids),
-		MovieRating.ignored == 0,
-		MovieRating.rating >= min_rating_for_rec
-		).all()
-	unrated_movies_exact_matches_liked_ids = [m.movie_id for m in unrated_movies_exact_matches_liked]
-
-	# print("update movie score for these movies to 1.0")
-	# update the user based score attribute of these movies to 1.0
-	(db.session.query(UserMovieRecommendationScores).filter(
-		UserMovieRecommendationScores.user_id == current_user.id,
-		UserMovieRecommendationScores.movie_id.in_(unrated_movies_exact_matches_liked_ids)
-		).update({'user_based_score': 1.0}))
-	db.session.commit()
+	# predict the user's ratings of all movies of the model and map them to scores between 0.0 and 1.0
+	movie_ids, predictions = predict_ratings(user_id)
+	lowest_rating = min_rating_for_rec - 1
+	scores = numpy.round(numpy.clip((predictions - lowest_rating) / (5.0 - lowest_rating), 0.0, 1.0), 2)
+	new_scores = dict(zip(movie_ids.tolist(), scores.tolist()))
 
-	# print("get movies from similar users")
-	# get the ids of all movies that similar users liked, excluding those that the current user rated or ignored
-	unrated_movies_similar_users_liked = MovieRating.query.filter(
-		MovieRating.user_id.in_(most_similar_users_ids),
-		MovieRating.movie_id.not_in(movies_already_rated_ids),
-		MovieRating.ignored == 0,
-		MovieRating.rating >= min_rating_for_rec
-		).all()
-	unrated_movies_similar_users_liked_ids = [m.movie_id for m in unrated_movies_similar_users_liked]
-
-	# print("update movie score for these movies to 0.5")
-	# update the user based score attribute of these movies to 0.75
-	(db.session.query(UserMovieRecommendationScores).filter(
-		UserMovieRecommendationScores.user_id == current_user.id,
-		UserMovieRecommendationScores.movie_id.in_(unrated_movies_similar_users_liked_ids),
-		UserMovieRecommendationScores.movie_id.not_in(unrated_movies_exact_matches_liked_ids)
-		).update({'user_based_score': 0.75}))
-	db.session.commit()
+	# set the scores of all movies the user rated or ignored to 0.0
+	rated_or_ignored_movies = (db.session.query(MovieRating.movie_id)
+	                           .filter(MovieRating.user_id == user_id).all())
+	for m in rated_or_ignored_movies:
+		if m.movie_id in new_scores:
+			new_scores[m.movie_id] = 0.0
 
-	# print("reset all movies rated by the user to 0.0")
-	# update the user based score attribute of all ignored and rated movies to 0.0
-	all_rated_movies_by_user, _ = get_all_rated_movies_by_current_user()
-	all_rated_movies_by_user_ids = [m.id for m in all_rated_movies_by_user]
-	(db.session.query(UserMovieRecommendationScores).filter(
-		UserMovieRecommendationScores.user_id == current_user.id,
-		or_(UserMovieRecommendationScores.movie_id.in_(all_rated_movies_by_user_ids),
-		    UserMovieRecommendationScores.movie_id.in_(ignored_movies_ids))
-		).update({'user_based_score': 0.0}))
-	db.session.commit()
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'user_based_score', new_scores)
 
 
-def get_user_based_recommendations(amount_of_results: int):
+def get_user_based_recommendations(user_id: int, amount_of_results: int):
 	"""
 	Gets a set amount of movie recommendations based on the user based score attribute in
 	UserMovieRecommendationsScores.
 
+	:param user_id: id of the user
 	:param amount_of_results: amount of results that should be returned
 	:return: user_based_recommendations - list of Movie objects of the recommended movies
 	"""
 
-	# print("get user-based recommendations by filtering the database")
-	# sort the UserMovieRecommendationScores entries corresponding to the current user by the user based score attribute
-	# in a descending manner and get the first amount_of_results entries and the corresponding movie ids
-	user_based_recommendations_ids = UserMovieRecommendationScores.query.filter(
-		UserMovieRecommendationScores.user_id == current_user.id
-		).order_by(UserMovieRecommendationScores.user_based_score.desc()).limit(amount_of_results).all()
+	# get the Movie objects of the movies with the highest user based score attribute of the user
+	return get_top_recommendations(user_id, 'user_based_score', amount_of_results)
+# endregion
 
-	user_based_recommendations_ids = [m.movie_id for m in user_based_recommendations_ids]
 
-	id_ordering = case(
-		{_id: index for index, _id in enumerate(user_based_recommendations_ids)},
-		value=Movie.id
-		)
+# region item-based
+def register_item_based_change(movie_id: int):
+	"""
+	Notes that the rating or the ignored status of a movie changed for the current user, so that the next calculation of
+	the item-based scores only needs to update the movies affected by the change. The changes are noted per process, so
+	this relies on all changes of a user being handled by the same process (like score_recalculation_needed_for).
 
-	# print("get the corresponding Movie objects")
-	# get the corresponding Movie objects ordered by the user based score attribute
-	user_based_recommendations = (Movie.query.filter(Movie.id.in_(user_based_recommendations_ids))
-	                              .order_by(id_ordering).all())
+	:param movie_id: id of the movie that changed
+	"""
 
-	return user_based_recommendations
-# endregion
+	# if the item-based scores were not calculated yet, all scores are calculated anyway
+	with score_tracking_lock:
+		if current_user.id in item_based_changed_movies:
+			item_based_changed_movies[current_user.id].add(int(movie_id))
 
 
-# region item-based
-def calculate_item_based_scores(genre_ratios: dict[any, list], decade_ratios: dict[any, list]):
+def calculate_item_based_scores(user_id: int, genre_ratios: dict[any, list], decade_ratios: dict[any, list],
+                                changed_movie_ids: set[int] = None):
 	"""
-	Calculates the item_based_score attribute of UserMovieRecommendationScores corresponding to the current user. The
-	score depends on how well the genres and the release year of the corresponding movie fit the current user's
-	preferences
+	Calculates the item_based_score attribute of UserMovieRecommendationScores corresponding to the user. The score
+	depends on how well the genres and the release year of the corresponding movie fit the user's preferences. The
+	scores are calculated at once from the shared movie features. If the ids of the movies whose rating or ignored
+	status changed are given, only the scores of these movies and of the movies that share a genre or the decade with
+	them are calculated, as the ratios of the other genres and decades did not change.
 
+	:param user_id: id of the user
 	:param genre_ratios: dictionary with genres as keys and a list of the "liked" and the "disliked" ratio as values
 	:param decade_ratios: dictionary with decades as keys and a list of the "liked" and the "disliked" ratio as values
+	:param changed_movie_ids: ids of the movies that changed since the scores were last calculated (None = all movies
+			need to be calculated)
 	"""
 
-	global all_movie_ids
-	try:
-		all_movie_ids
-	except NameError:
-		all_movie_ids = None
-	if all_movie_ids is None:
-		all_movie_ids, _ = get_all_movies_and_users_ids()
-
-	# get a list of the ids of all movies the current user rated, excluding those they ignored
-	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == current_user.id,
+	movie_ids, genres, genre_matrix, genre_counts, missing_genre, decades = get_movie_features()
+
+	# if only some movies changed, restrict the calculation to the movies that share a genre or the decade with them
+	if changed_movie_ids is not None:
+		changed = get_movie_mask(list(changed_movie_ids))
+		changed_genres = numpy.asarray(genre_matrix[changed].sum(axis=0)).ravel() > 0
+		changed_decades = numpy.unique(decades[changed & ~numpy.isnan(decades)])
+		affected = changed | (genre_matrix @ changed_genres.astype(float) > 0) | numpy.isin(decades, changed_decades)
+		if not numpy.any(affected):
+			return
+		movie_ids, genre_matrix, genre_counts, missing_genre, decades = (
+			movie_ids[affected], genre_matrix[affected], genre_counts[affected], missing_genre[affected],
+			decades[affected])
+
+	# get a list of the ids of all movies the user rated, excluding those they ignored
+	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == user_id,
 	                                                MovieRating.ignored == 0).all()
 	movies_already_rated_ids = [m.movie_id for m in movies_already_rated]
-	# get a list of the ids of all movies the current user ignored
-	ignored_movies = MovieRating.query.filter(MovieRating.user_id == current_user.id,
+	# get a list of the ids of all movies the user ignored
+	ignored_movies = MovieRating.query.filter(MovieRating.user_id == user_id,
 	                                          MovieRating.ignored == 1).all()
 	ignored_movies_ids = [m.movie_id for m in ignored_movies]
+	# get a mask of the movies the user ignored or rated
+	excluded = get_movie_mask(movies_already_rated_ids + ignored_movies_ids)
+	if changed_movie_ids is not None:
+		excluded = excluded[affected]
+
 	# print("GENRES")
 	# region genres
-	# count = 0
-	new_scores = {}
-	# go through all movies
-	for movie in all_movie_ids:
-		# count += 1
-		# if count % 1000 == 0:
-		# print("loop count:", count)
-		# if count == len(all_movie_ids):
-		# print("last loop")
-		# if the current user ignored or rated the movie, set the score to 0.0
-		if movie in ignored_movies_ids or movie in movies_already_rated_ids:
-			score = 0.0
-		else:
-			# get all genres of the movie
-			movie_genres = get_movie_genres(movie)
-			amount_of_genres = len(movie_genres)
-			score = 0.0
-			# go through each genre
-			for genre in movie_genres:
-				# if no genre is listed, add a small score for recommendation to not exclude it
-				if genre is None:
-					score = 0.25
-					break
-				# increase the score by a proportional factor based on the current user's genre ratios
-				# e.g. if the user liked 40% of the Comedy movies they rated and disliked 60% of them,
-				# and the movie has 4 genres in total, the factor would be: (1/4) * max(0, (1 * 0.4 + (-1) * 0.6))
-				# = (1/4) * max(0, (-0.2)) = 0
-				else:
-					score += (1 / amount_of_genres) * (1 * genre_ratios[genre][0] + (-1) * genre_ratios[genre][1])
-		# append the score to the dictionary
-		new_scores[movie] = round(score, 2)
+	# increase the score of each movie by a proportional factor for each of its genres based on the user's genre
+	# ratios
+	# e.g. if the user liked 40% of the Comedy movies they rated and disliked 60% of them,
+	# and the movie has 4 genres in total, the factor would be: (1/4) * max(0, (1 * 0.4 + (-1) * 0.6))
+	# = (1/4) * max(0, (-0.2)) = 0
+	# (the genre matrix keeps the order of the genres of each movie, so the factors are summed up in the same order as
+	# they would be when going through the genres of each movie)
+	genre_ratio_differences = numpy.array([1 * genre_ratios[g][0] + (-1) * genre_ratios[g][1] for g in genres])
+	weights = numpy.divide(1, genre_counts, out=numpy.zeros(len(genre_counts)), where=genre_counts > 0)
+	weighted_genre_matrix = csr_matrix((genre_matrix.data * numpy.repeat(weights, numpy.diff(genre_matrix.indptr)),
+	                                    genre_matrix.indices, genre_matrix.indptr), shape=genre_matrix.shape)
+	genre_scores = weighted_genre_matrix @ genre_ratio_differences
+	# if no genre is listed, add a small score for recommendation to not exclude it
+	genre_scores[missing_genre] = 0.25
+	# if the user ignored or rated the movie, set the score to 0.0
+	genre_scores[excluded] = 0.0
+	# round the scores like the built-in round function
+	genre_scores = numpy.array([round(score, 2) for score in genre_scores.tolist()])
 	# endregion
 
 	# print("DECADES")
 	# region release years
-	# count = 0
-	# go through all movies
-	for movie in all_movie_ids:
-		# count += 1
-		# if count % 1000 == 0:
-		# print("loop count:", count)
-		# if count == len(all_movie_ids):
-		# print("last loop")
-		# if the current user ignored or rated the movie, set the score to 0.0
-		if movie in ignored_movies_ids or movie in movies_already_rated_ids:
-			score = 0.0
-		else:
-			# get the release year of the movie
-			year = Movie.query.filter(Movie.id == movie).first().release_year
-			if year is not None:
-				# get the corresponding decade
-				decade = math.floor(year / 10) * 10
-				# calculate the score based on the current user's decade ratios
-				score = 1 * (1 * decade_ratios[decade][0] + (-1) * decade_ratios[decade][1])
-			else:
-				# if movie does not have a release year, add a small score for recommendation to not exclude it
-				score = 0.25
-		# if the genre-based movie score + the calculated decade-based score is not between 0.0 and 1.0, cast it
-		if new_scores[movie] + score > 1.0:
-			new_scores[movie] = 1.0
-		elif new_scores[movie] + score < 0.0:
-			new_scores[movie] = 0.0
-		# else append the sum to the dictionary
-		else:
-			new_scores[movie] = round((new_scores[movie] + score), 2)
-	# create a temporary table
-	try:
-		temp = Table("temp", db.metadata,
-		             Column("movie_id", db.Integer),
-		             Column("item_based_score", db.Float),
-		             extend_existing=True
-		             )
-	except exc.InvalidRequestError:
-		temp = None
-	if temp is None:
-		temp = Table("temp", db.metadata,
-		             Column("movie_id", db.Integer),
-		             Column("item_based_score", db.Float),
-		             extend_existing=True
-		             )
-	db.session.commit()
-	temp.create(bind=db.session.get_bind())
-
-	# insert the dictionary with the new scores
-	db.session.execute(
-		temp.insert().values([{"movie_id": k, "item_based_score": v} for k, v in new_scores.items()]))
-
-	# update the UserMovieRecommendationScores entries that correspond the current user
-	db.session.execute(UserMovieRecommendationScores.__table__.update().values(
-		item_based_score=temp.c.item_based_score).where(and_(
-		UserMovieRecommendationScores.__table__.c.movie_id == temp.c.movie_id,
-		UserMovieRecommendationScores.__table__.c.user_id == current_user.id)))
-	db.session.commit()
+	# calculate the score based on the user's decade ratios
+	decade_ratio_differences = {decade: 1 * (1 * ratios[0] + (-1) * ratios[1])
+	                            for decade, ratios in decade_ratios.items()}
+	decade_scores = numpy.array([0.0 if numpy.isnan(d) else decade_ratio_differences.get(int(d), 0.0)
+	                             for d in decades.tolist()])
+	# if movie does not have a release year, add a small score for recommendation to not exclude it
+	decade_scores[numpy.isnan(decades)] = 0.25
+	# if the user ignored or rated the movie, set the score to 0.0
+	decade_scores[excluded] = 0.0
+
+	# if the genre-based movie score + the calculated decade-based score is not between 0.0 and 1.0, cast it, else
+	# round the sum
+	total_scores = genre_scores + decade_scores
+	rounded_scores = numpy.array([round(score, 2) for score in total_scores.tolist()])
+	scores = numpy.where(total_scores > 1.0, 1.0, numpy.where(total_scores < 0.0, 0.0, rounded_scores))
+	new_scores = dict(zip(movie_ids.tolist(), scores.tolist()))
+	# endregion
 
-	# drop the temporary table
-	temp.drop(bind=db.session.get_bind())
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'item_based_score', new_scores)
 
 
-def get_item_based_recommendations(amount_of_results: int):
+def get_item_based_recommendations(user_id: int, amount_of_results: int):
 	"""
 	Gets a set amount of movie recommendations based on the item based score attribute in
 	UserMovieRecommendationsScores.
 
+	:param user_id: id of the user
 	:param amount_of_results: amount of results that should be returned
 	:return: item_based_recommendations - list of Movie objects of the recommended movies
 	"""
 
-	# print("get item-based recommendations by filtering the database")
-	# sort the UserMovieRecommendationScores entries corresponding to the current user by the item based score attribute
-	# in a descending manner and get the first amount_of_results entries and the corresponding movie ids
-	item_based_recommendations_ids = UserMovieRecommendationScores.query.filter(
-		UserMovieRecommendationScores.user_id == current_user.id
-		).order_by(UserMovieRecommendationScores.item_based_score.desc()).limit(amount_of_results).all()
+	# get the Movie objects of the movies with the highest item based score attribute of the user
+	return get_top_recommendations(user_id, 'item_based_score', amount_of_results)
+# endregion
 
-	item_based_recommendations_ids = [m.movie_id for m in item_based_recommendations_ids]
 
-	id_ordering = case(
-		{_id: index for index, _id in enumerate(item_based_recommendations_ids)},
-		value=Movie.id
-		)
+# region item-collaborative
+def calculate_item_collaborative_scores(user_id: int, min_rating_for_rec: float):
+	"""
+	Calculates the item_collaborative_score attribute of UserMovieRecommendationScores corresponding to the user. The
+	score depends on how similar the ratings of the corresponding movie are to the ratings of the movies the current
+	user liked, based on the neighbours in the item neighbour index (see item_similarity.py).
+
+	:param user_id: id of the user
+	:param min_rating_for_rec: minimum rating the user needs to have given a movie so that it is deemed as liked
+	"""
+
+	# get the scores of all movies of the index
+	movie_ids, scores = predict_item_collaborative_scores(user_id, min_rating_for_rec)
+	new_scores = dict(zip(movie_ids.tolist(), numpy.round(scores, 2).tolist()))
+
+	# set the scores of all movies the user rated or ignored to 0.0
+	rated_or_ignored_movies = (db.session.query(MovieRating.movie_id)
+	                           .filter(MovieRating.user_id == user_id).all())
+	for m in rated_or_ignored_movies:
+		if m.movie_id in new_scores:
+			new_scores[m.movie_id] = 0.0
+
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'item_collaborative_score', new_scores)
+
+
+def get_item_collaborative_recommendations(user_id: int, amount_of_results: int):
+	"""
+	Gets a set amount of movie recommendations based on the item collaborative score attribute in
+	UserMovieRecommendationsScores.
+
+	:param user_id: id of the user
+	:param amount_of_results: amount of results that should be returned
+	:return: item_collaborative_recommendations - list of Movie objects of the recommended movies
+	"""
 
-	# print("get the corresponding Movie objects")
-	# get the corresponding Movie objects ordered by the item based score attribute
-	item_based_recommendations = Movie.query.filter(
-		Movie.id.in_(item_based_recommendations_ids),
-		).order_by(id_ordering).all()
+	# get the Movie objects of the movies with the highest item collaborative score attribute of the user
+	return get_top_recommendations(user_id, 'item_collaborative_score', amount_of_results)
+# endregion
+
+
+# region tag-based
+def calculate_tag_based_scores(user_id: int, min_rating: float):
+	"""
+	Calculates the tag_based_score attribute of UserMovieRecommendationScores corresponding to the user. The score
+	depends on how similar the tags of the corresponding movie are to the tags of the movies the user liked, based on
+	the TF-IDF matrix of the tags (see tag_features.py).
+
+	:param user_id: id of the user
+	:param min_rating: minimum rating the user needs to have given a movie so that it is deemed as liked
+	"""
+
+	# get the scores of all movies
+	movie_ids, scores = predict_tag_based_scores(user_id, min_rating)
+	scores = numpy.round(scores, 2)
+
+	# set the scores of all movies the user rated or ignored to 0.0
+	rated_or_ignored_movies = (db.session.query(MovieRating.movie_id)
+	                           .filter(MovieRating.user_id == user_id).all())
+	scores[get_movie_mask([m.movie_id for m in rated_or_ignored_movies])] = 0.0
+	new_scores = dict(zip(movie_ids.tolist(), scores.tolist()))
+
+	# save the scores with a single bulk update
+	save_scores_of_user(user_id, 'tag_based_score', new_scores)
+
+
+def get_tag_based_recommendations(user_id: int, amount_of_results: int):
+	"""
+	Gets a set amount of movie recommendations based on the tag based score attribute in
+	UserMovieRecommendationsScores.
+
+	:param user_id: id of the user
+	:param amount_of_results: amount of results that should be returned
+	:return: tag_based_recommendations - list of Movie objects of the recommended movies
+	"""
 
-	return item_based_recommendations
+	# get the Movie objects of the movies with the highest tag based score attribute of the user
+	return get_top_recommendations(user_id, 'tag_based_score', amount_of_results)
 # endregion
 
 
 # region hybrid
-def calculate_hybrid_scores():
+def calculate_hybrid_scores(user_id: int, survey_entries: bool):
 	"""
-	Calculates the total_recommendation_score attribute of UserMovieRecommendationScores corresponding to the current
-	user. The score is a weighted sum of the survey-based, user-based, item-based and exploration-based score of a
-	movie if the current user submitted the preference survey, or of the user-based, item-based and exploration-based
-	score of a movie.
+	Calculates the total_recommendation_score attribute of UserMovieRecommendationScores corresponding to the user. The
+	score is a weighted sum of the scores of the components the hybrid component depends on, with the weights declared
+	in score_components (one set of weights for users who submitted the preference survey and one for users who did
+	not).
+
+	:param user_id: id of the user
+	:param survey_entries: whether the user submitted the preference survey
 	"""
 
 	# print("go through all movies to calculate weighted scores")
-	# if there are survey entries by the current user, calculate the score based on the corresponding survey-based,
-	# user-based, item-based and exploration-based score and update the entry
-	if check_whether_there_are_survey_entries():
-		# print("4-part calculation (including survey-based scores)")
-		(db.session.query(UserMovieRecommendationScores).filter(
-			UserMovieRecommendationScores.user_id == current_user.id).update(
-			{'total_recommendation_score': func.round(0.25 * UserMovieRecommendationScores.survey_based_score +
-			                                          0.15 * UserMovieRecommendationScores.exploration_based_score +
-			                                          0.3 * UserMovieRecommendationScores.user_based_score +
-			                                          0.3 * UserMovieRecommendationScores.item_based_score, 2)}))
-	# if there are no survey entries by the current user, calculate the score based on the corresponding user-based,
-	# item-based and exploration-based score instead and update the entry
-	else:
-		# print("3-part calculation (without survey-based scores)")
-		(db.session.query(UserMovieRecommendationScores).filter(
-			UserMovieRecommendationScores.user_id == current_user.id).update(
-			{'total_recommendation_score': func.round(0.2 * UserMovieRecommendationScores.exploration_based_score +
-			                                          0.4 * UserMovieRecommendationScores.user_based_score +
-			                                          0.4 * UserMovieRecommendationScores.item_based_score, 2)}))
-	db.session.commit()
+	# get the weights of the components in the order they are listed as dependencies, leaving out the components that
+	# do not contribute (e.g. the survey-based scores if there are no survey entries)
+	weights = {}
+	for name in score_components['hybrid']['dependencies']:
+		weight = score_components[name]['hybrid_weights'][0 if survey_entries else 1]
+		if weight:
+			weights[score_components[name]['output']] = weight
+	combine_scores(user_id, weights, 'total_recommendation_score')
 
 
-def get_hybrid_recommendations(amount_of_results):
+def get_hybrid_recommendations(user_id: int, amount_of_results):
 	"""
 	Gets a set amount of movie recommendations based on the total recommendation score attribute in
 	UserMovieRecommendationsScores.
 
+	:param user_id: id of the user
 	:param amount_of_results: amount of results that should be returned
 	:return: hybrid_recommendations = list of Movie objects of the recommended movies
 	"""
 
-	# get movies by score from the database
-	# print("get hybrid recommendations by filtering the database")
-	# sort the UserMovieRecommendationScores entries corresponding to the current user by the total recommendation score
-	# attribute in a descending manner and get the first amount_of_results entries and the corresponding movie ids
-	hybrid_recommendations_ids = UserMovieRecommendationScores.query.filter(
-		UserMovieRecommendationScores.user_id == current_user.id
-		).order_by(UserMovieRecommendationScores.total_recommendation_score.desc()).limit(amount_of_results).all()
+	# get the Movie objects of the movies with the highest total recommendation score attribute of the user
+	return get_top_recommendations(user_id, 'total_recommendation_score', amount_of_results)
+# endregion
 
-	hybrid_recommendations_ids = [m.movie_id for m in hybrid_recommendations_ids]
 
-	id_ordering = case(
-		{_id: index for index, _id in enumerate(hybrid_recommendations_ids)},
-		value=Movie.id
-		)
+# region scoring pipeline
+def get_ids_of_movies_already_rated(user_id: int):
+	"""
+	Gets the ids of all movies the user rated, excluding those they ignored.
 
-	# print("get corresponding Movie objects")
-	# get the corresponding Movie objects ordered by the total recommendation score attribute
-	hybrid_recommendations = Movie.query.filter(
-		Movie.id.in_(hybrid_recommendations_ids),
-		).order_by(id_ordering).all()
+	:param user_id: id of the user
+	:return: list of movie ids
+	"""
+
+	return [rating.movie_id for rating in MovieRating.query.filter(MovieRating.user_id == user_id,
+	                                                               MovieRating.ignored == 0).all()]
+
+
+def take_tracked_changes(user_id: int, changes_by_user: dict[int, set]):
+	"""
+	Gets the changes tracked for the user since their scores were last calculated (see item_based_changed_movies and
+	survey_changed_genres) and starts tracking anew, so that changes made while the scores are calculated (e.g. by a
+	background recomputation) are kept for the next calculation.
+
+	:param user_id: id of the user
+	:param changes_by_user: dictionary with the tracked changes by user id
+	:return: set of the changes (None if the user was not tracked, i.e. the scores need a full calculation)
+	"""
+
+	with score_tracking_lock:
+		changes = changes_by_user.get(user_id)
+		changes_by_user[user_id] = set()
+
+	return changes
+
+
+# functions that get the inputs shared by the scorers for a user from the id of the user (by input name); min_rating is
+# passed in by the request instead
+score_inputs = {
+	'movies_already_rated': get_ids_of_movies_already_rated,
+	'survey_entries': check_whether_there_are_survey_entries,
+	'preference_ratios': lambda user_id: get_user_preference_ratios(user_id, 1),
+	'item_based_changes': lambda user_id: take_tracked_changes(user_id, item_based_changed_movies),
+	'survey_changes': lambda user_id: take_tracked_changes(user_id, survey_changed_genres),
+}
+
+
+def get_score_input(user_id: int, inputs: dict[str, any], name: str):
+	"""
+	Gets a shared input of the scorers, fetching it only the first time it is needed in a request.
+
+	:param user_id: id of the user
+	:param inputs: inputs of the request that were fetched already (by input name)
+	:param name: name of the input (see score_inputs)
+	:return: value of the input
+	"""
+
+	if name not in inputs:
+		inputs[name] = score_inputs[name](user_id)
+	return inputs[name]
+
+
+def calculate_user_based_component(user_id: int, min_rating: float):
+	"""
+	Recalculates the user-based scores of the user, from the latent factor model if it is configured and trained, from
+	similar users otherwise.
+
+	:param user_id: id of the user
+	:param min_rating: minimum rating needed so that a movie is deemed as liked
+	"""
+
+	if current_app.config.get('USER_BASED_SCORING_MODEL') == 'latent-factors' and load_latent_factor_model():
+		calculate_latent_factor_user_based_scores(user_id, min_rating)
+	else:
+		calculate_user_based_scores(user_id, min_rating, current_app.config.get('USER_BASED_AMOUNT_OF_NEIGHBOURS'),
+		                            current_app.config.get('USER_SIMILARITY_METRIC', 'euclidean'))
+
+
+def calculate_item_based_component(user_id: int, item_based_changes: set[int],
+                                   preference_ratios: tuple[dict[any, list], dict[any, list]]):
+	"""
+	Recalculates the item-based scores of the user. If they were calculated before, only the movies affected by the
+	changes since then are updated.
+
+	:param user_id: id of the user
+	:param item_based_changes: ids of the movies whose rating or ignored status changed since the last calculation
+			(None = full calculation)
+	:param preference_ratios: genre and decade ratios of the user
+	"""
+
+	genre_ratios, decade_ratios = preference_ratios
+	try:
+		calculate_item_based_scores(user_id, genre_ratios, decade_ratios, item_based_changes)
+	except Exception:
+		# the changes were taken already, so the next calculation needs to be a full one
+		with score_tracking_lock:
+			item_based_changed_movies.pop(user_id, None)
+		raise
+
+
+def calculate_item_collaborative_component(user_id: int, min_rating: float):
+	"""
+	Recalculates the item-collaborative scores of the user if the item neighbour index was built.
 
-	return hybrid_recommendations
+	:param user_id: id of the user
+	:param min_rating: minimum rating needed so that a movie is deemed as liked
+	"""
+
+	if load_item_neighbour_index():
+		calculate_item_collaborative_scores(user_id, min_rating)
+
+
+def calculate_survey_based_component(user_id: int, survey_changes: set[str], survey_entries: bool):
+	"""
+	Recalculates the survey-based scores of the user. If the survey responses changed since the last calculation, only
+	the movies with the changed genres are updated. If there are no survey entries, the scores are reset to 0.0 in case
+	they were calculated for previous responses.
+
+	:param user_id: id of the user
+	:param survey_changes: genres whose survey response changed since the last calculation (None = full calculation)
+	:param survey_entries: whether the user submitted the preference survey
+	"""
+
+	if survey_entries:
+		try:
+			calculate_survey_based_scores(user_id, survey_changes)
+		except Exception:
+			# the changes were taken already, so the next calculation needs to be a full one
+			with score_tracking_lock:
+				survey_changed_genres.pop(user_id, None)
+			raise
+	else:
+		# reset survey-based scores if they were calculated for previous responses
+		_, survey_based_scores = load_scores(user_id, 'survey_based_score')
+		if numpy.any(survey_based_scores != 0):
+			# print("reset survey-based movie scores from previous survey responses")
+			set_scores(user_id, ['survey_based_score'], 0.0)
+
+
+def calculate_exploration_based_component(user_id: int, movies_already_rated: list[int],
+                                          preference_ratios: tuple[dict[any, list], dict[any, list]]):
+	"""
+	Recalculates the exploration-based scores of the user. If they rated less than 50 movies, the score is based on
+	popularity, otherwise on under-exploration.
+
+	:param user_id: id of the user
+	:param movies_already_rated: ids of the movies the user rated, excluding those they ignored
+	:param preference_ratios: genre and decade ratios of the user (not used directly, but getting them adds the missing
+			entries in UserGenrePreferences that the under-exploration is based on)
+	"""
+
+	if len(movies_already_rated) < 50:
+		calculate_exploration_based_scores(user_id, "popular")
+	else:
+		calculate_exploration_based_scores(user_id, "underexplored")
+
+
+# components of the scoring pipeline (by recommendation type), each with
+#   inputs: names of the shared inputs its calculate function gets as keyword arguments after the id of the user (see
+#           score_inputs)
+#   dependencies: components that need to be calculated before it
+#   output: score attribute of UserMovieRecommendationScores it calculates
+#   hybrid_weights: weights in the total recommendation score with and without survey entries
+#   calculate: function that recalculates the scores of a user
+# the components are evaluated in the order listed here, so a component has to be listed after its dependencies; a
+# new scorer is added by registering it here (and listing it as a dependency of hybrid if it has a weight)
+score_components = {
+	'user-based': {'inputs': ['min_rating'], 'dependencies': [], 'output': 'user_based_score',
+	               'hybrid_weights': (0.3, 0.4), 'calculate': calculate_user_based_component},
+	'item-based': {'inputs': ['item_based_changes', 'preference_ratios'], 'dependencies': [],
+	               'output': 'item_based_score', 'hybrid_weights': (0.2, 0.3),
+	               'calculate': calculate_item_based_component},
+	'item-collaborative': {'inputs': ['min_rating'], 'dependencies': [], 'output': 'item_collaborative_score',
+	                       'hybrid_weights': (0.0, 0.0), 'calculate': calculate_item_collaborative_component},
+	'tag-based': {'inputs': ['min_rating'], 'dependencies': [], 'output': 'tag_based_score',
+	              'hybrid_weights': (0.1, 0.1), 'calculate': calculate_tag_based_scores},
+	'survey-based': {'inputs': ['survey_changes', 'survey_entries'], 'dependencies': [],
+	                 'output': 'survey_based_score', 'hybrid_weights': (0.25, 0.0),
+	                 'calculate': calculate_survey_based_component},
+	'explorative': {'inputs': ['movies_already_rated', 'preference_ratios'], 'dependencies': [],
+	                'output': 'exploration_based_score', 'hybrid_weights': (0.15, 0.2),
+	                'calculate': calculate_exploration_based_component},
+	'hybrid': {'inputs': ['survey_entries'],
+	           'dependencies': ['survey-based', 'explorative', 'user-based', 'item-based', 'tag-based'],
+	           'output': 'total_recommendation_score', 'hybrid_weights': (0.0, 0.0),
+	           'calculate': calculate_hybrid_scores},
+}
+
+
+def calculate_score_components_in_parallel(user_id: int, names: list[str], inputs: dict[str, any]):
+	"""
+	Recalculates independent components of the scoring pipeline concurrently in a thread pool (the heavy parts run in
+	NumPy, which releases the GIL). Each thread works in an application context of its own with its own database
+	session. The inputs are fetched before, so that they are shared by the threads, and the scores of all components are
+	saved together with a single bulk update once all of them are done.
+
+	:param user_id: id of the user
+	:param names: names of the components
+	:param inputs: inputs of the request that were fetched already (by input name)
+	"""
+
+	arguments = {name: {input_name: get_score_input(user_id, inputs, input_name)
+	                    for input_name in score_components[name]['inputs']} for name in names}
+	app = current_app._get_current_object()
+
+	def calculate_component(name: str):
+		# collect the scores of the component in a buffer of its own instead of saving them (see save_scores_of_user)
+		buffer = {}
+		token = score_buffer.set(buffer)
+		try:
+			with app.app_context():
+				score_components[name]['calculate'](user_id, **arguments[name])
+		finally:
+			score_buffer.reset(token)
+		return buffer
+
+	new_scores = {}
+	with ThreadPoolExecutor(max_workers=current_app.config.get('SCORE_EVALUATION_WORKERS')) as executor:
+		futures = [executor.submit(calculate_component, name) for name in names]
+		# wait for all components and raise their exceptions, if any
+		for future in futures:
+			for score_name, scores in future.result().items():
+				new_scores.setdefault(score_name, {}).update(scores)
+
+	if new_scores:
+		# the scores of all attributes need to be saved for the same movies, so complement the scores of attributes
+		# that were only updated for some of the movies (e.g. after incremental updates) with the saved ones
+		movie_ids = set().union(*new_scores.values())
+		for score_name, scores in new_scores.items():
+			if len(scores) < len(movie_ids):
+				saved_movie_ids, saved_scores = load_scores(user_id, score_name)
+				saved = dict(zip(saved_movie_ids.tolist(), saved_scores.tolist()))
+				new_scores[score_name] = {movie_id: scores.get(movie_id, saved.get(movie_id, 0.0))
+				                          for movie_id in movie_ids}
+		save_scores(user_id, new_scores)
+
+
+def evaluate_score_components(user_id: int, method: str, pending: set[str], inputs: dict[str, any]):
+	"""
+	Recalculates the pending components of the scoring pipeline that the method depends on (including itself). A
+	component is also recalculated if one of its dependencies was. The components are evaluated in waves of components
+	that do not depend on each other, one after another or concurrently depending on the SCORE_EVALUATION_MODE setting.
+
+	:param user_id: id of the user
+	:param method: recommendation type, i.e. the component whose scores are needed
+	:param pending: names of the components that need to be recalculated
+	:param inputs: inputs of the request that were fetched already (by input name)
+	:return: calculated - set of the names of the components that were recalculated
+	"""
+
+	# get the components the method depends on
+	needed = set()
+	components_to_check = [method]
+	while components_to_check:
+		name = components_to_check.pop()
+		if name not in needed:
+			needed.add(name)
+			components_to_check.extend(score_components[name]['dependencies'])
+
+	calculated = set()
+	# keep the needed components in the order of the registry, so that the dependencies come first
+	remaining = [name for name in score_components if name in needed]
+	while remaining:
+		# get the components that none of the remaining components need to be calculated before
+		wave = [name for name in remaining if not set(score_components[name]['dependencies']).intersection(remaining)]
+		remaining = [name for name in remaining if name not in wave]
+		wave = [name for name in wave
+		        if name in pending or calculated.intersection(score_components[name]['dependencies'])]
+
+		if current_app.config.get('SCORE_EVALUATION_MODE') == 'parallel' and len(wave) > 1:
+			calculate_score_components_in_parallel(user_id, wave, inputs)
+		else:
+			for name in wave:
+				# print("calculate", name)
+				component = score_components[name]
+				component['calculate'](user_id, **{input_name: get_score_input(user_id, inputs, input_name)
+				                                   for input_name in component['inputs']})
+		calculated.update(wave)
+
+	return calculated
 # endregion
 
 
@@ -1219,6 +1258,10 @@ def delete_movie_features_from_preferences(movie_id: int, movie_rating: float):
 			setattr(row, 'amount_of_dislikes', UserDecadePreferences.amount_of_dislikes - 1)
 			db.session.commit()
 
+	# the item-based scores of the movies that share a genre or the decade with the movie need to be updated (noted
+	# after the preferences were saved, so that a calculation that takes the changes sees the new preferences)
+	register_item_based_change(movie_id)
+
 
 def revoke_ignore_movie_for_recommendations(movie_id: int):
 	"""
@@ -1281,6 +1324,22 @@ def add_or_update_ignored_status(movie_id: int, ignored: bool):
 		                         time_rated=math.nan, ignored=ignored, time_ignored=timestamp)
 		db.session.add(new_rating)
 		db.session.commit()
+
+	# count the change towards the invalidation of the current user's cached neighbours
+	register_rating_change(current_user.id)
+	# the item-based score of the movie needs to be updated, and the survey-based scores need to be calculated for all
+	# movies the next time (the survey-based score of a movie that is no longer ignored needs to be restored)
+	register_item_based_change(movie_id)
+	with score_tracking_lock:
+		survey_changed_genres.pop(current_user.id, None)
+
+	# update the shared rating matrix in place: an ignored movie counts as not rated, an "un"-ignored movie counts with
+	# its rating again (if it was rated)
+	rating = existent_rating.rating if existent_rating else None
+	if ignored:
+		update_rating_in_matrix(current_user.id, int(movie_id), 0.0)
+	elif rating is not None and not math.isnan(rating):
+		update_rating_in_matrix(current_user.id, int(movie_id), float(rating))
 # endregion
 
 
@@ -1314,9 +1373,62 @@ def add_new_rating_or_update(movie_id, rating):
 		                         ignored=False, time_ignored=math.nan)
 		db.session.add(new_rating)
 		db.session.commit()
+
+	# count the change towards the invalidation of the current user's cached neighbours
+	register_rating_change(current_user.id)
+
+	# update the shared rating matrix in place (ratings of ignored movies are not part of it)
+	if not (existent_rating and existent_rating.ignored):
+		update_rating_in_matrix(current_user.id, int(movie_id), float(rating))
 # endregion
 
 
+def get_top_recommendations(user_id: int, score_name: str, amount_of_results: int):
+	"""
+	Gets a set amount of movie recommendations based on a score attribute of the user. The ids of the movies with the
+	highest scores are selected from the score vector of the user, and only the corresponding Movie objects are fetched
+	from the database with a single query.
+
+	:param user_id: id of the user
+	:param score_name: name of the score attribute, e.g. 'user_based_score'
+	:param amount_of_results: amount of results that should be returned
+	:return: recommendations - list of Movie objects of the recommended movies ordered by the score
+	"""
+
+	# get the ids of the movies with the highest scores
+	recommendation_ids = get_top_movie_ids(user_id, score_name, amount_of_results)
+	if not recommendation_ids:
+		return []
+
+	id_ordering = case(
+		{_id: index for index, _id in enumerate(recommendation_ids)},
+		value=Movie.id
+		)
+
+	# print("get corresponding Movie objects")
+	# get the corresponding Movie objects ordered by the score attribute
+	recommendations = Movie.query.filter(Movie.id.in_(recommendation_ids)).order_by(id_ordering).all()
+
+	return recommendations
+
+
+def save_scores_of_user(user_id: int, score_name: str, new_scores: dict[int, float]):
+	"""
+	Saves the values of one score attribute of UserMovieRecommendationScores for the user with a single bulk update, or
+	collects them if the scorer runs with a score buffer (see calculate_score_components_in_parallel).
+
+	:param user_id: id of the user
+	:param score_name: name of the score attribute, e.g. 'user_based_score'
+	:param new_scores: dictionary with movie ids as keys and the new scores as values
+	"""
+
+	buffer = score_buffer.get()
+	if buffer is not None:
+		buffer.setdefault(score_name, {}).update(new_scores)
+	else:
+		save_scores(user_id, {score_name: new_scores})
+
+
 def update_scores_of_ignored_or_rated_movie(movie_id: int):
 	"""
 	Sets all score attributes in UserMovieRecommendationScores of a movie to 0.0 for the current user.
@@ -1324,17 +1436,8 @@ def update_scores_of_ignored_or_rated_movie(movie_id: int):
 	:param movie_id: id of the movie that the scores should be updated for
 	"""
 
-	# update the database entries
-	(db.session.query(UserMovieRecommendationScores).filter(
-		UserMovieRecommendationScores.user_id == current_user.id,
-		UserMovieRecommendationScores.movie_id == movie_id
-		).update(
-		{'survey_based_score': 0.0,
-		 'user_based_score': 0.0,
-		 'item_based_score': 0.0,
-		 'exploration_based_score': 0.0,
-		 'total_recommendation_score': 0.0}))
-	db.session.commit()
+	# update the scores
+	set_scores(current_user.id, score_names, 0.0, [movie_id])
 
 
 def update_data_after_rating(movie_id: int, rating: float):
@@ -1345,19 +1448,6 @@ def update_data_after_rating(movie_id: int, rating: float):
 	:param rating: rating of the movie
 	"""
 
-	global all_movie_ids_rated
-	# get the ids of all movies that were rated
-	try:
-		all_movie_ids_rated
-	except NameError:
-		all_movie_ids_rated = None
-	if all_movie_ids_rated is None:
-		all_movie_ids_rated = get_all_rated_movies_ids()
-
-	# update all rated movies if movie_id not in all_movie_ids_rated
-	if movie_id not in all_movie_ids_rated:
-		all_movie_ids_rated = get_all_rated_movies_ids()
-
 	# update the average movie ratings
 	update_average_movie_rating(movie_id, rating, "add")
 
@@ -1412,6 +1502,9 @@ def update_average_movie_rating(movie_id: int, rating: float, method: str = "add
 			'amount_of_ratings': Movie.amount_of_ratings - 1})
 		db.session.commit()
 
+	# the popularity ranking depends on the amounts of ratings and the average ratings, so it needs to be rebuilt
+	invalidate_popularity_ranking()
+
 
 # region watchlist
 def add_movie_to_watchlist(movie_id: int):
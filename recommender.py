@@ -1,21 +1,27 @@
 # Contains parts from: https://flask-user.readthedocs.io/en/latest/quickstart_app.html
 import os
 
-from flask import Flask, render_template, request
+import click
+from flask import Flask, render_template, request, abort, jsonify
 from flask_user import login_required, UserManager, current_user
 
+from background_scores import request_score_recomputation, check_whether_recomputation_is_running
+from batch_scores import compute_scores_for_all_users
 from get_data import get_user_preferences_from_database, get_movies_on_watchlist, get_ignored_movies, \
-    get_genre_and_decade_filtered_recommendations
-from models import db, User, MovieRating
+    get_genre_and_decade_filtered_recommendations, get_all_movies_and_users_ids, get_all_rated_movies_by_current_user
+from item_similarity import build_item_neighbour_index
+from latent_factors import train_latent_factor_model
+from models import db, User, Movie, MovieRating
 from preparation import preprocess_tags, get_and_save_amount_of_ratings_and_average_ratings, \
-    initialize_user_movie_scores
+    initialize_user_movie_scores, save_search_ready_titles_and_tags, upgrade_database_schema
 from read_data import check_and_read_data
 from recommendation import (get_movie_recommendations, add_movie_to_watchlist, delete_movie_from_watchlist,
-                            save_survey_preferences_and_check_for_recalculation, get_all_movies_and_users_ids,
-                            update_data_after_rating, get_all_rated_movies_by_current_user, add_new_rating_or_update,
-                            ignore_movie_for_recommendations, revoke_ignore_movie_for_recommendations,
-                            get_survey_preferences, update_scores_of_ignored_or_rated_movie)
+                            save_survey_preferences_and_check_for_recalculation, update_data_after_rating,
+                            add_new_rating_or_update, ignore_movie_for_recommendations,
+                            revoke_ignore_movie_for_recommendations, get_survey_preferences,
+                            update_scores_of_ignored_or_rated_movie)
 from searcher import find_movies_by_query
+from similar_movies import build_similar_movie_index, get_similar_movies
 
 global score_recalculation_needed_for, all_movie_ids, all_user_ids
 
@@ -30,6 +36,9 @@ class ConfigClass(object):
     # Flask-SQLAlchemy settings
     SQLALCHEMY_DATABASE_URI = 'sqlite:///movie_recommender.sqlite'  # File-based SQL database
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # Avoids SQLAlchemy warning
+    # Wait up to 30 seconds for a lock instead of failing at once, as the batch workers, the background recomputation
+    # and the requests write to the same SQLite database
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
 
     # Flask-User settings
     USER_APP_NAME = "MovieRex"  # Shown in and email templates and page footers
@@ -44,6 +53,34 @@ class ConfigClass(object):
     USER_AFTER_CHANGE_PASSWORD_ENDPOINT = 'home_page'
     USER_AFTER_CHANGE_USERNAME_ENDPOINT = 'home_page'
 
+    # Recommendation settings
+    # model the user-based scores are calculated with ('neighbours' = movies liked by similar users, 'latent-factors' =
+    # ratings predicted by the latent factor model trained with 'flask train-latent-factors')
+    USER_BASED_SCORING_MODEL = 'neighbours'
+    # amount of nearest users from the approximate nearest-neighbour index that the user-based scores are based on
+    # (None = all users within the maximum distance)
+    USER_BASED_AMOUNT_OF_NEIGHBOURS = None
+    # metric the similarity between users is measured with ('euclidean', 'cosine', 'pearson' or 'jaccard')
+    USER_SIMILARITY_METRIC = 'euclidean'
+    # the cached neighbours of a user are recalculated once the amount of changes of their ratings reaches the minimum
+    # amount or the ratio of their amount of ratings at the time of the calculation (whichever is larger), and after the
+    # refresh interval in seconds (None = no periodic refresh)
+    USER_NEIGHBOURS_MIN_RATING_CHANGES = 3
+    USER_NEIGHBOURS_RATING_CHANGE_RATIO = 0.1
+    USER_NEIGHBOURS_REFRESH_INTERVAL = 24 * 60 * 60
+    # backend the recommendation scores are stored with ('rows' = one row per user and movie, 'packed' = one float32
+    # array of the scores of all movies per user and score attribute)
+    SCORE_STORAGE_BACKEND = 'rows'
+    # whether the independent score components are recalculated one after another ('sequential') or concurrently in a
+    # thread pool ('parallel'), and the maximum amount of threads (None = default of ThreadPoolExecutor)
+    SCORE_EVALUATION_MODE = 'sequential'
+    SCORE_EVALUATION_WORKERS = None
+    # whether the scores are recalculated before the home page is shown ('inline') or by a background job while the
+    # home page shows the last calculated recommendations until the job is done ('background'), and the amount of
+    # background workers (SQLite only allows one writer at a time)
+    SCORE_RECOMPUTATION_MODE = 'inline'
+    SCORE_RECOMPUTATION_WORKERS = 1
+
 
 # Create Flask app
 app = Flask(__name__)
@@ -51,9 +88,11 @@ app.config.from_object(__name__ + '.ConfigClass')  # configuration
 app.app_context().push()  # create an app context before initializing db
 db.init_app(app)  # initialize database
 db.create_all()  # create database if necessary
+upgrade_database_schema()  # add the columns, indexes and constraints that are missing in existing tables
 user_manager = UserManager(app, db, User)  # initialize Flask-User management
 all_movie_ids, all_user_ids = get_all_movies_and_users_ids()
-score_recalculation_needed_for = ()
+# scores that need to be recalculated for a user the next time their home page is shown (by user id)
+score_recalculation_needed_for = {}
 
 
 # needed in case more than one user is logged in via VPN on the server
@@ -68,47 +107,91 @@ def add_header(response):
 def initdb_command():
     global db
     """Creates the database tables."""
-    check_and_read_data(db, testing=False)
+    data_was_read_in = check_and_read_data(db, testing=False)
     preprocess_tags()
+    save_search_ready_titles_and_tags()
     get_and_save_amount_of_ratings_and_average_ratings()
+    # the similar movie index only changes with the movies, so it is only built after they were read in (otherwise it
+    # is rebuilt via 'flask build-similar-movies')
+    if data_was_read_in:
+        build_similar_movie_index()
     # print('Initialized the database.')
 
 
+@app.cli.command('train-latent-factors')
+def train_latent_factors_command():
+    """Trains the latent factor model for the user-based scores on all ratings."""
+    train_latent_factor_model()
+
+
+@app.cli.command('build-item-neighbours')
+def build_item_neighbours_command():
+    """Builds the item neighbour index for the item-collaborative scores on all ratings."""
+    build_item_neighbour_index()
+
+
+@app.cli.command('build-similar-movies')
+def build_similar_movies_command():
+    """Builds the similar movie index for the "more like this" pages on the movies' genres, decades and tags."""
+    build_similar_movie_index()
+
+
+@app.cli.command('compute-all-scores')
+@click.option('--workers', default=None, type=int, help='Amount of worker processes (default: amount of CPUs).')
+@click.option('--chunk-size', default=20, type=int, help='Amount of users per chunk of work.')
+@click.option('--resume', is_flag=True, help='Resume the last run if it was not finished.')
+def compute_all_scores_command(workers, chunk_size, resume):
+    """Computes the neighbours and all recommendation scores for every active user."""
+    compute_scores_for_all_users(app, workers, chunk_size, resume)
+
+
 # The home page has two templates depending on whether the user is authenticated
 @app.route('/')
 def home_page():
-    global all_movie_ids, score_recalculation_needed_for
+    global all_movie_ids
     # show homepage with a few movies/recommendations if user is already signed in
     if current_user.is_authenticated:
         user = User.query.filter(User.id == current_user.id).first()
+        calculation_needed_for = score_recalculation_needed_for.pop(current_user.id, ())
         # initialize movie scores in database if not done for the user already
         if not user.initialized_scores:
             # print("initialize movie scores")
-            initialize_user_movie_scores()
+            initialize_user_movie_scores(current_user.id)
             # print("done with initializing movie scores")
             setattr(user, 'initialized_scores', True)
-            movies = get_movie_recommendations(4, 4.0, 48, "hybrid")
-            score_recalculation_needed_for = ()
+            movies = get_movie_recommendations(current_user.id, 4, 4.0, 48, "hybrid")
+        # recalculate the scores in the background and show the last calculated recommendations in the meantime
+        elif app.config.get('SCORE_RECOMPUTATION_MODE') == 'background':
+            if calculation_needed_for:
+                request_score_recomputation(current_user.id, calculation_needed_for)
+            movies = get_movie_recommendations(current_user.id, 4, 4.0, 48, "hybrid", calculation_needed_for=(),
+                                               recalculate=False)
         else:
-            movies = get_movie_recommendations(4, 4.0, 48, "hybrid",
-                                               calculation_needed_for=score_recalculation_needed_for)
-            if score_recalculation_needed_for:
-                score_recalculation_needed_for = ()
+            movies = get_movie_recommendations(current_user.id, 4, 4.0, 48, "hybrid",
+                                               calculation_needed_for=calculation_needed_for)
         movies_watchlist = get_movies_on_watchlist()
-        return render_template("home.html", movies=movies, movies_watchlist=movies_watchlist)
+        # the page checks for the end of a running recomputation and reloads to show the new recommendations
+        updating = check_whether_recomputation_is_running(current_user.id)
+        return render_template("home.html", movies=movies, movies_watchlist=movies_watchlist, updating=updating)
     else:  # show homepage with options to register or sign in if user has not done so
         return render_template("home01.html")
 
 
+@app.route('/recommendations_status')
+@login_required
+def recommendations_status():
+    return jsonify(updating=check_whether_recomputation_is_running(current_user.id))
+
+
 @app.route('/rate', methods=['GET', 'POST'])
 @login_required
 def rate():
-    global score_recalculation_needed_for
     rating = request.form.get('rating')
     movie_id = request.form.get('movieID')
     # print("Rating", rating, "for movie id: ", movie_id)
-    score_recalculation_needed_for = tuple(set(score_recalculation_needed_for + ('user-based', 'item-based',
-                                                                                 'explorative', 'hybrid')))
+    score_recalculation_needed_for[current_user.id] = tuple(set(
+        score_recalculation_needed_for.get(current_user.id, ()) + ('user-based', 'item-based', 'item-collaborative',
+                                                                   'tag-based', 'explorative', 'hybrid')))
     add_new_rating_or_update(movie_id, rating)
     update_data_after_rating(int(movie_id), float(rating))
     return render_template("rated.html", rating=rating)
@@ -117,7 +200,6 @@ def rate():
 @app.route('/ignore', methods=['GET', 'POST'])
 @login_required
 def ignore():
-    global score_recalculation_needed_for
     movie_id = request.form.get('movieID')
     # print("Ignore movie:", movie_id)
     ignore_movie_for_recommendations(int(movie_id))
@@ -127,8 +209,9 @@ def ignore():
         MovieRating.user_id == current_user.id
         ).first()
     if rating_entry.rating is not None:
-        score_recalculation_needed_for = tuple(set(score_recalculation_needed_for + ('user-based', 'item-based',
-                                                                                     'explorative', 'hybrid')))
+        score_recalculation_needed_for[current_user.id] = tuple(set(
+            score_recalculation_needed_for.get(current_user.id, ()) + ('user-based', 'item-based', 'item-collaborative',
+                                                                       'tag-based', 'explorative', 'hybrid')))
     # else no recalculation is needed, but setting the movie scores to 0 necessary to exclude movie from recommendations
     else:
         update_scores_of_ignored_or_rated_movie(int(movie_id))
@@ -139,14 +222,14 @@ def ignore():
 @app.route('/revoke_ignore', methods=['GET', 'POST'])
 @login_required
 def revoke_ignore():
-    global score_recalculation_needed_for
     movie_id = request.form.get('movieID')
     # print("Revoke ignore for movie:", movie_id)
     revoke_ignore_movie_for_recommendations(int(movie_id))
     # score recalculation is needed (if the movie was rated, revoke the consequences of ignoring the movie, if it was
     # not rated yet, recalculate the scores to include the movie again)
-    score_recalculation_needed_for = tuple(set(score_recalculation_needed_for + ('user-based', 'item-based',
-                                                                                 'explorative', 'hybrid')))
+    score_recalculation_needed_for[current_user.id] = tuple(set(
+        score_recalculation_needed_for.get(current_user.id, ()) + ('user-based', 'item-based', 'item-collaborative',
+                                                                   'tag-based', 'explorative', 'hybrid')))
     # return home page (although the return value is technically not used)
     return render_template("home.html")
 
@@ -160,7 +243,7 @@ def welcome_survey():
 @app.route('/survey')
 @login_required
 def survey_page():
-    liked_genres_survey, disliked_genres_survey = get_survey_preferences()
+    liked_genres_survey, disliked_genres_survey = get_survey_preferences(current_user.id)
     return render_template("survey.html", is_erroneous=False, liked_genres_survey=liked_genres_survey,
                            disliked_genres_survey=disliked_genres_survey)
 
@@ -168,14 +251,13 @@ def survey_page():
 @app.route('/survey_submit', methods=['GET', 'POST'])
 @login_required
 def survey_submit():
-    global score_recalculation_needed_for
     incl_genres = request.form.getlist('genre-incl')
     # print("survey response liked genres:", incl_genres)
     excl_genres = request.form.getlist('genre-excl')
     # print("survey response disliked genres:", excl_genres)
-    score_recalculation_needed_for = tuple(set(score_recalculation_needed_for +
-                                               save_survey_preferences_and_check_for_recalculation(incl_genres,
-                                                                                                   excl_genres)))
+    score_recalculation_needed_for[current_user.id] = tuple(set(
+        score_recalculation_needed_for.get(current_user.id, ()) +
+        save_survey_preferences_and_check_for_recalculation(incl_genres, excl_genres)))
     # refresh loads home page directly after feedback
     return render_template('survey_submit.html'), {"Refresh": "1; url=../recommender.wsgi/"}
 
@@ -295,7 +377,7 @@ def preferences_page():
         liked_decades = True
     if len(extracted_disliked_decades) > 0:
         disliked_decades = True
-    liked_genres_survey, disliked_genres_survey = get_survey_preferences()
+    liked_genres_survey, disliked_genres_survey = get_survey_preferences(current_user.id)
     if len(liked_genres_survey) > 0:
         liked_genres_sur = True
     if len(disliked_genres_survey) > 0:
@@ -331,6 +413,26 @@ def filter():
                            ignored_movies_ids=ignored_movies_ids)
 
 
+@app.route('/similar/<int:movie_id>')
+@login_required
+def similar(movie_id):
+    movie = db.session.get(Movie, movie_id)
+    if movie is None:
+        abort(404)
+    movies_watchlist = get_movies_on_watchlist()
+    results = get_similar_movies(movie_id, 24)
+    rated_movies, ratings = get_all_rated_movies_by_current_user()
+    if len(results) == 0:
+        no_results = True
+    else:
+        no_results = False
+    ignored_movies = get_ignored_movies()
+    ignored_movies_ids = [m.id for m in ignored_movies]
+    return render_template("similar_movies.html", movie=movie, results=results, no_results=no_results,
+                           movies_watchlist=movies_watchlist, rated_movies=rated_movies, ratings=ratings,
+                           ignored_movies=ignored_movies, ignored_movies_ids=ignored_movies_ids)
+
+
 # Start development web server
 if __name__ == '__main__':
     initdb_command()
@@ -0,0 +1,278 @@
+﻿from flask import current_app
+from sqlalchemy import Table, and_, bindparam, func
+import numpy
+
+from models import db, UserMovieRecommendationScores, UserScoreVector
+from movie_features import get_movie_features, get_movie_positions
+
+# names of the score attributes of a user and a movie
+score_names = ['survey_based_score', 'user_based_score', 'item_based_score', 'item_collaborative_score',
+               'tag_based_score', 'exploration_based_score', 'total_recommendation_score']
+
+# backends the scores can be stored with ('rows' = one UserMovieRecommendationScores entry per user and movie,
+# 'packed' = one UserScoreVector entry per user and score attribute with the scores of all movies as a float32 array)
+score_storage_backends = ['rows', 'packed']
+
+
+def get_score_storage_backend():
+	"""
+	Gets the backend the scores are stored with as set in the configuration of the app.
+
+	:return: name of the backend, either 'rows' or 'packed'
+	"""
+
+	backend = current_app.config.get('SCORE_STORAGE_BACKEND', 'rows')
+	# validate the configuration
+	if backend not in score_storage_backends:
+		raise ValueError("Invalid value for SCORE_STORAGE_BACKEND. Expected one of: %s" % score_storage_backends)
+
+	return backend
+
+
+def bulk_update(table: Table, key_columns: list[str], rows: list[dict[str, any]]):
+	"""
+	Updates several columns of many rows of a table with a single UPDATE statement that is executed for all rows at once
+	(executemany). No scratch tables are created, so several users (e.g. threads of the server or processes of the
+	batch job) can write at the same time.
+
+	:param table: table that should be updated
+	:param key_columns: names of the columns that identify a row, e.g. ['user_id', 'movie_id']
+	:param rows: list of dictionaries with the values of the key columns and the new values of the columns that should
+			be updated (all dictionaries need to have the same keys)
+	"""
+
+	if not rows:
+		return
+
+	# the parameters need different names than the columns, as the names of the columns are reserved for the SET
+	# clause
+	value_columns = [c for c in rows[0] if c not in key_columns]
+	statement = table.update().where(and_(*[table.c[c] == bindparam("key_" + c) for c in key_columns])).values(
+		{c: bindparam("value_" + c) for c in value_columns})
+
+	# update the rows
+	db.session.execute(statement, [{("key_" if c in key_columns else "value_") + c: v for c, v in row.items()}
+	                               for row in rows])
+	db.session.commit()
+
+
+# region packed score vectors
+def load_score_vectors(user_id: int, names: list[str]):
+	"""
+	Loads the packed score vectors of a user with a single query. Missing vectors and vectors that do not match the
+	current movies (e.g. because movies were added since they were saved) are returned as zeros.
+
+	:param user_id: id of the user
+	:param names: names of the score attributes
+	:return: vectors - dictionary with the names of the score attributes as keys and the float32 arrays of the scores
+			in the order of the movie features as values
+	"""
+
+	movie_ids = get_movie_features()[0]
+	rows = db.session.query(UserScoreVector.score_name, UserScoreVector.scores,
+	                        UserScoreVector.amount_of_movies).filter(
+		UserScoreVector.user_id == user_id,
+		UserScoreVector.score_name.in_(names)).all()
+	vectors = {name: numpy.zeros(len(movie_ids), dtype=numpy.float32) for name in names}
+	for row in rows:
+		if row.amount_of_movies == len(movie_ids):
+			vectors[row.score_name] = numpy.frombuffer(row.scores, dtype='<f4').astype(numpy.float32)
+
+	return vectors
+
+
+def save_score_vectors(user_id: int, vectors: dict[str, numpy.ndarray]):
+	"""
+	Saves the packed score vectors of a user, replacing a single entry per score attribute.
+
+	:param user_id: id of the user
+	:param vectors: dictionary with the names of the score attributes as keys and the arrays of the scores in the order
+			of the movie features as values
+	"""
+
+	existing_names = {row.score_name for row in db.session.query(UserScoreVector.score_name).filter(
+		UserScoreVector.user_id == user_id,
+		UserScoreVector.score_name.in_(list(vectors))).all()}
+	rows = [{"user_id": user_id, "score_name": name, "scores": numpy.asarray(vector, dtype='<f4').tobytes(),
+	         "amount_of_movies": len(vector)} for name, vector in vectors.items()]
+
+	# replace the existing entries and add the missing ones
+	bulk_update(UserScoreVector.__table__, ["user_id", "score_name"],
+	            [row for row in rows if row["score_name"] in existing_names])
+	new_rows = [row for row in rows if row["score_name"] not in existing_names]
+	if new_rows:
+		db.session.execute(UserScoreVector.__table__.insert(), new_rows)
+		db.session.commit()
+# endregion
+
+
+def initialize_scores(user_id: int):
+	"""
+	Initializes the scores of all movies for a user with 0.
+
+	:param user_id: id of the user
+	"""
+
+	movie_ids = get_movie_features()[0]
+	if get_score_storage_backend() == 'packed':
+		save_score_vectors(user_id, {name: numpy.zeros(len(movie_ids)) for name in score_names})
+	else:
+		# generate a new entry for each movie and add all of them to the database
+		db.session.execute(UserMovieRecommendationScores.__table__.insert(),
+		                   [dict({"user_id": user_id, "movie_id": movie_id}, **{name: 0 for name in score_names})
+		                    for movie_id in movie_ids.tolist()])
+		db.session.commit()
+
+
+def save_scores(user_id: int, new_scores: dict[str, dict[int, float]]):
+	"""
+	Saves the values of one or more score attributes of a user with a single bulk update.
+
+	:param user_id: id of the user
+	:param new_scores: dictionary with the names of the score attributes as keys, e.g. 'user_based_score', and
+			dictionaries with movie ids as keys and the new scores as values as values (all for the same movies)
+	"""
+
+	names = list(new_scores)
+	movie_ids = new_scores[names[0]].keys()
+	# validate the parameter
+	if any(new_scores[name].keys() != movie_ids for name in names):
+		raise ValueError("The new scores of all score attributes need to be for the same movies.")
+
+	if get_score_storage_backend() == 'packed':
+		# replace the scores of the given movies in the vectors
+		positions = get_movie_positions(list(movie_ids))
+		known = positions >= 0
+		vectors = load_score_vectors(user_id, names)
+		for name in names:
+			vectors[name][positions[known]] = numpy.array(list(new_scores[name].values()))[known]
+		save_score_vectors(user_id, vectors)
+	else:
+		# write all score attributes of a movie in the same row
+		rows = [dict({"user_id": user_id, "movie_id": movie_id},
+		             **{name: new_scores[name][movie_id] for name in names})
+		        for movie_id in movie_ids]
+		bulk_update(UserMovieRecommendationScores.__table__, ["user_id", "movie_id"], rows)
+
+
+def set_scores(user_id: int, names: list[str], value: float, movie_ids: list[int] = None):
+	"""
+	Sets the values of one or more score attributes of a user to the same value.
+
+	:param user_id: id of the user
+	:param names: names of the score attributes
+	:param value: new value of the scores
+	:param movie_ids: ids of the movies the scores should be set for (None = all movies)
+	"""
+
+	if get_score_storage_backend() == 'packed':
+		vectors = load_score_vectors(user_id, names)
+		for name in names:
+			if movie_ids is None:
+				vectors[name][:] = value
+			else:
+				positions = get_movie_positions(movie_ids)
+				vectors[name][positions[positions >= 0]] = value
+		save_score_vectors(user_id, vectors)
+	else:
+		(db.session.query(UserMovieRecommendationScores).filter(
+			UserMovieRecommendationScores.user_id == user_id,
+			UserMovieRecommendationScores.movie_id.in_(movie_ids) if movie_ids is not None else True
+			).update({name: value for name in names}))
+		db.session.commit()
+
+
+def combine_scores(user_id: int, weights: dict[str, float], target_name: str):
+	"""
+	Saves the weighted sum of score attributes of a user, rounded to two decimals, as another score attribute.
+
+	:param user_id: id of the user
+	:param weights: dictionary with the names of the score attributes as keys and their weights as values
+	:param target_name: name of the score attribute the weighted sum is saved as, e.g. 'total_recommendation_score'
+	"""
+
+	if get_score_storage_backend() == 'packed':
+		vectors = load_score_vectors(user_id, list(weights))
+		total = sum(weight * vectors[name].astype(float) for name, weight in weights.items())
+		# round half away from zero like the database does (the float32 scores are only precise to about 7 digits)
+		total = numpy.sign(total) * numpy.floor(numpy.round(numpy.abs(total) * 100, 4) + 0.5) / 100
+		save_score_vectors(user_id, {target_name: total})
+	else:
+		table = UserMovieRecommendationScores.__table__
+		(db.session.query(UserMovieRecommendationScores).filter(
+			UserMovieRecommendationScores.user_id == user_id).update(
+			{target_name: func.round(sum(weight * table.c[name] for name, weight in weights.items()), 2)}))
+		db.session.commit()
+
+
+def load_scores(user_id: int, name: str):
+	"""
+	Loads the values of a score attribute of a user for all movies with a single query.
+
+	:param user_id: id of the user
+	:param name: name of the score attribute
+	:return: movie_ids - array of the ids of all movies (the order of the movie features),
+			scores - array of the corresponding scores
+	"""
+
+	movie_ids = get_movie_features()[0]
+	if get_score_storage_backend() == 'packed':
+		return movie_ids, load_score_vectors(user_id, [name])[name].astype(float)
+
+	rows = db.session.query(UserMovieRecommendationScores.movie_id,
+	                        UserMovieRecommendationScores.__table__.c[name]).filter(
+		UserMovieRecommendationScores.user_id == user_id).all()
+	scores = numpy.zeros(len(movie_ids))
+	positions = get_movie_positions([row[0] for row in rows])
+	scores[positions[positions >= 0]] = numpy.array([row[1] for row in rows], dtype=float)[positions >= 0]
+
+	return movie_ids, scores
+
+
+def select_top_movie_ids(movie_ids: numpy.ndarray, scores: numpy.ndarray, amount_of_results: int = None):
+	"""
+	Selects the ids of the movies with the highest scores from a score vector. Only the top results are sorted (partial
+	selection), and movies with the same score are ordered by their ids.
+
+	:param movie_ids: array of the movie ids
+	:param scores: array of the corresponding scores
+	:param amount_of_results: amount of results that should be returned (None = all movies)
+	:return: list of the movie ids ordered by the score in a descending manner
+	"""
+
+	if amount_of_results is None or amount_of_results >= len(scores):
+		candidates = numpy.arange(len(scores))
+	elif amount_of_results <= 0:
+		return []
+	else:
+		# get the positions of the amount_of_results highest scores (in no particular order)
+		top = numpy.argpartition(-scores, amount_of_results - 1)[:amount_of_results]
+		# the movies with a score above the lowest of these scores are part of the results in any case, the remaining
+		# results are the movies with exactly this score that have the lowest ids (so that ties at the end of the
+		# results are broken by the movie ids as well)
+		threshold = scores[top].min()
+		above = top[scores[top] > threshold]
+		tied = numpy.flatnonzero(scores == threshold)
+		amount_of_tied = amount_of_results - len(above)
+		if len(tied) > amount_of_tied:
+			tied = tied[numpy.argpartition(movie_ids[tied], amount_of_tied - 1)[:amount_of_tied]]
+		candidates = numpy.concatenate((above, tied))
+	# sort the candidates by the score in a descending manner and then by the movie id
+	ordering = candidates[numpy.lexsort((movie_ids[candidates], -scores[candidates]))]
+
+	return movie_ids[ordering[:amount_of_results]].tolist()
+
+
+def get_top_movie_ids(user_id: int, name: str, amount_of_results: int = None):
+	"""
+	Gets the ids of the movies with the highest values of a score attribute for a user.
+
+	:param user_id: id of the user
+	:param name: name of the score attribute
+	:param amount_of_results: amount of results that should be returned (None = all movies)
+	:return: list of the movie ids ordered by the score in a descending manner
+	"""
+
+	movie_ids, scores = load_scores(user_id, name)
+
+	return select_top_movie_ids(movie_ids, scores, amount_of_results)
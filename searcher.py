@@ -5,22 +5,19 @@ from sqlalchemy import case
 from models import db, Movie, Tags
 
 
-def get_all_movie_titles_without_release_years():
+def get_title_without_release_year(movie_title: str):
 	"""
-	Gets all movie titles without the release years.
-	:return: movies - list of the movie ids and the corresponding movie title without the release year
-	"""
-
-	# get all movie titles
-	movie_ids_and_titles = db.session.query(Movie.id, Movie.title).order_by(Movie.title).all()
+	Removes the release year from a movie title.
 
-	movies = []
-	# go through the movies and edit the movie title before appending the id and the title to the list
-	for id_and_title in movie_ids_and_titles:
-		parenthesis_index = id_and_title.title[::-1].find("(")
-		movies.append([id_and_title.id, id_and_title.title[::-1][parenthesis_index+1:][::-1]])
+	:param movie_title: title the release year should be removed from
+	:return: movie title without the release year (or the title itself if there is no opening bracket in it)
+	"""
 
-	return movies
+	# get the index of the last opening bracket, which is where the release year starts
+	parenthesis_index = movie_title.rfind("(")
+	if parenthesis_index == -1:
+		return movie_title
+	return movie_title[:parenthesis_index]
 
 
 def preprocess_string(string: str):
@@ -39,6 +36,42 @@ def preprocess_string(string: str):
 	return string_preprocessed
 
 
+def get_search_title(movie_title: str):
+	"""
+	Gets the search-ready form of a movie title, i.e. the title without the release year, converted to lowercase and
+	without punctuation. It is saved in the search_title attribute of Movie.
+
+	:param movie_title: title of the movie
+	:return: search-ready movie title
+	"""
+
+	return preprocess_string(get_title_without_release_year(movie_title))
+
+
+def get_search_ready_movies():
+	"""
+	Gets the search-ready titles and tags of all movies as saved in the database with a single query.
+
+	:return: movies - list of the movie ids, the search-ready movie titles, the amounts of ratings and the lists of the
+			search-ready tags of the movies
+	"""
+
+	# get the search-ready titles and tags of all movies (one row per tag, or one row without a tag if the movie has
+	# none)
+	rows = (db.session.query(Movie.id, Movie.search_title, Movie.amount_of_ratings, Tags.search_tag)
+	        .outerjoin(Tags, Tags.movie_id == Movie.id).order_by(Movie.title, Tags.id).all())
+
+	movies = []
+	# go through the rows and collect the tags of each movie
+	for row in rows:
+		if not movies or movies[-1][0] != row.id:
+			movies.append([row.id, row.search_title, row.amount_of_ratings, []])
+		if row.search_tag is not None:
+			movies[-1][3].append(row.search_tag)
+
+	return movies
+
+
 def find_movies_by_query(search_query: str, min_similarity: int):
 	"""
 	Finds movies that the title and/or the tags match the search_query of.
@@ -53,12 +86,9 @@ def find_movies_by_query(search_query: str, min_similarity: int):
 	query_preprocessed = preprocess_string(search_query)
 	# print("query preprocessed:", query_preprocessed)
 
-	# print("get all movie titles without release years")
-	# get the movie titles without the release years
-	movies = get_all_movie_titles_without_release_years()
-	# print("preprocess the titles")
-	# preprocess the titles
-	movies_preprocessed = [[movie[0], preprocess_string(movie[1])] for movie in movies]
+	# print("get all search-ready movie titles and tags")
+	# get the preprocessed movie titles without the release years, the amounts of ratings and the preprocessed tags
+	movies_preprocessed = get_search_ready_movies()
 
 	similarities_titles = []
 	similarities_tags = []
@@ -71,14 +101,10 @@ def find_movies_by_query(search_query: str, min_similarity: int):
 		#	print(count, "loops done")
 		# if count == len(movies_preprocessed):
 		#	print("last loop")
-		# get amount of ratings
-
-		# get the amount of ratings of the movie
-		amount_of_ratings = Movie.query.filter(Movie.id == movie[0]).first().amount_of_ratings
 
-		# get the movie's tags
-		movie_tags = Tags.query.filter(Tags.movie_id == movie[0]).all()
-		tags = [m.tag for m in movie_tags]
+		# get the amount of ratings and the preprocessed tags of the movie
+		amount_of_ratings = movie[2]
+		tags = movie[3]
 
 		# get exact matches first
 		exact_match_title = False  # title has to match query perfectly for this to be True
@@ -97,8 +123,7 @@ def find_movies_by_query(search_query: str, min_similarity: int):
 		# but tags "time travel" and "time-travel" should also count as an exact match for query "timetravel"
 		amount_of_exact_matches = 0
 		tags_left_to_check_for_partial_match = []
-		for tag in tags:
-			tag_preprocessed = preprocess_string(tag)
+		for tag_preprocessed in tags:
 			if fuzz.token_sort_ratio(tag_preprocessed, query_preprocessed) >= 90:
 				amount_of_exact_matches += 1
 			else:
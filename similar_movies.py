@@ -0,0 +1,178 @@
+﻿from flask import current_app
+from scipy.sparse import csr_matrix, hstack
+from sqlalchemy import case
+import numpy
+import os
+
+from models import Movie
+from movie_features import build_movie_features, get_movie_features, get_movie_popularity
+from tag_features import build_movie_tag_matrix, get_movie_tag_matrix
+
+global similar_movie_ids, similar_movie_similarities, index_movie_index, time_index_file_modified
+similar_movie_ids = None
+similar_movie_similarities = None
+index_movie_index = None
+time_index_file_modified = None
+
+# name of the file in the instance folder the similar movie index is saved to
+index_file_name = 'similar_movies.npz'
+
+
+def get_index_file_path():
+	"""
+	Gets the path of the file the similar movie index is saved to.
+
+	:return: path of the index file in the instance folder of the app
+	"""
+
+	return os.path.join(current_app.instance_path, index_file_name)
+
+
+def normalize_rows(matrix: csr_matrix):
+	"""
+	Normalizes the rows of a sparse matrix to unit length (rows of zeros stay 0).
+
+	:param matrix: sparse matrix
+	:return: CSR matrix with the normalized rows
+	"""
+
+	norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+
+	return csr_matrix(matrix.multiply(numpy.divide(1.0, norms, out=numpy.zeros(len(norms)), where=norms > 0)[:, None]))
+
+
+def build_similar_movie_index(amount_of_similar_movies: int = 24, genre_weight: float = 0.5,
+                              decade_weight: float = 0.15, tag_weight: float = 0.35, block_size: int = 500):
+	"""
+	Builds the similar movie index, i.e. the amount_of_similar_movies most similar movies of every movie by their
+	content, and saves it to the instance folder. The content of a movie is described by its genres, its decade and the
+	TF-IDF vector of its tags, each normalized to unit length and weighted, so that the similarity of two movies is the
+	weighted sum of the cosine similarities of the parts (scaled by the parts the movies have). Ties are broken by the
+	amount of ratings, so that better known movies come first. The similarities are calculated for blocks of block_size
+	movies at a time, so that the full movie-movie matrix never needs to be held in memory. The movie features are
+	rebuilt first, so that the index reflects the current data (e.g. after the data was read in).
+
+	:param amount_of_similar_movies: amount of similar movies that are saved for each movie
+	:param genre_weight: weight of the genre similarity
+	:param decade_weight: weight of the decade similarity
+	:param tag_weight: weight of the tag similarity
+	:param block_size: amount of movies the similarities are calculated for at once
+	:return: path of the saved index file
+	"""
+
+	# print("build similar movie index")
+	build_movie_features()
+	build_movie_tag_matrix()
+	movie_ids, _, genre_matrix, _, _, decades = get_movie_features()
+	tag_matrix, _ = get_movie_tag_matrix()
+
+	# one-hot encode the decades (movies without release year have no decade)
+	known_decade = ~numpy.isnan(decades)
+	decade_values, decade_columns = numpy.unique(decades[known_decade], return_inverse=True)
+	decade_matrix = csr_matrix((numpy.ones(len(decade_columns)), (numpy.flatnonzero(known_decade), decade_columns)),
+	                           shape=(len(movie_ids), len(decade_values)))
+
+	# combine the weighted parts and normalize the rows, so that the product of two rows is the similarity of the movies
+	content = normalize_rows(hstack([numpy.sqrt(genre_weight) * normalize_rows(genre_matrix),
+	                                 numpy.sqrt(decade_weight) * decade_matrix,
+	                                 numpy.sqrt(tag_weight) * tag_matrix]).tocsr())
+	content_transposed = content.T.tocsc()
+
+	# break ties by the amount of ratings with a value that is too small to change the order of different similarities
+	amounts_of_ratings, _ = get_movie_popularity()
+	popularity_ranks = numpy.empty(len(movie_ids))
+	popularity_ranks[numpy.lexsort((movie_ids, -amounts_of_ratings))] = numpy.arange(len(movie_ids))
+	tie_breakers = (1.0 - popularity_ranks / max(len(movie_ids), 1)) * 1e-6
+
+	amount_of_movies = len(movie_ids)
+	amount_of_similar_movies = max(0, min(amount_of_similar_movies, amount_of_movies - 1))
+	neighbour_ids = numpy.zeros((amount_of_movies, amount_of_similar_movies), dtype=numpy.int32)
+	similarities = numpy.zeros((amount_of_movies, amount_of_similar_movies), dtype=numpy.float32)
+
+	for start in range(0, amount_of_movies, block_size):
+		block = numpy.arange(start, min(start + block_size, amount_of_movies))
+		# calculate the similarities of the movies of the block to all movies
+		block_similarities = (content[block] @ content_transposed).toarray()
+		# a movie is not similar to itself
+		block_similarities[numpy.arange(len(block)), block] = 0.0
+		ranking = block_similarities + tie_breakers
+
+		# get the most similar movies of each movie of the block sorted by the similarity
+		candidates = numpy.argpartition(-ranking, amount_of_similar_movies - 1, axis=1)[:, :amount_of_similar_movies]
+		for row, movie_row in enumerate(block):
+			order = numpy.argsort(-ranking[row, candidates[row]], kind='stable')
+			neighbour_ids[movie_row] = movie_ids[candidates[row][order]]
+			similarities[movie_row] = block_similarities[row, candidates[row][order]]
+
+	path = get_index_file_path()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	numpy.savez(path, similar_movie_ids=neighbour_ids, similarities=similarities, movie_ids=movie_ids)
+	# print("done (similar movie index)")
+
+	return path
+
+
+def load_similar_movie_index():
+	"""
+	Loads the similar movie index from the instance folder if it was not loaded yet or if the file changed since (e.g.
+	because the index was rebuilt by another process).
+
+	:return: True if an index is available, False if it was not built yet
+	"""
+
+	global similar_movie_ids, similar_movie_similarities, index_movie_index, time_index_file_modified
+
+	path = get_index_file_path()
+	if not os.path.exists(path):
+		return False
+	time_modified = os.path.getmtime(path)
+	if similar_movie_ids is None or time_modified != time_index_file_modified:
+		with numpy.load(path) as index:
+			similar_movie_ids = index['similar_movie_ids']
+			similar_movie_similarities = index['similarities']
+			index_movie_index = {movie_id: row for row, movie_id in enumerate(index['movie_ids'].tolist())}
+		time_index_file_modified = time_modified
+
+	return True
+
+
+def get_similar_movie_ids(movie_id: int, amount_of_results: int = None):
+	"""
+	Gets the ids of the movies most similar to a movie by a lookup in the similar movie index. The index is not built
+	here, as that takes too long for a request, but after the data was read in or with 'flask build-similar-movies'.
+
+	:param movie_id: id of the movie
+	:param amount_of_results: maximum amount of results (None = all saved similar movies)
+	:return: list of the ids of the similar movies ordered by the similarity (empty if the index was not built yet or
+			if the movie is not part of the index)
+	"""
+
+	if not load_similar_movie_index() or movie_id not in index_movie_index:
+		return []
+
+	# only keep the movies that have anything in common with the movie
+	row = index_movie_index[movie_id]
+	ids = similar_movie_ids[row][similar_movie_similarities[row] > 0]
+
+	return ids[:amount_of_results].tolist()
+
+
+def get_similar_movies(movie_id: int, amount_of_results: int = None):
+	"""
+	Gets the movies most similar to a movie by their content, fetching the Movie objects with a single query.
+
+	:param movie_id: id of the movie
+	:param amount_of_results: maximum amount of results (None = all saved similar movies)
+	:return: similar_movies - list of Movie objects of the similar movies ordered by the similarity
+	"""
+
+	similar_ids = get_similar_movie_ids(movie_id, amount_of_results)
+	if not similar_ids:
+		return []
+
+	id_ordering = case(
+		{_id: index for index, _id in enumerate(similar_ids)},
+		value=Movie.id
+		)
+
+	return Movie.query.filter(Movie.id.in_(similar_ids)).order_by(id_ordering).all()
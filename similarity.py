@@ -0,0 +1,461 @@
+﻿from flask import current_app
+from scipy.sparse import csr_matrix, csc_matrix
+from sklearn.decomposition import TruncatedSVD
+from sklearn.neighbors import BallTree
+from sklearn.preprocessing import normalize
+import calendar
+import numpy
+import threading
+import time
+
+from models import db, UserNeighbours
+from rating_matrix import get_rating_matrix, get_rating_matrix_by_movie, get_user_ratings, get_user_rating_statistics
+
+global user_neighbour_index, user_embedding_model, index_user_ids, time_index_built, index_rebuild_thread
+user_neighbour_index = None
+user_embedding_model = None
+index_user_ids = None
+time_index_built = None
+# thread that rebuilds the expired index in the background while the requests keep using the previous one
+index_rebuild_thread = None
+# lock for replacing the index, so that the index, the embedding model and the user ids are always read together
+index_lock = threading.Lock()
+
+# amount of dimensions of the reduced user rating profiles the approximate nearest-neighbour index is built on
+amount_of_embedding_dimensions = 32
+# time in seconds after which the approximate nearest-neighbour index is rebuilt
+index_rebuild_interval = 60 * 60
+# factor by which more candidates than needed are taken from the index before they are ranked by the exact distance
+candidate_factor = 5
+# minimum amount of co-rated movies needed for the mean-centered cosine and the Pearson similarity (with fewer movies,
+# the similarities are mostly 1 or -1)
+min_co_rated_movies = 3
+# minimum rating needed so that a movie is deemed as liked by the Jaccard similarity
+min_liked_rating = 4.0
+
+
+def get_co_rated_entries(matrix_by_movie: csc_matrix, user_columns: numpy.ndarray, user_values: numpy.ndarray):
+	"""
+	Gets the ratings of all users for the movies that one user rated, together with the user's own rating of the
+	respective movie, by only reading the columns of the movies the user rated.
+
+	:param matrix_by_movie: CSC matrix of the ratings with users as rows and movies as columns
+	:param user_columns: columns of the movies the user rated
+	:param user_values: the user's ratings of these movies
+	:return: rows - array of the rows (users) of the co-rated entries,
+			user_ratings - array of the user's ratings of the movies of the entries,
+			other_ratings - array of the other users' ratings of the movies of the entries
+	"""
+
+	# get all entries of these columns and repeat the user's rating for each entry of the respective column
+	columns = matrix_by_movie[:, user_columns]
+	user_ratings = numpy.repeat(user_values, numpy.diff(columns.indptr))
+	rows = columns.indices
+	other_ratings = columns.data
+	# only keep entries that are actual ratings
+	rated = other_ratings != 0
+
+	return rows[rated], user_ratings[rated], other_ratings[rated]
+
+
+def calculate_nan_euclidean_distances(matrix_by_movie: csc_matrix, user_columns: numpy.ndarray,
+                                      user_values: numpy.ndarray):
+	"""
+	Calculates the euclidean distances between the ratings of one user and the ratings of every user in the rating
+	matrix at once while ignoring movies that are not rated by both users (NaN-aware like nan_euclidean_distances of
+	scikit-learn). The squared differences are summed over the co-rated movies only and scaled by the ratio of the
+	amount of movies that were rated at least once to the amount of co-rated movies.
+
+	:param matrix_by_movie: CSC matrix of the ratings with users as rows and movies as columns
+	:param user_columns: columns of the movies the user rated
+	:param user_values: the user's ratings of these movies
+	:return: distances - array with the distance of each user (row) to the user, or NaN if there are no co-rated movies
+	"""
+
+	rows, user_ratings, other_ratings = get_co_rated_entries(matrix_by_movie, user_columns, user_values)
+
+	# get the amount of co-rated movies and the sum of the squared differences of the ratings for each user
+	amount_of_users = matrix_by_movie.shape[0]
+	amount_co_rated = numpy.bincount(rows, minlength=amount_of_users)
+	squared_differences = numpy.bincount(rows, weights=(user_ratings - other_ratings) ** 2, minlength=amount_of_users)
+
+	# scale the sums by the ratio of all rated movies (of the whole shared rating matrix, so that the distances do not
+	# depend on the rows passed) to the co-rated movies and set the distance to NaN if there are no co-rated movies
+	amount_of_rated_movies = numpy.count_nonzero(numpy.diff(get_rating_matrix_by_movie().indptr))
+	distances = numpy.full(amount_of_users, numpy.nan)
+	co_rated = amount_co_rated > 0
+	distances[co_rated] = numpy.sqrt(amount_of_rated_movies / amount_co_rated[co_rated] *
+	                                 squared_differences[co_rated])
+
+	return distances
+
+
+def calculate_mean_centered_cosine_distances(matrix_by_movie: csc_matrix, user_columns: numpy.ndarray,
+                                             user_values: numpy.ndarray):
+	"""
+	Calculates the cosine distances (1 - cosine similarity) between the mean-centered ratings of one user and the
+	mean-centered ratings of every user in the rating matrix at once, only considering the co-rated movies. The
+	ratings of each user are centered by the mean of all of their ratings.
+
+	:param matrix_by_movie: CSC matrix of the ratings with users as rows and movies as columns
+	:param user_columns: columns of the movies the user rated
+	:param user_values: the user's ratings of these movies
+	:return: distances - array with the distance (between 0 and 2) of each user (row) to the user, or NaN if there are
+			fewer than min_co_rated_movies co-rated movies or the centered ratings of one of the users are all 0
+	"""
+
+	rows, user_ratings, other_ratings = get_co_rated_entries(matrix_by_movie, user_columns, user_values)
+
+	# center the ratings by the mean rating of the respective user
+	amount_of_users = matrix_by_movie.shape[0]
+	user_rating_counts, user_rating_sums, _ = get_user_rating_statistics()
+	means = numpy.divide(user_rating_sums, user_rating_counts, out=numpy.zeros(amount_of_users),
+	                     where=user_rating_counts > 0)
+	user_ratings = user_ratings - (user_values.mean() if len(user_values) else 0.0)
+	other_ratings = other_ratings - means[rows]
+
+	# get the dot products and the norms of the centered ratings over the co-rated movies for each user
+	dot_products = numpy.bincount(rows, weights=user_ratings * other_ratings, minlength=amount_of_users)
+	user_norms = numpy.bincount(rows, weights=user_ratings ** 2, minlength=amount_of_users)
+	other_norms = numpy.bincount(rows, weights=other_ratings ** 2, minlength=amount_of_users)
+
+	distances = get_distances_from_similarities(dot_products, numpy.sqrt(user_norms * other_norms))
+	distances[numpy.bincount(rows, minlength=amount_of_users) < min_co_rated_movies] = numpy.nan
+
+	return distances
+
+
+def calculate_pearson_distances(matrix_by_movie: csc_matrix, user_columns: numpy.ndarray,
+                                user_values: numpy.ndarray):
+	"""
+	Calculates the Pearson distances (1 - Pearson correlation) between the ratings of one user and the ratings of every
+	user in the rating matrix at once. Unlike the mean-centered cosine similarity, the ratings of both users are
+	centered by their means over the co-rated movies only.
+
+	:param matrix_by_movie: CSC matrix of the ratings with users as rows and movies as columns
+	:param user_columns: columns of the movies the user rated
+	:param user_values: the user's ratings of these movies
+	:return: distances - array with the distance (between 0 and 2) of each user (row) to the user, or NaN if there are
+			fewer than min_co_rated_movies co-rated movies or the ratings of one of the users do not vary over them
+	"""
+
+	rows, user_ratings, other_ratings = get_co_rated_entries(matrix_by_movie, user_columns, user_values)
+
+	# get the sums needed for the correlation over the co-rated movies for each user
+	amount_of_users = matrix_by_movie.shape[0]
+	amount_co_rated = numpy.bincount(rows, minlength=amount_of_users)
+	user_sums = numpy.bincount(rows, weights=user_ratings, minlength=amount_of_users)
+	other_sums = numpy.bincount(rows, weights=other_ratings, minlength=amount_of_users)
+	products = numpy.bincount(rows, weights=user_ratings * other_ratings, minlength=amount_of_users)
+	user_squares = numpy.bincount(rows, weights=user_ratings ** 2, minlength=amount_of_users)
+	other_squares = numpy.bincount(rows, weights=other_ratings ** 2, minlength=amount_of_users)
+
+	# calculate the covariances and variances (multiplied by the amount of co-rated movies)
+	co_rated = numpy.maximum(amount_co_rated, 1)
+	covariances = products - user_sums * other_sums / co_rated
+	user_variances = numpy.maximum(user_squares - user_sums ** 2 / co_rated, 0.0)
+	other_variances = numpy.maximum(other_squares - other_sums ** 2 / co_rated, 0.0)
+
+	distances = get_distances_from_similarities(covariances, numpy.sqrt(user_variances * other_variances))
+	distances[amount_co_rated < min_co_rated_movies] = numpy.nan
+
+	return distances
+
+
+def calculate_jaccard_distances(matrix_by_movie: csc_matrix, user_columns: numpy.ndarray,
+                                user_values: numpy.ndarray):
+	"""
+	Calculates the Jaccard distances (1 - Jaccard similarity) between the set of movies one user liked and the sets of
+	movies every user in the rating matrix liked at once. A movie is deemed as liked if its rating is at least
+	min_liked_rating.
+
+	:param matrix_by_movie: CSC matrix of the ratings with users as rows and movies as columns
+	:param user_columns: columns of the movies the user rated
+	:param user_values: the user's ratings of these movies
+	:return: distances - array with the distance (between 0 and 1) of each user (row) to the user, or NaN if neither of
+			the users liked any movie
+	"""
+
+	# only consider the movies the user liked
+	liked = user_values >= min_liked_rating
+	rows, _, other_ratings = get_co_rated_entries(matrix_by_movie, user_columns[liked], user_values[liked])
+
+	# get the amount of movies liked by both users and by each user
+	amount_of_users = matrix_by_movie.shape[0]
+	amount_liked_by_both = numpy.bincount(rows, weights=other_ratings >= min_liked_rating, minlength=amount_of_users)
+	amount_liked = numpy.bincount(matrix_by_movie.indices, weights=matrix_by_movie.data >= min_liked_rating,
+	                              minlength=amount_of_users)
+
+	# the union of both sets is the sum of their sizes minus the intersection
+	amount_liked_by_either = numpy.count_nonzero(liked) + amount_liked - amount_liked_by_both
+
+	return get_distances_from_similarities(amount_liked_by_both, amount_liked_by_either)
+
+
+def get_distances_from_similarities(numerators: numpy.ndarray, denominators: numpy.ndarray):
+	"""
+	Calculates the distances (1 - similarity) for similarities given as fractions. The distances are rounded so that
+	identical profiles get a distance of exactly 0 despite floating point errors.
+
+	:param numerators: array of the numerators of the similarities
+	:param denominators: array of the denominators of the similarities
+	:return: distances - array of the distances, or NaN where the denominator is 0
+	"""
+
+	distances = numpy.full(len(numerators), numpy.nan)
+	defined = denominators > 0
+	similarities = numpy.clip(numerators[defined] / denominators[defined], -1.0, 1.0)
+	distances[defined] = numpy.round(1.0 - similarities, 12)
+
+	return distances
+
+
+# similarity metrics that can be used to find similar users, with the function that calculates the distances of all
+# users to a user and the default maximum distance between similar users
+similarity_metrics = {
+	'euclidean': {'function': calculate_nan_euclidean_distances, 'max_distance': 30},
+	'cosine': {'function': calculate_mean_centered_cosine_distances, 'max_distance': 0.5},
+	'pearson': {'function': calculate_pearson_distances, 'max_distance': 0.5},
+	'jaccard': {'function': calculate_jaccard_distances, 'max_distance': 0.8},
+	}
+
+
+def calculate_user_distances(user_id: int, metric: str = 'euclidean', rows: numpy.ndarray = None):
+	"""
+	Calculates the distances between a user's exact current ratings and the ratings of every user (or only the given
+	users) in the rating matrix with the given similarity metric.
+
+	:param user_id: id of the user
+	:param metric: name of the similarity metric (a key of similarity_metrics)
+	:param rows: rows of the users the distances should be calculated for (all users if None)
+	:return: distances - array with the distance of each user (row) to the user, or NaN if it is not defined (or if
+			the row is not one of the given rows)
+	"""
+
+	if metric not in similarity_metrics:
+		raise ValueError("Unknown similarity metric: " + str(metric))
+
+	matrix, _, _ = get_rating_matrix(user_id)
+	user_columns, user_values = get_user_ratings(user_id)
+
+	if rows is None:
+		matrix_by_movie = get_rating_matrix_by_movie()
+	else:
+		# only keep the given rows (at their positions, so that the rows still match the per-user statistics)
+		selected = matrix[rows].tocoo()
+		matrix_by_movie = csc_matrix((selected.data, (numpy.asarray(rows)[selected.row], selected.col)),
+		                             shape=matrix.shape)
+		matrix_by_movie.sort_indices()
+
+	return similarity_metrics[metric]['function'](matrix_by_movie, user_columns, user_values)
+
+
+def get_centered_ratings(matrix: csr_matrix):
+	"""
+	Centers the ratings of each user by subtracting the user's mean rating, so that the rating profiles of users who
+	rate generally higher or lower can be compared.
+
+	:param matrix: CSR matrix of the ratings with users as rows and movies as columns
+	:return: centered - CSR matrix of the centered ratings with the same sparsity structure
+	"""
+
+	# get the row of each entry and calculate the mean rating of each user (only considering actual ratings)
+	entry_rows = numpy.repeat(numpy.arange(matrix.shape[0]), numpy.diff(matrix.indptr))
+	rated = matrix.data != 0
+	amount_of_ratings = numpy.bincount(entry_rows, weights=rated, minlength=matrix.shape[0])
+	sum_of_ratings = numpy.bincount(entry_rows, weights=matrix.data, minlength=matrix.shape[0])
+	means = numpy.divide(sum_of_ratings, amount_of_ratings, out=numpy.zeros(matrix.shape[0]),
+	                     where=amount_of_ratings > 0)
+
+	# subtract the means from the ratings of the corresponding rows
+	centered_data = (matrix.data - means[entry_rows]) * rated
+	centered = csr_matrix((centered_data, matrix.indices, matrix.indptr), shape=matrix.shape)
+
+	return centered
+
+
+def build_user_neighbour_index():
+	"""
+	Builds the approximate nearest-neighbour index over the users' rating profiles. The centered rating profiles are
+	reduced to a small amount of dimensions with a truncated SVD and normalized, and a ball tree is built on these
+	embeddings so that the nearest users to a profile can be found without comparing it to all users.
+	"""
+
+	global user_neighbour_index, user_embedding_model, index_user_ids, time_index_built
+
+	# print("build user neighbour index")
+	matrix, users, _ = get_rating_matrix()
+	centered = get_centered_ratings(matrix)
+
+	# reduce the rating profiles to the embedding dimensions and normalize them
+	amount_of_components = max(1, min(amount_of_embedding_dimensions, min(matrix.shape) - 1))
+	embedding_model = TruncatedSVD(n_components=amount_of_components, random_state=0)
+	embeddings = normalize(embedding_model.fit_transform(centered))
+
+	index = BallTree(embeddings)
+	with index_lock:
+		user_neighbour_index = index
+		user_embedding_model = embedding_model
+		index_user_ids = numpy.array(list(users.keys()))
+		time_index_built = time.time()
+	# print("done (user neighbour index)")
+
+
+def rebuild_user_neighbour_index_in_background():
+	"""
+	Starts rebuilding the approximate nearest-neighbour index in a thread of its own (with an application context of
+	its own) unless it is already being rebuilt. The previous index is used until the new one is built.
+	"""
+
+	global index_rebuild_thread
+
+	def rebuild(app):
+		with app.app_context():
+			build_user_neighbour_index()
+
+	with index_lock:
+		if index_rebuild_thread is not None and index_rebuild_thread.is_alive():
+			return
+		index_rebuild_thread = threading.Thread(target=rebuild, args=(current_app._get_current_object(),),
+		                                        name='user-neighbour-index', daemon=True)
+		index_rebuild_thread.start()
+
+
+def get_nearest_users(user_id: int, amount_of_neighbours: int, metric: str = 'euclidean'):
+	"""
+	Gets the amount_of_neighbours users that are most similar to a user by querying the approximate nearest-neighbour
+	index for candidates and ranking them by the exact distance of the given similarity metric. The index is built in
+	the background if it does not exist yet and rebuilt periodically; until the first index is built, all users are
+	ranked by the exact distance (one-vs-all), so that no request needs to wait for the index.
+
+	:param user_id: id of the user the nearest users should be gotten for
+	:param amount_of_neighbours: amount of users that should be returned
+	:param metric: name of the similarity metric the candidates are ranked by (a key of similarity_metrics)
+	:return: user_ids - array of the ids of the nearest users sorted by the distance in an increasing manner,
+			distances - array of the corresponding distances
+	"""
+
+	with index_lock:
+		index, embedding_model, user_ids, time_built = (user_neighbour_index, user_embedding_model, index_user_ids,
+		                                                time_index_built)
+	# build the index in the background if it does not exist yet or the rebuild interval has passed
+	if index is None or time.time() - time_built > index_rebuild_interval:
+		rebuild_user_neighbour_index_in_background()
+
+	matrix, users, _ = get_rating_matrix(user_id)
+
+	if index is None:
+		# until the index is built, calculate the exact distances between all users and the user
+		distances = calculate_user_distances(user_id, metric)
+		candidate_ids = numpy.array(list(users.keys()))
+		own_row = candidate_ids == user_id
+		candidate_ids, distances = candidate_ids[~own_row], distances[~own_row]
+	else:
+		user_columns, user_values = get_user_ratings(user_id)
+
+		# embed the user's current rating profile (the user does not need to be part of the index) and query the index
+		# for candidates
+		user_profile = csr_matrix((user_values, user_columns, [0, len(user_columns)]), shape=(1, matrix.shape[1]))
+		embedding = normalize(embedding_model.transform(get_centered_ratings(user_profile)))
+		amount_of_candidates = min(len(user_ids), (amount_of_neighbours + 1) * candidate_factor)
+		_, candidate_indices = index.query(embedding, k=amount_of_candidates)
+		candidate_ids = user_ids[candidate_indices.ravel()]
+		candidate_ids = candidate_ids[candidate_ids != user_id]
+
+		# calculate the exact distances of the candidates (only for their rows)
+		candidate_rows = numpy.array([users[u] for u in candidate_ids], dtype=int)
+		distances = calculate_user_distances(user_id, metric, candidate_rows)[candidate_rows]
+
+	# rank the candidates by the exact distance and ignore candidates for which it is not defined
+	valid = ~numpy.isnan(distances)
+	candidate_ids, distances = candidate_ids[valid], distances[valid]
+	order = numpy.lexsort((candidate_ids, distances))[:amount_of_neighbours]
+
+	return candidate_ids[order], distances[order]
+
+
+def get_cached_neighbours(user_id: int, metric: str, max_distance: float, amount_of_neighbours: int = None):
+	"""
+	Gets the neighbours of a user from the persisted neighbour cache if the cached entry is still valid. An entry is
+	invalid if it was calculated with other parameters, if the user's ratings changed materially since it was
+	calculated (i.e. the amount of rating changes reached USER_NEIGHBOURS_MIN_RATING_CHANGES or the share
+	USER_NEIGHBOURS_RATING_CHANGE_RATIO of the amount of ratings at the time of the calculation, whichever is
+	larger), or if it is older than USER_NEIGHBOURS_REFRESH_INTERVAL seconds.
+
+	:param user_id: id of the user
+	:param metric: name of the similarity metric the neighbours were calculated with
+	:param max_distance: maximum distance the neighbours were calculated with
+	:param amount_of_neighbours: amount of nearest users the neighbours were calculated with (or None)
+	:return: neighbour_ids, distances - arrays of the ids of the cached neighbours and their distances, or None, None if
+			there is no valid entry
+	"""
+
+	entry = UserNeighbours.query.filter(UserNeighbours.user_id == user_id).first()
+	if entry is None:
+		return None, None
+
+	# check whether the entry was calculated with the same parameters
+	if (entry.metric != metric or entry.max_distance != max_distance or
+			entry.amount_of_neighbours != amount_of_neighbours):
+		return None, None
+
+	# check whether the user's ratings changed materially since the calculation
+	change_ratio = current_app.config.get('USER_NEIGHBOURS_RATING_CHANGE_RATIO', 0.0)
+	min_rating_changes = max(current_app.config.get('USER_NEIGHBOURS_MIN_RATING_CHANGES', 1),
+	                         change_ratio * entry.amount_of_ratings)
+	if entry.amount_of_rating_changes >= min_rating_changes:
+		return None, None
+
+	# check whether the entry needs to be refreshed
+	current_time = calendar.timegm(time.gmtime())
+	refresh_interval = current_app.config.get('USER_NEIGHBOURS_REFRESH_INTERVAL')
+	if refresh_interval is not None and current_time - entry.time_calculated > refresh_interval:
+		return None, None
+
+	return numpy.array(entry.neighbour_ids, dtype=int), numpy.array(entry.distances, dtype=float)
+
+
+def save_neighbours(user_id: int, neighbour_ids: numpy.ndarray, distances: numpy.ndarray, metric: str,
+                    max_distance: float, amount_of_neighbours: int = None):
+	"""
+	Saves the neighbours of a user in the persisted neighbour cache together with the parameters they were calculated
+	with and the user's current amount of ratings, and resets the user's amount of rating changes.
+
+	:param user_id: id of the user
+	:param neighbour_ids: array of the ids of the neighbours ordered by the distance
+	:param distances: array of the corresponding distances
+	:param metric: name of the similarity metric the neighbours were calculated with
+	:param max_distance: maximum distance the neighbours were calculated with
+	:param amount_of_neighbours: amount of nearest users the neighbours were calculated with (or None)
+	"""
+
+	# get the user's current amount of ratings
+	user_columns, _ = get_user_ratings(user_id)
+
+	entry = UserNeighbours.query.filter(UserNeighbours.user_id == user_id).first()
+	if entry is None:
+		entry = UserNeighbours(user_id=user_id, version=0)
+		db.session.add(entry)
+	entry.neighbour_ids = neighbour_ids.tolist()
+	entry.distances = distances.tolist()
+	entry.metric = metric
+	entry.max_distance = max_distance
+	entry.amount_of_neighbours = amount_of_neighbours
+	entry.version = (entry.version or 0) + 1
+	entry.amount_of_ratings = len(user_columns)
+	entry.amount_of_rating_changes = 0
+	entry.time_calculated = calendar.timegm(time.gmtime())
+	db.session.commit()
+
+
+def register_rating_change(user_id: int):
+	"""
+	Counts a change of a user's ratings (a new, updated, ignored or "un"-ignored rating) towards the invalidation of
+	the user's cached neighbours.
+
+	:param user_id: id of the user whose ratings changed
+	"""
+
+	(db.session.query(UserNeighbours).filter(UserNeighbours.user_id == user_id)
+	 .update({'amount_of_rating_changes': UserNeighbours.amount_of_rating_changes + 1}))
+	db.session.commit()
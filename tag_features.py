@@ -0,0 +1,93 @@
+﻿from scipy.sparse import csr_matrix
+import numpy
+
+from models import db, Tags
+from movie_features import get_movie_features, get_movie_positions
+from rating_matrix import get_user_ratings, get_movie_ids
+
+global tag_names, tag_index, movie_tag_matrix
+tag_names = None
+tag_index = None
+movie_tag_matrix = None
+
+
+def build_movie_tag_matrix():
+	"""
+	Builds the TF-IDF matrix of the tags of all movies with a single query. The preprocessed tags (search_tag) are used
+	as the canonical form of the tags, so that e.g. "Time Travel" and "time-travel" count as the same tag. The rows
+	are in the order of the shared movie features and normalized to unit length, so that the product of two rows is the
+	cosine similarity of the movies.
+	"""
+
+	global tag_names, tag_index, movie_tag_matrix
+
+	# print("build movie tag matrix")
+	movie_ids = get_movie_features()[0]
+	tags = db.session.query(Tags.movie_id, Tags.search_tag).filter(Tags.search_tag.isnot(None),
+	                                                               Tags.search_tag != '').all()
+	tag_names = sorted({t.search_tag for t in tags})
+	tag_index = {tag: index for index, tag in enumerate(tag_names)}
+
+	# count how often each tag was given to each movie (the term frequencies), leaving out movies that are not part of
+	# the movie features
+	rows = get_movie_positions([t.movie_id for t in tags])
+	columns = numpy.array([tag_index[t.search_tag] for t in tags], dtype=int)
+	known = rows >= 0
+	matrix = csr_matrix((numpy.ones(int(known.sum())), (rows[known], columns[known])),
+	                    shape=(len(movie_ids), len(tag_names)))
+	matrix.sum_duplicates()
+
+	# weight the term frequencies by the smoothed inverse document frequency of the tags, so that tags given to many
+	# movies count less than specific ones
+	amount_of_tagged_movies = numpy.count_nonzero(numpy.diff(matrix.indptr))
+	document_frequencies = numpy.bincount(matrix.indices, minlength=len(tag_names))
+	matrix = matrix.multiply(numpy.log((1 + amount_of_tagged_movies) / (1 + document_frequencies)) + 1).tocsr()
+
+	# normalize the rows to unit length (rows of movies without tags stay 0)
+	norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+	movie_tag_matrix = csr_matrix(matrix.multiply(numpy.divide(1.0, norms, out=numpy.zeros(len(norms)),
+	                                                           where=norms > 0)[:, None]))
+	# print("done (movie tag matrix)")
+
+
+def get_movie_tag_matrix():
+	"""
+	Gets the TF-IDF matrix of the tags of all movies and builds it if it does not exist yet.
+
+	:return: movie_tag_matrix - CSR matrix with the movies as rows (in the order of the movie features) and the tags as
+			columns, tag_names - list of the preprocessed tags (the order of the columns)
+	"""
+
+	if movie_tag_matrix is None:
+		build_movie_tag_matrix()
+
+	return movie_tag_matrix, tag_names
+
+
+def predict_tag_based_scores(user_id: int, min_rating: float):
+	"""
+	Calculates the tag-based scores of all movies for a user as the cosine similarity between the tag vector of each
+	movie and the profile of the user, i.e. the sum of the tag vectors of the movies the user liked, with a single
+	sparse matrix-vector product.
+
+	:param user_id: id of the user
+	:param min_rating: minimum rating needed so that a movie is deemed as liked
+	:return: movie_ids - array of the ids of all movies (in the order of the movie features),
+			scores - array of the corresponding scores between 0.0 and 1.0
+	"""
+
+	matrix, _ = get_movie_tag_matrix()
+	movie_ids = get_movie_features()[0]
+	user_columns, user_values = get_user_ratings(user_id)
+
+	# get the rows of the liked movies in the tag matrix
+	positions = get_movie_positions(get_movie_ids()[user_columns[user_values >= min_rating]].tolist())
+	positions = positions[positions >= 0]
+
+	# build the profile of the user from the tag vectors of the liked movies and normalize it to unit length
+	profile = numpy.asarray(matrix[positions].sum(axis=0)).ravel()
+	norm = numpy.linalg.norm(profile)
+	if norm == 0:
+		return movie_ids, numpy.zeros(len(movie_ids))
+
+	return movie_ids, matrix @ (profile / norm)
@@ -0,0 +1,167 @@
+﻿from sqlalchemy import func
+import math
+
+from get_data import get_all_movies_and_users_ids, get_movie_genres, get_most_popular_movie_ids, get_survey_preferences
+from models import db, Movie, MovieRating, UserGenrePreferences
+
+# the scorers as they were before they were vectorised, going through all movies one by one with a query per movie; the
+# vectorised scorers need to calculate the same scores
+
+
+def get_rated_and_ignored_movie_ids(user_id: int):
+	"""
+	Gets the ids of the movies the user rated (excluding those they ignored) and of the movies they ignored.
+
+	:param user_id: id of the user
+	:return: movies_already_rated_ids - list of the ids of the movies the user rated,
+			ignored_movies_ids - list of the ids of the movies the user ignored
+	"""
+
+	movies_already_rated = MovieRating.query.filter(MovieRating.user_id == user_id,
+	                                                MovieRating.ignored == 0).all()
+	ignored_movies = MovieRating.query.filter(MovieRating.user_id == user_id,
+	                                          MovieRating.ignored == 1).all()
+
+	return [m.movie_id for m in movies_already_rated], [m.movie_id for m in ignored_movies]
+
+
+def calculate_item_based_scores(user_id: int, genre_ratios: dict[any, list], decade_ratios: dict[any, list]):
+	"""
+	Calculates the item-based scores of all movies for the user.
+
+	:param user_id: id of the user
+	:param genre_ratios: dictionary with genres as keys and a list of the "liked" and the "disliked" ratio as values
+	:param decade_ratios: dictionary with decades as keys and a list of the "liked" and the "disliked" ratio as values
+	:return: new_scores - dictionary with movie ids as keys and the scores as values
+	"""
+
+	all_movie_ids, _ = get_all_movies_and_users_ids()
+	movies_already_rated_ids, ignored_movies_ids = get_rated_and_ignored_movie_ids(user_id)
+
+	new_scores = {}
+	# go through all movies and sum up the genre-based factors
+	for movie in all_movie_ids:
+		if movie in ignored_movies_ids or movie in movies_already_rated_ids:
+			score = 0.0
+		else:
+			movie_genres = get_movie_genres(movie)
+			amount_of_genres = len(movie_genres)
+			score = 0.0
+			for genre in movie_genres:
+				if genre is None:
+					score = 0.25
+					break
+				else:
+					score += (1 / amount_of_genres) * (1 * genre_ratios[genre][0] + (-1) * genre_ratios[genre][1])
+		new_scores[movie] = round(score, 2)
+
+	# go through all movies again and add the decade-based score
+	for movie in all_movie_ids:
+		if movie in ignored_movies_ids or movie in movies_already_rated_ids:
+			score = 0.0
+		else:
+			year = Movie.query.filter(Movie.id == movie).first().release_year
+			if year is not None:
+				decade = math.floor(year / 10) * 10
+				score = 1 * (1 * decade_ratios[decade][0] + (-1) * decade_ratios[decade][1])
+			else:
+				score = 0.25
+		if new_scores[movie] + score > 1.0:
+			new_scores[movie] = 1.0
+		elif new_scores[movie] + score < 0.0:
+			new_scores[movie] = 0.0
+		else:
+			new_scores[movie] = round((new_scores[movie] + score), 2)
+
+	return new_scores
+
+
+def calculate_survey_based_scores(user_id: int):
+	"""
+	Calculates the survey-based scores of all movies for the user.
+
+	:param user_id: id of the user
+	:return: new_scores - dictionary with movie ids as keys and the scores as values
+	"""
+
+	all_movie_ids, _ = get_all_movies_and_users_ids()
+	movies_already_rated_ids, ignored_movies_ids = get_rated_and_ignored_movie_ids(user_id)
+	max_amount_of_ratings = db.session.query(func.max(Movie.amount_of_ratings)).first()[0]
+	liked_genres, disliked_genres = get_survey_preferences(user_id)
+
+	new_scores = {}
+	for movie in all_movie_ids:
+		if movie in ignored_movies_ids or movie in movies_already_rated_ids:
+			score = 0.0
+		else:
+			movie_genres = get_movie_genres(movie)
+			disliked = [g for g in movie_genres if g in disliked_genres]
+			if disliked:
+				score = 0.0
+			else:
+				liked = [g for g in movie_genres if g in liked_genres]
+				if liked:
+					amount_of_ratings = Movie.query.filter(Movie.id == movie).first().amount_of_ratings
+					if amount_of_ratings is None:
+						amount_of_ratings = 0
+					score = round((0.5 * (len(liked) / len(movie_genres)) + 0.5 * (
+							amount_of_ratings / max_amount_of_ratings)), 2)
+				else:
+					score = 0.0
+		new_scores[movie] = score
+
+	return new_scores
+
+
+def calculate_exploration_based_scores(user_id: int, exploration_type: str):
+	"""
+	Calculates the exploration-based scores of all movies for the user.
+
+	:param user_id: id of the user
+	:param exploration_type: either popular or underexplored
+	:return: new_scores - dictionary with movie ids as keys and the scores as values
+	"""
+
+	all_movie_ids, _ = get_all_movies_and_users_ids()
+	movies_already_rated_ids, ignored_movies_ids = get_rated_and_ignored_movie_ids(user_id)
+	max_amount_of_ratings = db.session.query(func.max(Movie.amount_of_ratings)).first()[0]
+
+	new_scores = {}
+	if exploration_type == "popular":
+		popular_liked_movies_ids = get_most_popular_movie_ids(user_id, 100, consider_ratings=True)
+		for movie_id in popular_liked_movies_ids:
+			if movie_id in ignored_movies_ids or movie_id in movies_already_rated_ids:
+				score = 0.0
+			else:
+				movie = Movie.query.filter(Movie.id == movie_id).first()
+				amount_of_ratings = movie.amount_of_ratings if movie.amount_of_ratings is not None else 0
+				score = round(
+					(0.5 * (movie.average_rating - 4.0) + 0.5 * (amount_of_ratings / max_amount_of_ratings)), 2)
+			new_scores[movie_id] = score
+		for movie_id in all_movie_ids:
+			if movie_id not in popular_liked_movies_ids:
+				new_scores[movie_id] = 0.0
+	else:
+		# get the genres the user did not rate any movie with, or if there are none, the genres that less than 10% of
+		# their ratings included
+		no_ratings = UserGenrePreferences.query.filter(UserGenrePreferences.user_id == user_id,
+		                                               UserGenrePreferences.amount_of_ratings == 0).all()
+		if not no_ratings:
+			no_ratings = UserGenrePreferences.query.filter(
+				UserGenrePreferences.user_id == user_id,
+				UserGenrePreferences.amount_of_ratings < len(movies_already_rated_ids) * 0.1).all()
+		underexplored_genres = [g.genre for g in no_ratings]
+
+		for movie in all_movie_ids:
+			if not underexplored_genres or movie in ignored_movies_ids or movie in movies_already_rated_ids:
+				score = 0.0
+			else:
+				movie_genres = get_movie_genres(movie)
+				if None in movie_genres:
+					score = 0.25
+				else:
+					underexplored = [g for g in movie_genres if g is not None and g in underexplored_genres]
+					score = round(len(underexplored) / len(movie_genres), 2) if underexplored else 0.0
+			new_scores[movie] = score
+
+	return new_scores
@@ -0,0 +1,191 @@
+﻿import math
+import os
+import sys
+
+from flask import Flask
+from flask_login import login_user
+from flask_user import UserManager
+import pytest
+
+# the modules of the app are not part of a package, so make them importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import get_data
+import movie_features
+import rating_matrix
+import recommendation
+from models import db, User, Movie, MovieGenre, MovieRating
+from preparation import get_and_save_amount_of_ratings_and_average_ratings, initialize_user_movie_scores
+from recommendation import (add_new_rating_or_update, update_data_after_rating, ignore_movie_for_recommendations,
+                            revoke_ignore_movie_for_recommendations, update_scores_of_ignored_or_rated_movie,
+                            save_survey_preferences_and_check_for_recalculation)
+
+# genres and release years of the fixture movies (None = "(no genres listed)" or no release year), chosen so that
+# there are movies with several genres, without a genre and without a release year
+fixture_movies = {
+	1: (['Action', 'Sci-Fi'], 1977),
+	2: (['Comedy'], 1995),
+	3: (['Drama', 'Romance'], 1994),
+	4: (['Horror'], 1980),
+	5: (['Action', 'Comedy', 'Drama'], 2001),
+	6: ([None], 1999),
+	7: (['Sci-Fi'], None),
+	8: (['Comedy', 'Romance'], 1989),
+	9: (['Drama'], 2010),
+	10: (['Action'], 2015),
+	11: (['Horror', 'Sci-Fi'], 1979),
+	12: (['Romance'], 1953),
+	13: ([None], None),
+	14: (['Comedy', 'Drama'], 1999),
+	15: (['Action', 'Drama', 'Romance', 'Sci-Fi'], 2004),
+	16: (['Drama'], 1972),
+	17: (['Documentary'], 2012),
+	18: (['Animation', 'Comedy'], 1995),
+}
+# ids of the other users that rated the fixture movies
+fixture_user_ids = [1, 2, 3, 4, 5, 6]
+# id of the user the scores are calculated for
+test_user_id = 10
+# ratings of the test user before the tests (in the order in which they are rated)
+test_user_ratings = {1: 5.0, 3: 2.0, 8: 4.0, 11: 1.0, 9: 3.0}
+
+
+def get_fixture_rating(user_id: int, movie_id: int):
+	"""
+	Gets the rating of a fixture movie by another user, so that some of the movies are popular (an average rating of at
+	least 4.0) and one movie is not rated at all.
+
+	:param user_id: id of the user
+	:param movie_id: id of the movie
+	:return: rating - the rating of the movie (None if the user did not rate it)
+	"""
+
+	if (user_id + movie_id) % 4 == 0 or movie_id == 18:
+		return None
+	return 5.0 - ((user_id * movie_id + movie_id) % 7) * 0.5
+
+
+@pytest.fixture
+def app(monkeypatch):
+	"""
+	Creates an app with an in-memory database that contains the fixture movies and ratings, and resets the shared state
+	of the modules (movie features, rating matrix, popularity ranking and tracked changes), so that each test starts
+	from the fixture.
+	"""
+
+	app = Flask(__name__)
+	app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+	app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+	app.config['SECRET_KEY'] = 'test'
+	app.config['USER_ENABLE_EMAIL'] = False
+	app.config['USER_ENABLE_USERNAME'] = True
+	db.init_app(app)
+	UserManager(app, db, User)
+
+	monkeypatch.setattr(movie_features, 'feature_movie_ids', None)
+	monkeypatch.setattr(rating_matrix, 'rating_matrix', None)
+	monkeypatch.setattr(rating_matrix, 'rating_matrix_by_movie', None)
+	monkeypatch.setattr(rating_matrix, 'pending_ratings', {})
+	monkeypatch.setattr(get_data, 'popularity_ranking', None)
+	monkeypatch.setattr(recommendation, 'item_based_changed_movies', {})
+	monkeypatch.setattr(recommendation, 'survey_changed_genres', {})
+	monkeypatch.setattr(recommendation, 'pending_score_components', {})
+
+	with app.app_context():
+		db.create_all()
+		for movie_id, (genres, year) in fixture_movies.items():
+			title = "Movie %d" % movie_id if year is None else "Movie %d (%d)" % (movie_id, year)
+			db.session.add(Movie(id=movie_id, title=title, release_year=year))
+			# a missing genre is saved as NaN like in read_data.py (as the column has a server default)
+			for genre in genres:
+				db.session.add(MovieGenre(movie_id=movie_id, genre=math.nan if genre is None else genre))
+		for user_id in fixture_user_ids + [test_user_id]:
+			db.session.add(User(id=user_id, username="User%d" % user_id, password='', active=True))
+			for movie_id in fixture_movies:
+				rating = get_fixture_rating(user_id, movie_id)
+				if user_id != test_user_id and rating is not None:
+					db.session.add(MovieRating(user_id=user_id, movie_id=movie_id, rating=rating,
+					                           time_rated=movie_id, ignored=False))
+		db.session.commit()
+		get_and_save_amount_of_ratings_and_average_ratings()
+		initialize_user_movie_scores(test_user_id)
+		yield app
+		db.session.remove()
+		db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+	"""
+	Gets the test user after they rated their fixture ratings (like through the /rate route).
+	"""
+
+	user = db.session.get(User, test_user_id)
+	for movie_id, rating in test_user_ratings.items():
+		with app.test_request_context():
+			login_user(user)
+			add_new_rating_or_update(movie_id, rating)
+			update_data_after_rating(movie_id, rating)
+	return user
+
+
+@pytest.fixture
+def rate(app, user):
+	"""
+	Gets a function that rates a movie as the test user (like the /rate route).
+	"""
+
+	def rate_movie(movie_id: int, rating: float):
+		with app.test_request_context():
+			login_user(user)
+			add_new_rating_or_update(movie_id, rating)
+			update_data_after_rating(movie_id, rating)
+
+	return rate_movie
+
+
+@pytest.fixture
+def ignore(app, user):
+	"""
+	Gets a function that ignores a movie as the test user (like the /ignore route).
+	"""
+
+	def ignore_movie(movie_id: int):
+		with app.test_request_context():
+			login_user(user)
+			ignore_movie_for_recommendations(movie_id)
+			rating_entry = MovieRating.query.filter(MovieRating.movie_id == movie_id,
+			                                        MovieRating.user_id == user.id).first()
+			if rating_entry.rating is None:
+				update_scores_of_ignored_or_rated_movie(movie_id)
+
+	return ignore_movie
+
+
+@pytest.fixture
+def revoke_ignore(app, user):
+	"""
+	Gets a function that revokes ignoring a movie as the test user (like the /revoke_ignore route).
+	"""
+
+	def revoke_ignore_movie(movie_id: int):
+		with app.test_request_context():
+			login_user(user)
+			revoke_ignore_movie_for_recommendations(movie_id)
+
+	return revoke_ignore_movie
+
+
+@pytest.fixture
+def submit_survey(app, user):
+	"""
+	Gets a function that submits the preference survey as the test user (like the /survey_submit route) and returns the
+	scores that need to be recalculated.
+	"""
+
+	def submit(included_genres: list[str], excluded_genres: list[str]):
+		with app.test_request_context():
+			login_user(user)
+			return save_survey_preferences_and_check_for_recalculation(included_genres, excluded_genres)
+
+	return submit
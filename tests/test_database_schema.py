@@ -0,0 +1,67 @@
+﻿from flask import Flask
+from sqlalchemy import inspect, text
+import pytest
+
+from models import db
+from preparation import upgrade_database_schema, save_search_ready_titles_and_tags
+
+# tables as they were created before the search-ready columns, the item-collaborative and tag-based scores and the
+# unique constraint of the scores were added
+old_tables = [
+	"CREATE TABLE movies (id INTEGER NOT NULL, title VARCHAR(100) COLLATE \"NOCASE\" NOT NULL, release_year INTEGER, "
+	"amount_of_ratings INTEGER, average_rating FLOAT, PRIMARY KEY (id), UNIQUE (title))",
+	"CREATE TABLE tags (id INTEGER NOT NULL, movie_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+	"tag VARCHAR(255) DEFAULT '' NOT NULL, timestamp INTEGER, PRIMARY KEY (id), UNIQUE (movie_id, tag))",
+	"CREATE TABLE user_movie_scores (id INTEGER NOT NULL, user_id INTEGER NOT NULL, movie_id INTEGER NOT NULL, "
+	"survey_based_score FLOAT DEFAULT '' NOT NULL, user_based_score FLOAT DEFAULT '' NOT NULL, "
+	"item_based_score FLOAT DEFAULT '' NOT NULL, exploration_based_score FLOAT DEFAULT '' NOT NULL, "
+	"total_recommendation_score FLOAT DEFAULT '' NOT NULL, PRIMARY KEY (id))",
+]
+
+
+@pytest.fixture
+def old_database():
+	"""
+	Creates an app with an in-memory database that has the old tables and some entries, including a duplicate score.
+	"""
+
+	app = Flask(__name__)
+	app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+	db.init_app(app)
+	with app.app_context():
+		for statement in old_tables:
+			db.session.execute(text(statement))
+		db.session.execute(text("INSERT INTO movies (id, title, release_year) VALUES (1, 'Toy Story (1995)', 1995)"))
+		db.session.execute(text("INSERT INTO tags (id, movie_id, user_id, tag) VALUES (1, 1, 1, 'PIXAR')"))
+		for score_id, item_based_score in [(1, 0.5), (2, 0.25)]:
+			db.session.execute(text("INSERT INTO user_movie_scores VALUES (%d, 1, 1, 0, 0, %s, 0, 0)"
+			                        % (score_id, item_based_score)))
+		db.session.commit()
+		db.create_all()
+		yield app
+		db.session.remove()
+		db.drop_all()
+
+
+def test_missing_columns_indexes_and_constraints_are_added(old_database):
+	upgrade_database_schema()
+
+	inspector = inspect(db.engine)
+	score_columns = {c['name'] for c in inspector.get_columns('user_movie_scores')}
+	assert {'item_collaborative_score', 'tag_based_score'} <= score_columns
+	assert any(i['column_names'] == ['search_title'] for i in inspector.get_indexes('movies'))
+	assert any(i['column_names'] == ['search_tag'] for i in inspector.get_indexes('tags'))
+	assert any(i['column_names'] == ['user_id', 'movie_id'] and i['unique']
+	           for i in inspector.get_indexes('user_movie_scores'))
+	# the first of the duplicate scores is kept, and the new scores get their default
+	scores = db.session.execute(text("SELECT id, item_based_score, item_collaborative_score, tag_based_score "
+	                                 "FROM user_movie_scores")).all()
+	assert [tuple(row) for row in scores] == [(1, 0.5, 0.0, 0.0)]
+
+	# the search-ready titles and tags can be filled in for the existing entries now
+	save_search_ready_titles_and_tags()
+	assert db.session.execute(text("SELECT search_title FROM movies")).scalar() is not None
+	assert db.session.execute(text("SELECT search_tag FROM tags")).scalar() == 'pixar'
+
+	# nothing is missing anymore
+	upgrade_database_schema()
@@ -0,0 +1,82 @@
+﻿import pytest
+
+import recommendation
+from recommendation import get_movie_recommendations
+from score_storage import load_scores
+
+
+def recalculate_scores(user_id: int, method: str, score_name: str, calculation_needed_for: tuple[str]):
+	"""
+	Recalculates the scores of a method for the user like the home page does and gets them.
+
+	:param user_id: id of the user
+	:param method: recommendation type, e.g. 'item-based'
+	:param score_name: name of the score attribute of the method, e.g. 'item_based_score'
+	:param calculation_needed_for: tuple of strings relating to UserMovieRecommendationScores attributes that the values
+			need to be recalculated for
+	:return: scores - dictionary with movie ids as keys and the scores as values
+	"""
+
+	get_movie_recommendations(user_id, 0, 4.0, 10, method, calculation_needed_for=calculation_needed_for)
+	movie_ids, scores = load_scores(user_id, score_name)
+	return dict(zip(movie_ids.tolist(), scores.tolist()))
+
+
+@pytest.mark.parametrize('changes', [
+	# a new rating, a new rating of a movie without a genre and release year, and a changed rating
+	[('rate', 2, 1.0)],
+	[('rate', 13, 5.0)],
+	[('rate', 8, 1.5)],
+	# an ignored movie that was rated and one that was not
+	[('ignore', 3)],
+	[('ignore', 6)],
+	# several changes, each followed by a recalculation
+	[('rate', 2, 1.0), ('rate', 15, 4.5), ('ignore', 10), ('revoke', 10), ('ignore', 1), ('revoke', 1)],
+])
+def test_item_based_scores_are_updated_incrementally(user, rate, ignore, revoke_ignore, changes):
+	recalculate_scores(user.id, 'item-based', 'item_based_score', ('item-based',))
+
+	for change in changes:
+		if change[0] == 'rate':
+			rate(change[1], change[2])
+		elif change[0] == 'ignore':
+			ignore(change[1])
+		else:
+			revoke_ignore(change[1])
+		# only the changed movie is tracked, so the scores are updated incrementally
+		assert recommendation.item_based_changed_movies[user.id] == {change[1]}
+		incremental_scores = recalculate_scores(user.id, 'item-based', 'item_based_score', ('item-based',))
+
+		# without the tracked changes, the scores are calculated for all movies
+		recommendation.item_based_changed_movies.pop(user.id)
+		full_scores = recalculate_scores(user.id, 'item-based', 'item_based_score', ('item-based',))
+		assert incremental_scores == pytest.approx(full_scores)
+
+
+@pytest.mark.parametrize('surveys', [
+	# a genre added, then the same responses again (no recalculation needed)
+	[(['Action', 'Sci-Fi', 'Documentary'], ['Horror']), (['Action', 'Sci-Fi', 'Documentary'], ['Horror'])],
+	# a liked genre that becomes disliked
+	[(['Action'], ['Horror', 'Sci-Fi'])],
+	# all responses removed, then new ones
+	[([], []), (['Comedy'], []), (['Comedy', 'Romance'], ['Drama'])],
+])
+def test_survey_based_scores_are_updated_incrementally(user, submit_survey, surveys):
+	submit_survey(['Action', 'Sci-Fi'], ['Horror'])
+	recalculate_scores(user.id, 'survey-based', 'survey_based_score', ('survey-based',))
+
+	previous_included_genres, previous_excluded_genres = {'Action', 'Sci-Fi'}, {'Horror'}
+	for included_genres, excluded_genres in surveys:
+		calculation_needed_for = submit_survey(included_genres, excluded_genres)
+		# only the genres whose response changed are tracked, so the scores are updated incrementally
+		changed_genres = ((previous_included_genres ^ set(included_genres)) |
+		                  (previous_excluded_genres ^ set(excluded_genres)))
+		assert recommendation.survey_changed_genres[user.id] == changed_genres
+		assert bool(calculation_needed_for) == bool(changed_genres)
+		incremental_scores = recalculate_scores(user.id, 'survey-based', 'survey_based_score', calculation_needed_for)
+
+		# without the tracked changes, the scores are calculated for all movies
+		recommendation.survey_changed_genres.pop(user.id)
+		full_scores = recalculate_scores(user.id, 'survey-based', 'survey_based_score', ('survey-based',))
+		assert incremental_scores == pytest.approx(full_scores)
+		previous_included_genres, previous_excluded_genres = set(included_genres), set(excluded_genres)
@@ -0,0 +1,38 @@
+﻿from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy
+
+import movie_features
+from movie_features import get_movie_features
+
+
+def test_movie_features_are_complete_for_concurrent_threads_on_a_cold_cache(app, monkeypatch):
+	expected = get_movie_features()
+	amount_of_threads = 8
+	barrier = threading.Barrier(amount_of_threads)
+
+	def get_features():
+		with app.app_context():
+			barrier.wait()
+			return get_movie_features()
+
+	# the threads only overlap with the build now and then, so the cold start is repeated
+	for _ in range(20):
+		# start from a cold cache, like after the start of a process
+		for name in ['feature_movie_ids', 'feature_movie_index', 'genre_names', 'genre_index', 'movie_genre_matrix',
+		             'movie_genre_counts', 'movie_missing_genre', 'movie_decades', 'genre_movie_index']:
+			monkeypatch.setattr(movie_features, name, None)
+
+		# get the features in several threads at once, like the scorers of a parallel evaluation
+		with ThreadPoolExecutor(max_workers=amount_of_threads) as executor:
+			futures = [executor.submit(get_features) for _ in range(amount_of_threads)]
+			results = [future.result() for future in futures]
+
+		for movie_ids, genre_names, genre_matrix, genre_counts, missing_genre, decades in results:
+			assert numpy.array_equal(movie_ids, expected[0])
+			assert genre_names == expected[1]
+			assert (genre_matrix != expected[2]).nnz == 0
+			assert numpy.array_equal(genre_counts, expected[3])
+			assert numpy.array_equal(missing_genre, expected[4])
+			assert numpy.array_equal(decades, expected[5], equal_nan=True)
@@ -0,0 +1,78 @@
+﻿import pytest
+
+import baseline_scorers
+from get_data import get_user_preference_ratios
+from recommendation import (calculate_item_based_scores, calculate_survey_based_scores,
+                            calculate_exploration_based_scores)
+from score_storage import load_scores
+
+
+def get_saved_scores(user_id: int, score_name: str):
+	"""
+	Gets the saved scores of a score attribute of the user.
+
+	:param user_id: id of the user
+	:param score_name: name of the score attribute, e.g. 'item_based_score'
+	:return: scores - dictionary with movie ids as keys and the scores as values
+	"""
+
+	movie_ids, scores = load_scores(user_id, score_name)
+	return dict(zip(movie_ids.tolist(), scores.tolist()))
+
+
+@pytest.mark.parametrize('min_amount_of_ratings', [1, 4])
+def test_item_based_scores_match_baseline(user, min_amount_of_ratings):
+	genre_ratios, decade_ratios = get_user_preference_ratios(user.id, min_amount_of_ratings)
+	calculate_item_based_scores(user.id, genre_ratios, decade_ratios)
+
+	expected = baseline_scorers.calculate_item_based_scores(user.id, genre_ratios, decade_ratios)
+	assert get_saved_scores(user.id, 'item_based_score') == pytest.approx(expected)
+
+
+def test_item_based_scores_match_baseline_with_ignored_movies(user, ignore):
+	# one rated and one unrated movie
+	ignore(3)
+	ignore(6)
+	genre_ratios, decade_ratios = get_user_preference_ratios(user.id, 1)
+	calculate_item_based_scores(user.id, genre_ratios, decade_ratios)
+
+	expected = baseline_scorers.calculate_item_based_scores(user.id, genre_ratios, decade_ratios)
+	assert get_saved_scores(user.id, 'item_based_score') == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('included_genres, excluded_genres', [
+	(['Action', 'Sci-Fi'], ['Horror']),
+	(['Comedy', 'Drama', 'Romance'], []),
+	(['Documentary'], ['Comedy']),
+	(['Action', 'Comedy'], ['Drama']),
+	([], ['Drama']),
+])
+def test_survey_based_scores_match_baseline(user, submit_survey, included_genres, excluded_genres):
+	submit_survey(included_genres, excluded_genres)
+	calculate_survey_based_scores(user.id)
+
+	expected = baseline_scorers.calculate_survey_based_scores(user.id)
+	assert get_saved_scores(user.id, 'survey_based_score') == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('exploration_type', ['popular', 'underexplored'])
+def test_exploration_based_scores_match_baseline(user, ignore, exploration_type):
+	# a popular movie, which is still part of the popular movies after it was ignored
+	ignore(5)
+	# add the missing UserGenrePreferences entries, like the exploration-based component does
+	get_user_preference_ratios(user.id, 1)
+	calculate_exploration_based_scores(user.id, exploration_type)
+
+	expected = baseline_scorers.calculate_exploration_based_scores(user.id, exploration_type)
+	assert get_saved_scores(user.id, 'exploration_based_score') == pytest.approx(expected)
+
+
+def test_underexplored_scores_match_baseline_without_unrated_genres(user, rate):
+	# rate a movie of each genre, so that the underexplored genres are those with less than 10% of the ratings
+	for movie_id in [2, 4, 7, 10, 12, 15, 17, 18]:
+		rate(movie_id, 4.5)
+	get_user_preference_ratios(user.id, 1)
+	calculate_exploration_based_scores(user.id, 'underexplored')
+
+	expected = baseline_scorers.calculate_exploration_based_scores(user.id, 'underexplored')
+	assert get_saved_scores(user.id, 'exploration_based_score') == pytest.approx(expected)